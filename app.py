@@ -1,21 +1,64 @@
+import os
+import json
+import time
+import random
+import urllib.parse
+from datetime import datetime
 from pathlib import Path
-import io
-from flask import Flask, render_template, request, jsonify, send_file, abort, Response
-from PIL import Image, ImageOps
-from config import SECRET_KEY, MAX_CONTENT_LENGTH, EXPORT_DIR, COVER_MAX_SIZE, COVER_QUALITY
-from database import query_songs
-from export_utils import copy_songs, create_target_filename
-from audio_utils import extract_embedded_cover, get_audio_metadata
+from flask import Flask, render_template, request, jsonify, send_file, abort, Response, g, redirect, url_for
+from config import SECRET_KEY, MAX_CONTENT_LENGTH, EXPORT_DIR, SYNC_DIR, PROFILE_HEADER, COVER_REDIRECT_MAX_AGE
+from database import query_songs_page, decode_cursor
+from export_utils import create_target_filename, plan_sync, summarize_sync_plan
+from audio_utils import extract_embedded_cover, resolve_cover
+import cover_cache
+import export_jobs
+import library_watcher
+import metrics
+import sync_index
+import transcode
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = SECRET_KEY
 app.config['MAX_CONTENT_LENGTH'] = MAX_CONTENT_LENGTH
 
+# Refresh query state and covers in the background when LMS rescans
+library_watcher.start()
+
+
+@app.before_request
+def start_request_timing():
+    g.request_start = time.perf_counter()
+    if PROFILE_HEADER in request.headers:
+        metrics.start_profile()
+
+@app.after_request
+def record_request_timing(response):
+    """Observe the route's latency and add the profile of opted-in requests as Server-Timing"""
+    seconds = time.perf_counter() - g.request_start
+    # Streamed responses (ZIP downloads, event streams) are only timed until they start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.HTTP_REQUEST_SECONDS.observe(seconds, route=route, method=request.method, status=response.status_code)
+    entries = metrics.finish_profile()
+    if entries is not None:
+        response.headers['Server-Timing'] = metrics.server_timing(entries, seconds)
+    return response
+
+@app.teardown_request
+def stop_profile(exc):
+    # Requests that failed before after_request must not leak their profile into the thread's next one
+    metrics.finish_profile()
+
 
 @app.route('/')
 def index():
     """Main page"""
-    return render_template('index.html')
+    return render_template('index.html', transcode_profiles=transcode.PROFILES,
+                           default_transcode_profile=transcode.DOWNSAMPLING_PROFILE)
+
+def guess_filenames(song):
+    """Names a song may have in the sync folder (original or renamed, format agnostic)"""
+    renamed_filename = create_target_filename(Path(song['url']), song['filename'], rename_files=True)
+    return [song['filename'], renamed_filename]
 
 @app.route('/api/query', methods=['POST'])
 def api_query():
@@ -29,52 +72,35 @@ def api_query():
         album_limit = data.get('album_limit')
         order_by = data.get('order_by', 'added')
         added_before = data.get('added_before')
+        seed = data.get('seed')
+        page_size = data.get('page_size')
+        if page_size is None:
+            page_size = limit
+        cursor = data.get('cursor')
         
-        songs = query_songs(rating, limit, exclude_genres, dyn_ps_val, album_limit, order_by, added_before)
+        try:
+            if order_by == 'random':
+                # Later pages continue the shuffle of the first one
+                if cursor:
+                    seed = decode_cursor(cursor).get('seed', seed)
+                # Echoed back so the client can reproduce this shuffle
+                if seed is None:
+                    seed = random.randrange(2 ** 32)
+            songs, next_cursor = query_songs_page(rating, limit, exclude_genres, dyn_ps_val, album_limit, order_by,
+                                                  added_before, seed, page_size, cursor)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
 
 
         # Mark songs that already exist in the sync folder
-        sync_dir = Path(EXPORT_DIR) / "sync"
-
-        if sync_dir.is_dir():
-            for song in songs:
-                song['exists_in_sync'] = False
-                try:
-                    # Check renamed filename (default export behavior)
-                    source_path = Path(song['url'])
-                    renamed_filename = create_target_filename(source_path, song['filename'], rename_files=True)
-                    renamed_path = sync_dir / renamed_filename
-
-                    if renamed_path.is_file():
-                        song['exists_in_sync'] = True
-
-                    # Check original filename
-                    original_path = sync_dir / song['filename']
-                    if original_path.is_file():
-                        song['exists_in_sync'] = True
-
-                    # Additionally check for mp3 (if original file is not mp3)
-                    if source_path.suffix.lower() != '.mp3':
-                        base_name = Path(song['filename']).stem
-                        renamed_base = Path(renamed_filename).stem
-
-                        mp3_path = sync_dir / f"{base_name}.mp3"
-                        renamed_mp3_path = sync_dir / f"{renamed_base}.mp3"
-
-                        if mp3_path.is_file() or renamed_mp3_path.is_file():
-                            song['exists_in_sync'] = True
-
-                except Exception as e:
-                    print(f"[ERROR] Checking file existence: {e}")
-                
-        else:
-            for song in songs:
-                song['exists_in_sync'] = False
+        sync_index.mark_synced(songs, guess_filenames)
         
         return jsonify({
             'success': True,
             'songs': songs,
-            'count': len(songs)
+            'count': len(songs),
+            'cursor': next_cursor,
+            'seed': seed if order_by == 'random' else None
         })
     except Exception as e:
         return jsonify({
@@ -82,69 +108,62 @@ def api_query():
             'error': str(e)
         }), 500
 
+@app.route('/metrics')
+def prometheus_metrics():
+    """Prometheus metrics: route latencies, query, tag parsing, cover and export timings"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/library/status', methods=['GET'])
+def api_library_status():
+    """When the library state was last refreshed after an LMS rescan, and how long it took"""
+    return jsonify({'success': True, 'library': library_watcher.status()})
+
 @app.route('/api/sync/list', methods=['GET'])
 def api_sync_list():
-    """List audio files in the fixed sync folder"""
+    """List audio files in the fixed sync folder.
+
+    Query params: q (text filter), sort (name, artist, album, title, size or
+    modified; "-" prefix for descending), offset and page_size.
+    """
     try:
-        sync_dir = Path(EXPORT_DIR) / "sync"
-        if not sync_dir.is_dir():
-            return jsonify({'success': True, 'songs': [], 'count': 0})
+        text = request.args.get('q', '')
+        sort = request.args.get('sort', 'name')
+        offset = max(0, request.args.get('offset', 0, type=int))
+        page_size = min(max(1, request.args.get('page_size', 100, type=int)), 1000)
+        try:
+            files, total, total_bytes = sync_index.list_files(text, sort, offset, page_size)
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
 
-        allowed_exts = {'.mp3', '.flac', '.wav', '.ogg', '.opus', '.aac'}
         items = []
-        import urllib.parse
-        for path in sorted(sync_dir.iterdir(), key=lambda p: p.name):
-            if not path.is_file():
-                continue
-            ext = path.suffix.lower()
-            if ext not in allowed_exts:
-                continue
-            
-            # Extract metadata from audio file
-            metadata = get_audio_metadata(path)
-            
+        for file in files:
             # Build a song-like object to reuse renderer
-            url = str(path)
-            cover_url = f"/api/cover?path={urllib.parse.quote(url, safe='')}"
-            filesize = round(path.stat().st_size / (1024 * 1024), 0)
-            
-            # Use extracted metadata if available, otherwise fall back to filename
-            if metadata:
-                title = metadata.get('title', '') or path.stem
-                artist = metadata.get('artist', '') or 'Unknown Artist'
-                album = metadata.get('album', '') or 'Unknown Album'
-                genre = metadata.get('genre', '') or ''
-                year = metadata.get('year')
-            else:
-                # Fallback to filename-based values if metadata extraction fails
-                title = path.stem
-                artist = 'Unknown Artist'
-                album = 'Unknown Album'
-                genre = ''
-                year = None
-            
+            url = str(Path(SYNC_DIR) / file['filename'])
+            stem, ext = os.path.splitext(file['filename'])
             items.append({
                 'url': url,
-                'title': title,
-                'artist': artist,
-                'genre': genre,
+                # Fall back to filename-based values if the file has no tags
+                'title': file['title'] or stem,
+                'artist': file['artist'] or 'Unknown Artist',
+                'genre': file['genre'],
                 'rating': 0,
                 'added': None,
                 'last_played': None,
-                'year': year,
-                'album': album,
+                'year': file['year'],
+                'album': file['album'] or 'Unknown Album',
                 'dyn_ps_val': None,
-                'filename': path.name,
-                'cover_url': cover_url,
-                'filesize': filesize,
-                'filetype': path.suffix.upper().lstrip('.')
+                'filename': file['filename'],
+                'cover_url': f"/api/cover?path={urllib.parse.quote(url, safe='')}",
+                'filesize': round(file['size'] / (1024 * 1024), 0),
+                'filetype': ext.upper().lstrip('.')
             })
 
-        return jsonify({'success': True, 'songs': items, 'count': len(items)})
+        next_offset = offset + len(items) if offset + len(items) < total else None
+        return jsonify({'success': True, 'songs': items, 'count': len(items), 'total': total,
+                        'total_bytes': total_bytes, 'offset': offset, 'next_offset': next_offset})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
-
 @app.route('/api/sync/delete', methods=['POST'])
 def api_sync_delete():
     """Delete a file from the fixed sync folder"""
@@ -154,55 +173,174 @@ def api_sync_delete():
         if not filename:
             return jsonify({'success': False, 'error': 'Missing filename'}), 400
 
-        sync_dir = Path(EXPORT_DIR) / "sync"
-        target_path = (sync_dir / filename).resolve()
-        sync_dir_abs = sync_dir.resolve()
-
-        # Safety: ensure target resides in sync directory
-        try:
-            target_path.relative_to(sync_dir_abs)
-        except Exception:
+        (result,), _ = sync_index.delete_files([filename])
+        if result['error'] == 'Invalid path':
             return jsonify({'success': False, 'error': 'Invalid path'}), 400
-
-        if not target_path.is_file():
+        if result['error'] == 'File not found':
             return jsonify({'success': False, 'error': 'File not found'}), 404
-
-        target_path.unlink()
+        if not result['success']:
+            return jsonify({'success': False, 'error': result['error']}), 500
         return jsonify({'success': True})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/sync/delete/batch', methods=['POST'])
+def api_sync_delete_batch():
+    """Delete several files from the fixed sync folder in one request.
+
+    Takes either a list of filenames or filters: older_than (unix timestamp,
+    by file mtime) and/or not_in (a non-empty list of songs with url and
+    filename, e.g. the current query result; files none of them map to are
+    selected). dry_run only reports
+    what would be deleted.
+    """
+    try:
+        data = request.get_json() or {}
+        filenames = data.get('filenames')
+        older_than = data.get('older_than')
+        not_in = data.get('not_in')
+        if filenames is None and older_than is None and not_in is None:
+            return jsonify({'success': False, 'error': 'Missing filenames or filter'}), 400
+        if filenames is not None and (not isinstance(filenames, list)
+                                      or not all(isinstance(name, str) for name in filenames)):
+            return jsonify({'success': False, 'error': 'filenames must be a list of file names'}), 400
+        if older_than is not None and (isinstance(older_than, bool) or not isinstance(older_than, (int, float))):
+            return jsonify({'success': False, 'error': 'older_than must be a unix timestamp'}), 400
+        # An empty not_in would select every file of the sync folder
+        if not_in is not None and (not isinstance(not_in, list) or not not_in or not all(
+                isinstance(song, dict) and isinstance(song.get('url'), str) and isinstance(song.get('filename'), str)
+                for song in not_in)):
+            return jsonify({'success': False, 'error': 'not_in must be a non-empty list of songs with url and filename'}), 400
+
+        if filenames is None:
+            selected = None
+            if older_than is not None:
+                selected = set(sync_index.files_older_than(float(older_than)))
+            if not_in is not None:
+                unmatched = set(sync_index.files_not_matching(not_in, guess_filenames))
+                selected = unmatched if selected is None else selected & unmatched
+            filenames = sorted(selected)
+
+        results, freed_bytes = sync_index.delete_files(filenames, dry_run=data.get('dry_run', False))
+        deleted = sum(1 for result in results if result['success'])
+        return jsonify({
+            'success': True,
+            'results': results,
+            'deleted': deleted,
+            'failed': len(results) - deleted,
+            'freed_bytes': freed_bytes,
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/sync/plan', methods=['POST'])
+def api_sync_plan():
+    """Dry run of an incremental sync folder export: what would be added, updated, skipped or removed"""
+    try:
+        data = request.get_json() or {}
+        try:
+            transcode_profile = transcode.resolve_profile(data.get('transcode_profile'), data.get('song_downsampling', False))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
+        plan = plan_sync(data.get('songs', []), data.get('embed_covers', True), data.get('rename_files', True),
+                         transcode_profile, data.get('prune', False))
+        return jsonify({
+            'success': True,
+            'summary': summarize_sync_plan(plan),
+            'songs': [{'action': action, 'source': str(source), 'filename': target_filename}
+                      for action, _, source, target_filename, _ in plan['songs']],
+            'remove': plan['remove']
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
 @app.route('/api/export', methods=['POST'])
 def api_export():
-    """API endpoint to export selected songs"""
+    """API endpoint to start exporting selected songs in the background"""
     try:
         data = request.get_json()
         selected_songs = data.get('songs', [])
         export_format = data.get('format', 'folder')
         embed_covers = data.get('embed_covers', True)
         rename_files = data.get('rename_files', True)
-        song_downsampling = data.get('song_downsampling', False)
         sync_folder = data.get('sync_folder', False)
+        incremental = data.get('incremental', False)
+        prune = data.get('prune', False)
         
         if not selected_songs:
             return jsonify({
                 'success': False,
                 'error': 'No songs selected'
             }), 400
+
+        try:
+            # song_downsampling is the pre-profile switch for MP3 V0
+            transcode_profile = transcode.resolve_profile(data.get('transcode_profile'), data.get('song_downsampling', False))
+        except ValueError as e:
+            return jsonify({'success': False, 'error': str(e)}), 400
         
-        result_path = copy_songs(selected_songs, export_format, embed_covers, rename_files, song_downsampling, sync_folder)
+        if export_format == 'zip' and data.get('stream', False):
+            # The archive is generated on the fly when the download URL is requested
+            job_id = export_jobs.submit_stream_export(selected_songs, rename_files, data.get('zip64', False),
+                                                      transcode_profile)
+        else:
+            job_id = export_jobs.submit_export(selected_songs, export_format, embed_covers, rename_files, transcode_profile, sync_folder,
+                                               incremental, prune)
+        job = export_jobs.get_job(job_id)
         
         return jsonify({
             'success': True,
-            'export_path': result_path,
+            'job_id': job_id,
+            'status_url': f"/api/export/{job_id}",
+            'events_url': f"/api/export/{job_id}/events",
+            'download_url': job['download_url'],
             'format': export_format
-        })
+        }), 202
     except Exception as e:
         return jsonify({
             'success': False,
             'error': str(e)
         }), 500
 
+@app.route('/api/export/<job_id>', methods=['GET'])
+def api_export_status(job_id):
+    """Report the progress of an export job"""
+    job = export_jobs.get_job(job_id, include_results=True)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown export job'}), 404
+    return jsonify({'success': True, 'job': job})
+
+@app.route('/api/export/<job_id>/events', methods=['GET'])
+def api_export_events(job_id):
+    """Stream export job progress as Server-Sent Events until the job finishes"""
+    job = export_jobs.get_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Unknown export job'}), 404
+
+    def generate(job):
+        while job is not None:
+            yield f"data: {json.dumps(job)}\n\n"
+            if job['status'] in export_jobs.FINISHED_STATES:
+                return
+            job = export_jobs.wait_for_change(job_id, job['version'])
+
+    resp = Response(generate(job), mimetype='text/event-stream')
+    resp.headers['Cache-Control'] = 'no-cache'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
+@app.route('/api/export/<job_id>/download', methods=['GET'])
+def api_export_download(job_id):
+    """Stream the ZIP archive of a streaming export job"""
+    stream = export_jobs.stream_job(job_id)
+    if stream is None:
+        return jsonify({'error': 'Unknown export job'}), 404
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    resp = Response(stream, mimetype='application/zip')
+    resp.headers['Content-Disposition'] = f'attachment; filename="music_export_{timestamp}.zip"'
+    resp.headers['X-Accel-Buffering'] = 'no'
+    return resp
+
 @app.route('/api/download/<path:filename>')
 def download_file(filename):
     """Download exported files"""
@@ -217,53 +355,104 @@ def download_file(filename):
 
 @app.route('/api/cover')
 def api_cover():
-    """Serve album cover image for a given song file path (query param: path)"""
+    """Serve album cover image for a given song file path (query params: path, optional size)"""
     file_path = request.args.get('path')
     if not file_path:
         abort(400, description='Missing path parameter')
     song_path = Path(file_path)
     if not song_path.exists():
         abort(404, description='Song file not found')
-    parent_dir = song_path.parent
-    for cover_name in ["cover.jpg", "cover.png", "cover.jpeg", "folder.jpg", "folder.png", "folder.jpeg"]:
-        cover_path = parent_dir / cover_name
-        if cover_path.is_file():
-            try:
-                with Image.open(str(cover_path)) as img:
-                    img = ImageOps.exif_transpose(img)
-                    if img.mode not in ("RGB", "L"):
-                        img = img.convert("RGB")
-                    img.thumbnail(COVER_MAX_SIZE, Image.Resampling.LANCZOS)
-                    buf = io.BytesIO()
-                    img.save(buf, format='JPEG', quality=COVER_QUALITY, optimize=True, progressive=True)
-                    buf.seek(0)
-                resp = Response(buf.getvalue(), mimetype='image/jpeg')
-                resp.headers['Cache-Control'] = 'public, max-age=86400'
-                return resp
-            except Exception:
-                # Fallback to sending the original if resize fails
-                mimetype = 'image/png' if cover_name.endswith('.png') else 'image/jpeg'
-                return send_file(str(cover_path), mimetype=mimetype)
-    # Try extracting embedded cover from the audio file
-    img_bytes, mime = extract_embedded_cover(song_path)
-    if img_bytes and mime:
-        try:
-            with Image.open(io.BytesIO(img_bytes)) as img:
-                img = ImageOps.exif_transpose(img)
-                if img.mode not in ("RGB", "L"):
-                    img = img.convert("RGB")
-                img.thumbnail(COVER_MAX_SIZE, Image.Resampling.LANCZOS)
-                buf = io.BytesIO()
-                img.save(buf, format='JPEG', quality=COVER_QUALITY, optimize=True, progressive=True)
-                buf.seek(0)
-            resp = Response(buf.getvalue(), mimetype='image/jpeg')
-            resp.headers['Cache-Control'] = 'public, max-age=86400'
+    return _cover_response(song_path.parent)
+
+@app.route('/api/cover/album')
+def api_cover_album():
+    """Serve the cover of an album directory (query params: dir, optional size and v).
+
+    Without the current version v (see cover_cache.cover_version) this redirects
+    to the versioned URL, whose image browsers may then keep for good.
+    """
+    directory = request.args.get('dir')
+    if not directory:
+        abort(400, description='Missing dir parameter')
+    directory = Path(directory)
+    if not directory.is_dir():
+        abort(404, description='Album directory not found')
+    version = cover_cache.cover_version(directory)
+    if request.args.get('v') != version:
+        resp = redirect(url_for('api_cover_album', **dict(request.args.items(), v=version)))
+        resp.cache_control.max_age = COVER_REDIRECT_MAX_AGE
+        return resp
+    # A URL with the current version always names this image: let browsers keep it for good
+    return _cover_response(directory, immutable=True)
+
+def _cover_response(directory, immutable=False):
+    size, fmt = _requested_thumbnail()
+    resp = _cover_source_response(directory, size, fmt, immutable)
+    # The thumbnail format depends on the Accept header, so caches must key on it
+    resp.vary.add('Accept')
+    return resp
+
+def _requested_thumbnail():
+    """Return (size, format) of the thumbnail asked for: ?size= (snapped to COVER_SIZES), WebP if accepted"""
+    size = request.args.get('size', type=int, default=cover_cache.DEFAULT_SIZE)
+    if size <= 0:
+        abort(400, description='Invalid size parameter')
+    accepts_webp = any(value == 'image/webp' and quality > 0 for value, quality in request.accept_mimetypes)
+    return cover_cache.thumbnail_size(size), 'webp' if accepts_webp else 'jpeg'
+
+def _cover_source_response(directory, size, fmt, immutable):
+    kind, cover_path = resolve_cover(directory)
+    if kind == 'file':
+        resp = _cached_cover_response(cover_path, size=size, fmt=fmt, immutable=immutable)
+        if resp is not None:
+            return resp
+        # Fallback to sending the original if resize fails
+        mimetype = 'image/png' if cover_path.suffix.lower() == '.png' else 'image/jpeg'
+        return send_file(str(cover_path), mimetype=mimetype)
+    if kind == 'embedded':
+        # Embedded cover of the album (from the first of its files that has one)
+        resp = _cached_cover_response(cover_path, embedded=True, size=size, fmt=fmt, immutable=immutable)
+        if resp is not None:
             return resp
-        except Exception:
+        img_bytes, mime = extract_embedded_cover(cover_path)
+        if img_bytes and mime:
             return Response(img_bytes, mimetype=mime)
     # Fallback to default cover image
     default_cover = Path('static') / 'default-cover.png'
-    return send_file(str(default_cover), mimetype='image/png')
+    resp = send_file(str(default_cover), mimetype='image/png')
+    if immutable:
+        _cache_forever(resp)
+    return resp
+
+def _cache_forever(resp):
+    resp.cache_control.no_cache = None
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 365 * 86400
+    resp.cache_control.immutable = True
+
+def _cached_cover_response(source_path, embedded=False, size=cover_cache.DEFAULT_SIZE, fmt='jpeg', immutable=False):
+    """Serve a thumbnail from the cover cache, answering conditional requests with 304"""
+    try:
+        etag, _ = cover_cache.cache_key(source_path, size, fmt)
+        if etag in request.if_none_match:
+            resp = Response(status=304)
+            resp.set_etag(etag)
+            resp.headers['Cache-Control'] = 'public, max-age=86400'
+            if immutable:
+                _cache_forever(resp)
+            return resp
+        thumbnail = cover_cache.get_thumbnail(source_path, embedded=embedded, size=size, fmt=fmt)
+    except OSError:
+        return None
+    if thumbnail is None:
+        return None
+    thumb_path, etag, last_modified = thumbnail
+    resp = send_file(thumb_path, mimetype=cover_cache.FORMATS[fmt][1], etag=etag,
+                     last_modified=last_modified, max_age=86400, conditional=True)
+    if immutable:
+        _cache_forever(resp)
+    return resp
 
 if __name__ == '__main__':
+    metrics.clear_shared()
     app.run(host='0.0.0.0', port=5000, debug=False) 
\ No newline at end of file
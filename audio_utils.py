@@ -1,41 +1,55 @@
 import os
+import json
 import pathlib
 import base64
+import sqlite3
+import threading
+from collections import OrderedDict
 from mutagen.easyid3 import EasyID3
 from mutagen.flac import FLAC, Picture
-from mutagen import File
 from mutagen.mp3 import MP3
-from mutagen.id3 import ID3, APIC, error, ID3NoHeaderError
+from mutagen.oggopus import OggOpus
+from mutagen.id3 import ID3, APIC
+from config import METADATA_CACHE_DB, METADATA_CACHE_ENTRIES, COVER_INDEX_ENTRIES
+import metrics
 
 def get_artist_and_title(source_file):
     """Extract artist and title from music file tags"""
-    try:
-        tags = None
-        if source_file.suffix == '.mp3':
-            tags = EasyID3(str(source_file))
-        elif source_file.suffix == '.flac':
-            tags = FLAC(str(source_file))
-        
-        if tags:
-            artist = tags.get("artist", [""])[0] if "artist" in tags else ""
-            title = tags.get("title", [""])[0] if "title" in tags else ""
-            return artist, title
-    except Exception as e:
-        print(f"Error reading tags from {source_file}: {e}")
-    
+    metadata = get_audio_metadata(source_file)
+    if metadata:
+        return metadata['artist'], metadata['title']
     return None, None
 
 def get_audio_metadata(source_file):
     """Extract comprehensive metadata from music file tags.
     
     Returns a dict with: artist, title, album, year, genre, or None if extraction fails.
+    Results are memoized by (path, mtime, size), so unchanged files are only stat()ed.
     """
+    source_file = pathlib.Path(source_file)
+    try:
+        st = source_file.stat()
+    except OSError as e:
+        print(f"Error reading metadata from {source_file}: {e}")
+        return None
+
+    path = str(source_file)
+    signature = (st.st_mtime_ns, st.st_size)
+    found, metadata = _metadata_cache.get(path, signature)
+    if not found:
+        metadata = _read_audio_metadata(source_file)
+        _metadata_cache.put(path, signature, metadata)
+    return dict(metadata) if metadata is not None else None
+
+def _read_audio_metadata(source_file):
+    """Parse the tags of a music file (uncached, see get_audio_metadata)"""
     try:
         tags = None
-        if source_file.suffix == '.mp3':
-            tags = EasyID3(str(source_file))
-        elif source_file.suffix == '.flac':
-            tags = FLAC(str(source_file))
+        with metrics.timed(metrics.TAG_PARSE_SECONDS, purpose='metadata'):
+            if source_file.suffix == '.mp3':
+                tags = EasyID3(str(source_file))
+            elif source_file.suffix == '.flac':
+                tags = FLAC(str(source_file))
 
         
         if tags:
@@ -75,78 +89,149 @@ def get_audio_metadata(source_file):
     
     return None
 
-def add_mp3_cover(filename, album_art):
-    """Add cover art to MP3 file"""
-    try:
-        audio = MP3(filename, ID3=ID3)
-        
-        try:
-            audio.add_tags()
-        except error:
-            pass
-        
-        if album_art.endswith('png'):
-            mime = 'image/png'
-        else:
-            mime = 'image/jpeg'
-        
-        audio.tags.add(
-            APIC(
-                encoding=3,
-                mime=mime,
-                type=3,
-                desc=u'Cover',
-                data=open(album_art, 'rb').read()
-            )
-        )
-        audio.save()
-    except Exception as e:
-        print(f"Error adding MP3 cover: {e}")
+class MetadataCache:
+    """In-memory LRU of parsed tags backed by a SQLite sidecar file.
 
-def add_flac_cover(filename, album_art):
-    """Add cover art to FLAC file"""
-    try:
-        audio = File(filename)
-        image = Picture()
-        image.type = 3
-        
-        if album_art.endswith('png'):
-            image.mime = 'image/png'
-        else:
-            image.mime = 'image/jpeg'
-        image.desc = 'front cover'
-        
-        with open(album_art, 'rb') as f:
-            image.data = f.read()
-        
-        audio.add_picture(image)
-        audio.save()
-    except Exception as e:
-        print(f"Error adding FLAC cover: {e}")
+    Entries are keyed by path and only valid for the (mtime_ns, size)
+    signature they were read with. The sidecar survives restarts, so a
+    library is parsed once and then only stat()ed. If the sidecar can't be
+    opened (e.g. read-only export dir) the cache works in memory only.
+    """
+
+    def __init__(self, db_path, max_entries):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._con = None
+        self._db_failed = False
+
+    def _db(self):
+        if self._con is None and not self._db_failed:
+            try:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                con = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+                con.execute("PRAGMA journal_mode=WAL")
+                con.execute("PRAGMA synchronous=NORMAL")
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS metadata ("
+                    "path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, data TEXT)"
+                )
+                con.commit()
+                self._con = con
+            except Exception as e:
+                print(f"Metadata cache disabled, cannot open {self.db_path}: {e}")
+                self._db_failed = True
+        return self._con
+
+    def get(self, path, signature):
+        """Return (found, metadata) for path if cached with a matching signature"""
+        with self._lock:
+            entry = self._lru.get(path)
+            if entry is not None and entry[0] == signature:
+                self._lru.move_to_end(path)
+                return True, entry[1]
+
+            con = self._db()
+            if con is None:
+                return False, None
+            try:
+                row = con.execute(
+                    "SELECT mtime_ns, size, data FROM metadata WHERE path = ?", (path,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                print(f"Error reading metadata cache: {e}")
+                return False, None
+            if row is None or (row[0], row[1]) != signature:
+                return False, None
+            metadata = json.loads(row[2]) if row[2] is not None else None
+            self._remember(path, signature, metadata)
+            return True, metadata
+
+    def put(self, path, signature, metadata):
+        with self._lock:
+            self._remember(path, signature, metadata)
+            con = self._db()
+            if con is None:
+                return
+            try:
+                con.execute(
+                    "INSERT OR REPLACE INTO metadata (path, mtime_ns, size, data) VALUES (?, ?, ?, ?)",
+                    (path, signature[0], signature[1], json.dumps(metadata) if metadata is not None else None),
+                )
+                con.commit()
+            except sqlite3.Error as e:
+                print(f"Error writing metadata cache: {e}")
+
+    def _remember(self, path, signature, metadata):
+        self._lru[path] = (signature, metadata)
+        self._lru.move_to_end(path)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+_metadata_cache = MetadataCache(METADATA_CACHE_DB, METADATA_CACHE_ENTRIES)
+
+def picture_from_file(album_art):
+    """Read an image file into a front cover Picture"""
+    image = Picture()
+    image.type = 3
+
+    if str(album_art).endswith('png'):
+        image.mime = 'image/png'
+    else:
+        image.mime = 'image/jpeg'
+    image.desc = 'front cover'
+
+    with open(album_art, 'rb') as f:
+        image.data = f.read()
+    return image
+
+def _open_tags(file_path):
+    """Open a music file with the mutagen class matching its format, or None if unsupported"""
+    with metrics.timed(metrics.TAG_PARSE_SECONDS, purpose='open'):
+        if file_path.suffix == '.mp3':
+            return MP3(file_path, ID3=ID3)
+        elif file_path.suffix == '.flac':
+            return FLAC(file_path)
+        elif file_path.suffix == '.opus':
+            return OggOpus(file_path)
+    return None
+
+def _has_picture(audio):
+    """Check an opened music file (see _open_tags) for embedded cover art"""
+    if isinstance(audio, MP3):
+        return bool(audio.tags and audio.tags.getall('APIC'))
+    if isinstance(audio, FLAC) and audio.pictures:
+        return True
+    # VorbisComment metadata with COVERART or METADATA_BLOCK_PICTURE (FLAC and Opus)
+    return bool(audio.tags and ('coverart' in audio.tags or 'metadata_block_picture' in audio.tags))
+
+def _add_picture(audio, picture):
+    """Add a Picture to an opened music file (see _open_tags) without saving it"""
+    if isinstance(audio, MP3):
+        if audio.tags is None:
+            audio.add_tags()
+        audio.tags.add(APIC(
+            encoding=3,       # UTF-8
+            mime=picture.mime,
+            type=3,           # Cover (front)
+            desc="Cover",
+            data=picture.data
+        ))
+    elif isinstance(audio, FLAC):
+        audio.add_picture(picture)
+    else:
+        # Ogg files store pictures as base64 encoded METADATA_BLOCK_PICTURE comments
+        values = audio.tags.get('metadata_block_picture', [])
+        audio.tags['metadata_block_picture'] = values + [base64.b64encode(picture.write()).decode('ascii')]
 
 def has_embedded_cover(file_path):
     """Check if a music file already has embedded cover art"""
     file_path = pathlib.Path(file_path)
     try:
-        if file_path.suffix == '.mp3':
-            audio = MP3(file_path, ID3=ID3)
-            if audio.tags:
-                for key in audio.tags.keys():
-                    if key.startswith('APIC:'):
-                        return True
-        elif file_path.suffix == '.flac':
-            audio = FLAC(file_path)
-            # Check for VorbisComment metadata with COVERART or METADATA_BLOCK_PICTURE
-            if audio.tags:
-                # Check for COVERART field
-                if 'coverart' in audio.tags:
-                    return True
-                # Check for METADATA_BLOCK_PICTURE (base64 encoded)
-                if 'metadata_block_picture' in audio.tags:
-                    return True
-            # Also check for embedded pictures using the pictures property
-            if hasattr(audio, 'pictures') and audio.pictures:
-                return len(audio.pictures) > 0
+        audio = _open_tags(file_path)
+        if audio is not None:
+            return _has_picture(audio)
     except Exception as e:
         print(f"Error checking embedded cover in {file_path}: {e}")
     return False
@@ -158,7 +243,8 @@ def extract_embedded_cover(file_path):
     """
     try:
         if file_path.suffix == '.mp3':
-            audio = MP3(file_path, ID3=ID3)
+            with metrics.timed(metrics.TAG_PARSE_SECONDS, purpose='cover'):
+                audio = MP3(file_path, ID3=ID3)
             if audio.tags:
                 # Prefer direct APIC frames if available
                 try:
@@ -177,7 +263,8 @@ def extract_embedded_cover(file_path):
                         mime = tag.mime or 'image/jpeg'
                         return tag.data, mime
         elif file_path.suffix == '.flac':
-            flac = FLAC(file_path)
+            with metrics.timed(metrics.TAG_PARSE_SECONDS, purpose='cover'):
+                flac = FLAC(file_path)
             # First try embedded pictures list
             if hasattr(flac, 'pictures') and flac.pictures:
                 pic = flac.pictures[0]
@@ -205,74 +292,166 @@ def extract_embedded_cover(file_path):
         print(f"Error extracting embedded cover from {file_path}: {e}")
     return None, None
 
-def copy_meatdata(source, target):
-    """copy metadata as well as the cover (if present) from flac to mp3
+def read_source_tags(source):
+    """Read the tags, pictures and length of a FLAC file with a single open.
+
+    Returns (tags, pictures, length) with tags as a {key: [values]} dict
+    and length in seconds.
     """
-    # Read tags and cover art from the FLAC file
-    flac_tags = FLAC(source)
+    with metrics.timed(metrics.TAG_PARSE_SECONDS, purpose='source_tags'):
+        flac = FLAC(source)
+    tags = flac.tags.as_dict() if flac.tags else {}
+    return tags, list(flac.pictures), flac.info.length
 
-    # Write tags to the new MP3 file
-    mp3 = EasyID3(target)
+def write_tags(target, tags, pictures):
+    """Replace the tags of a converted file (mp3 or opus) with tags and pictures, saving it once.
 
-    # Remove "encodersettings" field (added by LAME)
-    if "encoder" in mp3:
-        print("remove encodersettings")
-        del mp3["encoder"]
+    Whatever the encoder wrote (e.g. the TSSE/ENCODER fields) is dropped.
+    """
+    suffix = pathlib.Path(target).suffix.lower()
+    if suffix == '.mp3':
+        # Build the whole ID3 tag in memory; EasyID3's key mappings turn Vorbis names into frames
+        audio = ID3()
+        for key, values in tags.items():
+            setter = EasyID3.Set.get(key.lower())
+            if setter is not None:
+                setter(audio, key.lower(), values)
+        for picture in pictures:
+            audio.add(APIC(
+                encoding=3,       # UTF-8
+                mime=picture.mime,
+                type=3,           # Cover (front)
+                desc="Cover",
+                data=picture.data
+            ))
+        audio.save(target)
+    elif suffix == '.opus':
+        # Opus uses Vorbis comments like FLAC, so every tag maps one to one
+        audio = OggOpus(target)
+        audio.tags.clear()
+        for key, values in tags.items():
+            audio.tags[key] = values
+        for picture in pictures:
+            _add_picture(audio, picture)
+        audio.save()
+    else:
+        raise ValueError(f"Cannot copy metadata to {suffix} files")
 
-    # Only copy keys that EasyID3 supports
-    valid_keys = set(EasyID3.valid_keys.keys())
-    for key, value in flac_tags.tags.items():
-        key_lower = key.lower()
-        if key_lower in valid_keys:
-            mp3[key_lower] = value
-    mp3.save()
+def copy_meatdata(source, target, cover_file=None, source_tags=None):
+    """copy metadata as well as the cover from flac to the converted file (mp3 or opus)
 
+    The FLAC's pictures are used, or cover_file if it has none. The source
+    is opened once (not at all if source_tags, from read_source_tags, is
+    given) and the target written once.
+    """
+    tags, pictures, _ = read_source_tags(source) if source_tags is None else source_tags
+    if not pictures and cover_file is not None:
+        pictures = [picture_from_file(cover_file)]
+    write_tags(target, tags, pictures)
 
-    try:
-        mp3_id3 = ID3(target)
-    except ID3NoHeaderError:
-        mp3_id3 = ID3()
 
-    # Delete the TSSE frame (encoder) added by lame
-    if 'TSSE' in mp3_id3:
-        del mp3_id3['TSSE']
+# Cover image file names, in order of preference (matched case-insensitively)
+COVER_NAMES = ["cover.jpg", "cover.png", "cover.jpeg", "folder.jpg", "folder.png", "folder.jpeg"]
 
-    # Add cover art (if present)
-    for picture in flac_tags.pictures:
-        mp3_id3.add(APIC(
-            encoding=3,       # UTF-8
-            mime=picture.mime,
-            type=3,           # Cover (front)
-            desc="Cover",
-            data=picture.data
-        ))
-    mp3_id3.save()
+# Files checked for embedded art when an album directory has no cover file
+_EMBEDDED_COVER_EXTENSIONS = ('.mp3', '.flac', '.opus')
 
+# Marks an index entry whose embedded art hasn't been looked for yet
+_UNKNOWN = object()
+
+class CoverIndex:
+    """Remembers which cover each album directory uses.
+
+    A directory is listed once (a single os.scandir) to find its cover
+    file; if it has none, its audio files are checked for embedded art
+    the first time that is asked for. Entries are kept until the
+    directory's mtime changes (files added, removed or renamed), so a grid
+    of songs from a few albums costs a few directory scans instead of
+    several stat() calls and a tag parse per song.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry(self, directory):
+        """Return the up to date index entry of a directory (call with lock held)"""
+        key = str(directory)
+        mtime_ns = os.stat(key).st_mtime_ns
+        entry = self._lru.get(key)
+        if entry is None or entry['mtime_ns'] != mtime_ns:
+            entry = {'mtime_ns': mtime_ns, 'file': None, 'embedded': _UNKNOWN, 'audio': []}
+            ranks = {name: rank for rank, name in enumerate(COVER_NAMES)}
+            best = len(COVER_NAMES)
+            with os.scandir(key) as entries:
+                for dir_entry in entries:
+                    name = dir_entry.name.casefold()
+                    if name in ranks and ranks[name] < best and dir_entry.is_file():
+                        best = ranks[name]
+                        entry['file'] = pathlib.Path(dir_entry.path)
+                    elif os.path.splitext(name)[1] in _EMBEDDED_COVER_EXTENSIONS:
+                        entry['audio'].append(dir_entry.path)
+            entry['audio'].sort()
+            self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+        return entry
+
+    def cover_file(self, directory):
+        """Return the cover image file of a directory or None"""
+        with self._lock:
+            try:
+                return self._entry(directory)['file']
+            except OSError:
+                return None
+
+    def resolve(self, directory):
+        """Return ('file', image path), ('embedded', audio file with art) or ('none', None)"""
+        with self._lock:
+            try:
+                entry = self._entry(directory)
+            except OSError:
+                return 'none', None
+        if entry['file'] is not None:
+            return 'file', entry['file']
+        if entry['embedded'] is _UNKNOWN:
+            # The first file with a picture stands for the whole album (parsed outside the lock)
+            entry['embedded'] = next(
+                (pathlib.Path(path) for path in entry['audio'] if has_embedded_cover(path)), None)
+        if entry['embedded'] is not None:
+            return 'embedded', entry['embedded']
+        return 'none', None
+
+_cover_index = CoverIndex(COVER_INDEX_ENTRIES)
+
+def find_cover_file(directory):
+    """Return the cover image file of an album directory or None"""
+    return _cover_index.cover_file(directory)
+
+def resolve_cover(directory):
+    """Return where the cover of an album directory comes from (see CoverIndex.resolve)"""
+    return _cover_index.resolve(directory)
 
 def embed_cover(source_path, target):
-    """Embed cover art into music file if no cover is already embedded"""
+    """Embed cover art into music file if no cover is already embedded.
+
+    The target is opened once and saved at most once.
+    """
     target = pathlib.Path(target)
-    # Check if target file already has embedded cover
-    if has_embedded_cover(target):
-        return  # Skip if cover is already embedded
-    
-    cover = None
-    
+
     # Look for cover files in the same directory
-    parent_dir = source_path.parent
-    for cover_name in ["cover.jpg", "cover.png", "cover.jpeg"]:
-        cover_path = parent_dir / cover_name
-        if cover_path.is_file():
-            cover = cover_path
-            break
-    
+    cover = find_cover_file(source_path.parent)
     if cover is None:
         return
-    
+
     try:
-        if target.suffix == '.mp3':
-            add_mp3_cover(target, str(cover))
-        elif target.suffix == '.flac':
-            add_flac_cover(target, str(cover))
+        audio = _open_tags(target)
+        # Skip if cover is already embedded
+        if audio is None or _has_picture(audio):
+            return
+        _add_picture(audio, picture_from_file(cover))
+        audio.save()
     except Exception as e:
-        print(f"Error embedding cover: {e}") 
\ No newline at end of file
+        print(f"Error embedding cover: {e}")
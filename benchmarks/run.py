@@ -0,0 +1,331 @@
+"""Time the hot paths of LMS Mixtape against synthetic libraries and store the results as JSON.
+
+    python benchmarks/run.py --tracks 10000 100000 500000 --output results.json
+    python benchmarks/run.py --tracks 10000 --compare results.json
+
+Each library size runs in its own interpreter (so caches start cold) with
+the app pointed at a generated library in a scratch directory. Covered:
+song queries per ordering and album limit (SQLite and snapshot), /api/query,
+/api/cover cold and warm, /api/sync/list, and folder exports with and
+without FLAC conversion (skipped if flac/lame aren't installed). Query plans
+are checked too: the exit status is 1 if a check fails or, with --compare,
+if a median got slower than --threshold allows.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+
+QUERY_FILTERS = {'rating': 40, 'exclude_genres': ['Christmas', 'Score'], 'dyn_ps_val': None, 'added_before': None}
+
+
+def timed(fn, repeat=5, warmup=0):
+    """Call fn repeat times and return timing statistics in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        'runs': len(samples),
+        'min_ms': round(samples[0], 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'max_ms': round(samples[-1], 3),
+    }
+
+
+def configure(workdir, lms_dir):
+    """Point the app's configuration at the scratch directory (before any app module is imported)"""
+    import config
+    config.LMS_DB_DIR = lms_dir
+    config.EXPORT_DIR = os.path.join(workdir, 'exports')
+    config.SYNC_DIR = os.path.join(config.EXPORT_DIR, 'sync')
+    config.CACHE_DIR = os.path.join(config.EXPORT_DIR, '.cache')
+    config.COVER_CACHE_DIR = os.path.join(config.CACHE_DIR, 'covers')
+    config.METADATA_CACHE_DB = os.path.join(config.CACHE_DIR, 'metadata.db')
+    config.SYNC_MANIFEST_DB = os.path.join(config.CACHE_DIR, 'sync.db')
+    config.TRANSCODE_CACHE_DIR = os.path.join(config.CACHE_DIR, 'transcode')
+    config.ENCODER_SLOTS_DIR = os.path.join(config.CACHE_DIR, 'encoder_slots')
+    config.METRICS_DIR = os.path.join(config.CACHE_DIR, 'metrics')
+    config.EXPORT_JOBS_DB = os.path.join(config.CACHE_DIR, 'jobs.db')
+    config.LIBRARY_WATCHER_LOCK = os.path.join(config.CACHE_DIR, 'library_watcher.lock')
+    config.LIBRARY_STATUS_FILE = os.path.join(config.CACHE_DIR, 'library_status.json')
+    config.LIBRARY_POLL_SECONDS = 0
+    config.PUID = config.PGID = None
+    os.makedirs(config.SYNC_DIR, exist_ok=True)
+
+
+def check_query_plans(database):
+    """EXPLAIN the song queries: no temporary B-tree for GROUP BY, no full scan of genre_track"""
+    checks = {}
+    with database.lms_connection() as con:
+        has_alternativeplaycount = database._pool.schema(con)['has_alternativeplaycount']
+        queries = {}
+        for order_by in ('added', 'last_played'):
+            for album_limit in (None, 2):
+                queries[f"songs_{order_by}_album_limit_{album_limit}"] = database.build_song_query(
+                    has_alternativeplaycount, QUERY_FILTERS['rating'], 100, QUERY_FILTERS['exclude_genres'],
+                    None, album_limit, order_by)
+        queries['primary_genres'] = (
+            "SELECT genre_track.track, MIN(genres.name) FROM genre_track JOIN genres ON genre_track.genre = genres.id "
+            "WHERE genre_track.track IN (1, 2, 3) GROUP BY genre_track.track", [])
+        for name, (query, params) in queries.items():
+            plan = [row[-1] for row in con.execute("EXPLAIN QUERY PLAN " + query, params)]
+            problems = [line for line in plan
+                        if 'USE TEMP B-TREE FOR GROUP BY' in line or line.startswith('SCAN genre_track')]
+            checks[name] = {'passed': not problems, 'problems': problems, 'plan': plan}
+    return checks
+
+
+def bench_queries(database, repeat):
+    results = {}
+    start = time.perf_counter()
+    database.refresh_query_state()
+    results['snapshot_build'] = {'runs': 1, 'median_ms': round((time.perf_counter() - start) * 1000, 3)}
+    for backend in ('sql', 'snapshot'):
+        database.LMS_TRACK_SNAPSHOT = backend == 'snapshot'
+        for order_by in ('added', 'last_played', 'random'):
+            for album_limit in (None, 2):
+                def first_page():
+                    database.query_songs_page(limit=1000, album_limit=album_limit, order_by=order_by, seed=1,
+                                              page_size=100, **QUERY_FILTERS)
+
+                def fifth_page():
+                    cursor = None
+                    for _ in range(5):
+                        _, cursor = database.query_songs_page(limit=1000, album_limit=album_limit, order_by=order_by,
+                                                              seed=1, page_size=100, cursor=cursor, **QUERY_FILTERS)
+                results[f"query_{backend}_{order_by}_album_limit_{album_limit}"] = timed(first_page, repeat, warmup=1)
+                results[f"query_{backend}_{order_by}_album_limit_{album_limit}_5_pages"] = timed(fifth_page, repeat)
+    database.LMS_TRACK_SNAPSHOT = True
+    return results
+
+
+def bench_api_query(client, repeat):
+    body = dict(QUERY_FILTERS, limit=100, order_by='added', album_limit=2)
+    return {'api_query': timed(lambda: client.post('/api/query', json=body), repeat, warmup=1)}
+
+
+def bench_covers(client, audio_utils, cover_cache, config, album_tracks, repeat):
+    """Request the cover of each album with files: cold (no thumbnails, new cover index), then warm"""
+    def request_all(headers=None):
+        for path in album_tracks:
+            client.get('/api/cover', query_string={'path': path}, headers=headers or {})
+
+    def cold():
+        shutil.rmtree(config.COVER_CACHE_DIR, ignore_errors=True)
+        cover_cache._cache._total_bytes = None
+        audio_utils._cover_index = audio_utils.CoverIndex(config.COVER_INDEX_ENTRIES)
+        request_all()
+
+    per_album = max(1, len(album_tracks))
+    results = {'cover_cold_all_albums': timed(cold, max(1, repeat // 2)),
+               'cover_warm_all_albums': timed(request_all, repeat, warmup=1)}
+    etags = {}
+    for path in album_tracks:
+        etags[path] = client.get('/api/cover', query_string={'path': path}).headers.get('ETag')
+
+    def revalidate():
+        for path in album_tracks:
+            client.get('/api/cover', query_string={'path': path}, headers={'If-None-Match': etags[path] or ''})
+    results['cover_revalidate_all_albums'] = timed(revalidate, repeat)
+    for name in list(results):
+        results[name]['albums'] = per_album
+    return results
+
+
+def bench_exports(export_utils, transcode, config, songs, repeat):
+    """Folder exports of every generated file, original and (if the tools exist) converted to MP3"""
+    results = {}
+
+    def export_original():
+        export_path, _ = export_utils.copy_songs(songs, 'folder', embed_covers=True, rename_files=True)
+        shutil.rmtree(export_path, ignore_errors=True)
+    results['export_folder_original'] = timed(export_original, max(1, repeat // 2))
+
+    if shutil.which('flac') and shutil.which('lame'):
+        def export_converted():
+            export_path, _ = export_utils.copy_songs(songs, 'folder', embed_covers=True, rename_files=True,
+                                                     transcode_profile=transcode.DOWNSAMPLING_PROFILE)
+            shutil.rmtree(export_path, ignore_errors=True)
+
+        def export_converted_cold():
+            shutil.rmtree(config.TRANSCODE_CACHE_DIR, ignore_errors=True)
+            transcode._cache._total_bytes = None
+            export_converted()
+        results['export_folder_mp3_v0_cold'] = timed(export_converted_cold, 1)
+        results['export_folder_mp3_v0_cached'] = timed(export_converted, max(1, repeat // 2))
+    else:
+        results['export_folder_mp3_v0_cold'] = {'skipped': 'flac and lame are not installed'}
+        results['export_folder_mp3_v0_cached'] = {'skipped': 'flac and lame are not installed'}
+
+    # Fill the sync folder for the listing benchmark
+    start = time.perf_counter()
+    export_utils.copy_songs(songs, 'folder', embed_covers=False, rename_files=True, sync_folder=True)
+    results['export_sync_folder'] = {'runs': 1, 'median_ms': round((time.perf_counter() - start) * 1000, 3)}
+    for name in results:
+        results[name]['songs'] = len(songs)
+    return results
+
+
+def bench_sync_list(client, repeat):
+    results = {'sync_list_first_call': timed(lambda: client.get('/api/sync/list'), 1)}
+    results['sync_list'] = timed(lambda: client.get('/api/sync/list'), repeat)
+    results['sync_list_sorted_filtered'] = timed(
+        lambda: client.get('/api/sync/list', query_string={'q': 'track', 'sort': '-modified'}), repeat)
+    return results
+
+
+def run_size(tracks, workdir, repeat, albums_with_files):
+    """Generate a library of the given size and benchmark it in this interpreter; returns the results"""
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCHMARKS_DIR)
+    from synthetic_library import generate
+
+    start = time.perf_counter()
+    lms_dir, music_dir = generate(workdir, tracks, albums_with_files)
+    generate_seconds = time.perf_counter() - start
+    configure(workdir, lms_dir)
+
+    import config
+    import database
+    import audio_utils
+    import cover_cache
+    import export_utils
+    import transcode
+    from app import app
+
+    client = app.test_client()
+    songs = []
+    album_tracks = []
+    for directory, _, files in sorted(os.walk(music_dir)):
+        audio_files = sorted(f for f in files if f.endswith(('.flac', '.mp3')))
+        if audio_files:
+            album_tracks.append(os.path.join(directory, audio_files[0]))
+        songs.extend({'url': os.path.join(directory, f), 'filename': f} for f in audio_files)
+
+    results = {}
+    results.update(bench_queries(database, repeat))
+    results.update(bench_api_query(client, repeat))
+    results.update(bench_covers(client, audio_utils, cover_cache, config, album_tracks, repeat))
+    results.update(bench_exports(export_utils, transcode, config, songs, repeat))
+    results.update(bench_sync_list(client, repeat))
+    return {
+        'tracks': tracks,
+        'generate_seconds': round(generate_seconds, 3),
+        'results': results,
+        'checks': check_query_plans(database),
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print median changes against a baseline run; returns the names of regressions"""
+    regressions = []
+    for size, run in current['sizes'].items():
+        base_run = baseline.get('sizes', {}).get(size)
+        if base_run is None:
+            print(f"{size} tracks: not in baseline")
+            continue
+        print(f"{size} tracks:")
+        for name, result in run['results'].items():
+            base = base_run['results'].get(name, {})
+            if 'median_ms' not in result or not base.get('median_ms'):
+                continue
+            ratio = result['median_ms'] / base['median_ms']
+            flag = ''
+            # Single samples (first calls, cold runs) are too noisy to fail on
+            if ratio > 1 + threshold and result['runs'] > 1:
+                flag = '  REGRESSION'
+                regressions.append(f"{size}/{name}")
+            print(f"  {name:55} {base['median_ms']:10.2f} -> {result['median_ms']:10.2f} ms  x{ratio:.2f}{flag}")
+    return regressions
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--tracks', type=int, nargs='+', default=[10000], help='library sizes, e.g. 10000 100000 500000')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--albums-with-files', type=int, default=30)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON file of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown against --compare (0.25 = 25%%)')
+    parser.add_argument('--workdir', help='scratch directory (default: a temporary one, removed afterwards)')
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single is not None:
+        # Child process: benchmark one size and print the results
+        result = run_size(args.single, args.workdir, args.repeat, args.albums_with_files)
+        print(json.dumps(result))
+        return 0
+
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': _git_revision(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'tools': {tool: shutil.which(tool) is not None for tool in ('flac', 'lame', 'opusenc')},
+        'sizes': {},
+    }
+    failed_checks = []
+    for tracks in args.tracks:
+        workdir = os.path.join(args.workdir, str(tracks)) if args.workdir else tempfile.mkdtemp(prefix='lms-bench-')
+        os.makedirs(workdir, exist_ok=True)
+        try:
+            print(f"Benchmarking {tracks} tracks in {workdir}", file=sys.stderr)
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--single', str(tracks),
+                                   '--workdir', workdir, '--repeat', str(args.repeat),
+                                   '--albums-with-files', str(args.albums_with_files)],
+                                  stdout=subprocess.PIPE, check=True, text=True)
+            run = json.loads(proc.stdout.strip().splitlines()[-1])
+        finally:
+            if not args.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+        report['sizes'][str(tracks)] = run
+        failed_checks += [f"{tracks}/{name}: {check['problems']}" for name, check in run['checks'].items()
+                          if not check['passed']]
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    for size, run in report['sizes'].items():
+        print(f"{size} tracks:")
+        for name, result in run['results'].items():
+            print(f"  {name:55} " + (f"{result['median_ms']:10.2f} ms" if 'median_ms' in result else result['skipped']))
+
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.threshold)
+    for problem in failed_checks:
+        print(f"Query plan check failed: {problem}")
+    return 1 if failed_checks or regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
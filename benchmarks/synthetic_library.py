@@ -0,0 +1,235 @@
+"""Generate a synthetic LMS library: persist.db/library.db and a tree of small audio files.
+
+The databases have the tables and columns LMS Mixtape reads (tracks,
+tracks_persistent, genres, genre_track, contributors, contributor_track,
+albums and optionally alternativeplaycount), with LMS's indexes and a
+plausible distribution of ratings, play dates and genres. Only the first
+albums get actual files, so large libraries stay cheap to generate.
+
+    python benchmarks/synthetic_library.py /tmp/lms-bench --tracks 100000
+"""
+import io
+import os
+import sys
+import random
+import shutil
+import sqlite3
+import argparse
+import subprocess
+import urllib.parse
+from PIL import Image
+from mutagen.flac import FLAC, Picture
+from mutagen.id3 import ID3, TIT2, TPE1, TALB, TCON, APIC
+
+GENRES = ['Rock', 'Pop', 'Jazz', 'Classical', 'Electronic', 'Hip-Hop', 'Folk', 'Blues', 'Metal', 'Soul',
+          'Reggae', 'Country', 'Ambient', 'Soundtrack', 'Score', 'Indie', 'Punk', 'Funk', 'Latin', 'World',
+          'Christmas', 'Disco', 'House', 'Techno', 'Trance', 'Gospel', 'Opera', 'Swing', 'Grunge', 'Ska']
+TRACKS_PER_ALBUM = 11
+TRACKS_PER_ARTIST = 40
+
+LIBRARY_SCHEMA = '''
+CREATE TABLE tracks (id INTEGER PRIMARY KEY, url TEXT NOT NULL, title TEXT, titlesort TEXT, audio INTEGER,
+                     content_type TEXT, musicbrainz_id TEXT, primary_artist INTEGER, album INTEGER,
+                     tracknum INTEGER, year INTEGER, secs REAL, filesize INTEGER, timestamp INTEGER);
+CREATE UNIQUE INDEX trackURLIndex ON tracks (url);
+CREATE INDEX trackAlbumIndex ON tracks (album);
+CREATE INDEX trackMusicBrainzIndex ON tracks (musicbrainz_id);
+CREATE TABLE albums (id INTEGER PRIMARY KEY, title TEXT, titlesort TEXT, contributor INTEGER, year INTEGER);
+CREATE TABLE contributors (id INTEGER PRIMARY KEY, name TEXT, namesort TEXT);
+CREATE TABLE contributor_track (role INTEGER, contributor INTEGER, track INTEGER, PRIMARY KEY (role, contributor, track));
+CREATE INDEX contributor_trackTrackIndex ON contributor_track (track);
+CREATE TABLE genres (id INTEGER PRIMARY KEY, name TEXT, namesort TEXT);
+CREATE TABLE genre_track (genre INTEGER, track INTEGER, PRIMARY KEY (genre, track));
+CREATE INDEX genre_trackTrackIndex ON genre_track (track);
+'''
+
+PERSIST_SCHEMA = '''
+CREATE TABLE tracks_persistent (id INTEGER PRIMARY KEY, url TEXT NOT NULL, musicbrainz_id TEXT, added INTEGER,
+                                rating INTEGER, playCount INTEGER, lastPlayed INTEGER);
+CREATE INDEX trackPersistentURLIndex ON tracks_persistent (url);
+CREATE INDEX trackPersistentMBIndex ON tracks_persistent (musicbrainz_id);
+'''
+
+APC_SCHEMA = '''
+CREATE TABLE alternativeplaycount (url TEXT NOT NULL, playCount INTEGER, skipCount INTEGER, dynPSval INTEGER);
+CREATE INDEX apcURLIndex ON alternativeplaycount (url);
+'''
+
+
+def track_path(music_dir, album_id, track_number, extension):
+    return os.path.join(music_dir, f"Artist {album_id % 997}", f"Album {album_id}", f"{track_number:02d} Track{extension}")
+
+
+def generate_databases(lms_dir, music_dir, tracks=10000, alternativeplaycount=True, seed=1):
+    """Write prefs/persist.db and cache/library.db for a library of tracks songs under music_dir"""
+    rng = random.Random(seed)
+    os.makedirs(os.path.join(lms_dir, 'prefs'), exist_ok=True)
+    os.makedirs(os.path.join(lms_dir, 'cache'), exist_ok=True)
+    persist_path = os.path.join(lms_dir, 'prefs', 'persist.db')
+    library_path = os.path.join(lms_dir, 'cache', 'library.db')
+    for path in (persist_path, library_path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    library = sqlite3.connect(library_path)
+    persist = sqlite3.connect(persist_path)
+    library.executescript(LIBRARY_SCHEMA)
+    persist.executescript(PERSIST_SCHEMA)
+    if alternativeplaycount:
+        persist.executescript(APC_SCHEMA)
+
+    albums = (tracks + TRACKS_PER_ALBUM - 1) // TRACKS_PER_ALBUM
+    artists = max(1, tracks // TRACKS_PER_ARTIST)
+    library.executemany("INSERT INTO genres VALUES (?, ?, ?)", [(i, g, g.upper()) for i, g in enumerate(GENRES, 1)])
+    library.executemany("INSERT INTO contributors VALUES (?, ?, ?)",
+                        [(i, f"Artist {i}", f"ARTIST {i}") for i in range(1, artists + 1)])
+    library.executemany("INSERT INTO albums VALUES (?, ?, ?, ?, ?)",
+                        [(i, f"Album {i}", f"ALBUM {i}", rng.randint(1, artists), 1960 + i % 60)
+                         for i in range(1, albums + 1)])
+
+    track_rows, genre_rows, contributor_rows, persistent_rows, apc_rows = [], [], [], [], []
+    added = 1_400_000_000
+    for track_id in range(1, tracks + 1):
+        album_id = (track_id - 1) // TRACKS_PER_ALBUM + 1
+        number = (track_id - 1) % TRACKS_PER_ALBUM + 1
+        # One FLAC album out of three is MP3 instead
+        extension = '.mp3' if album_id % 3 == 0 else '.flac'
+        url = 'file://' + urllib.parse.quote(track_path(music_dir, album_id, number, extension))
+        artist = rng.randint(1, artists)
+        # Albums are imported in batches, so many tracks share their added time
+        if number == 1 and rng.random() < 0.3:
+            added += rng.randint(60, 86400 * 7)
+        mbid = f"{track_id:08x}-0000-4000-8000-{album_id:012x}"
+        track_rows.append((track_id, url, f"Track {track_id}", f"TRACK {track_id}", 1,
+                           extension[1:], mbid, artist, album_id, number, 1960 + album_id % 60,
+                           rng.uniform(120, 420), rng.randint(3_000_000, 40_000_000), added))
+        genre_ids = rng.sample(range(1, len(GENRES) + 1), rng.choice([1, 1, 1, 2, 3]))
+        genre_rows.extend((genre_id, track_id) for genre_id in genre_ids)
+        contributor_rows.append((1, artist, track_id))
+        contributor_rows.append((5, artist, track_id))
+        last_played = None if rng.random() < 0.4 else added + rng.randint(0, 86400 * 365)
+        persistent_rows.append((track_id, url, mbid, added, rng.choice([0, 0, 0, 20, 40, 60, 60, 80, 100]),
+                                rng.randint(0, 50), last_played))
+        if alternativeplaycount:
+            apc_rows.append((url, rng.randint(0, 50), rng.randint(0, 10), rng.randint(-100, 100)))
+
+    library.executemany("INSERT INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", track_rows)
+    library.executemany("INSERT INTO genre_track VALUES (?, ?)", genre_rows)
+    library.executemany("INSERT OR IGNORE INTO contributor_track VALUES (?, ?, ?)", contributor_rows)
+    persist.executemany("INSERT INTO tracks_persistent VALUES (?, ?, ?, ?, ?, ?, ?)", persistent_rows)
+    if alternativeplaycount:
+        persist.executemany("INSERT INTO alternativeplaycount VALUES (?, ?, ?, ?)", apc_rows)
+    for con in (library, persist):
+        con.commit()
+        con.execute("ANALYZE")
+        con.close()
+    return persist_path, library_path
+
+
+def _cover_bytes(album_id, size=1000):
+    img = Image.new('RGB', (size, size), ((album_id * 37) % 256, (album_id * 91) % 256, (album_id * 53) % 256))
+    buf = io.BytesIO()
+    img.save(buf, format='JPEG', quality=90)
+    return buf.getvalue()
+
+
+def _silence(seconds):
+    return b'\0' * (44100 * 4 * seconds)
+
+
+def _write_flac(path, seconds):
+    """Encode silence with the flac tool, or write a header-only FLAC that mutagen can parse"""
+    if shutil.which('flac'):
+        subprocess.run(["flac", "-s", "-f", "--force-raw-format", "--endian=little", "--sign=signed", "--channels=2",
+                        "--bps=16", "--sample-rate=44100", "-o", path, "-"], input=_silence(seconds), check=True)
+        return
+    samples = 44100 * seconds
+    streaminfo = (4096).to_bytes(2, 'big') * 2 + b'\0' * 6
+    streaminfo += ((44100 << 44) | (1 << 41) | (15 << 36) | samples).to_bytes(8, 'big') + b'\0' * 16
+    with open(path, 'wb') as f:
+        f.write(b'fLaC' + bytes([0x80]) + len(streaminfo).to_bytes(3, 'big') + streaminfo)
+
+
+def _write_mp3(path, seconds):
+    """Encode silence with lame, or write silent MPEG frames"""
+    if shutil.which('lame'):
+        subprocess.run(["lame", "-S", "-r", "--little-endian", "-s", "44.1", "-", path],
+                       input=_silence(seconds), check=True)
+        return
+    frame = b'\xff\xfb\x90\x00' + b'\0' * 413  # MPEG-1 Layer III, 128 kbps, 44.1 kHz
+    with open(path, 'wb') as f:
+        f.write(frame * (seconds * 38))
+
+
+def generate_files(music_dir, tracks=10000, albums=50, seconds=2):
+    """Write the audio files of the first albums of the library, with covers.
+
+    Two albums out of three have a cover.jpg, every fifth has its cover
+    embedded in the files instead and the others have none.
+    """
+    written = 0
+    for album_id in range(1, albums + 1):
+        extension = '.mp3' if album_id % 3 == 0 else '.flac'
+        cover = _cover_bytes(album_id)
+        for number in range(1, TRACKS_PER_ALBUM + 1):
+            if (album_id - 1) * TRACKS_PER_ALBUM + number > tracks:
+                return written
+            path = track_path(music_dir, album_id, number, extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tags = {'title': f"Track {(album_id - 1) * TRACKS_PER_ALBUM + number}", 'artist': f"Artist {album_id % 997}",
+                    'album': f"Album {album_id}", 'genre': GENRES[album_id % len(GENRES)]}
+            embedded = album_id % 5 == 0
+            if extension == '.flac':
+                _write_flac(path, seconds)
+                audio = FLAC(path)
+                audio.update(tags)
+                if embedded:
+                    picture = Picture()
+                    picture.type = 3
+                    picture.mime = 'image/jpeg'
+                    picture.data = cover
+                    audio.add_picture(picture)
+                audio.save()
+            else:
+                _write_mp3(path, seconds)
+                id3 = ID3()
+                id3.add(TIT2(encoding=3, text=tags['title']))
+                id3.add(TPE1(encoding=3, text=tags['artist']))
+                id3.add(TALB(encoding=3, text=tags['album']))
+                id3.add(TCON(encoding=3, text=tags['genre']))
+                if embedded:
+                    id3.add(APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover', data=cover))
+                id3.save(path)
+            written += 1
+        if not embedded and album_id % 3 != 2:
+            with open(os.path.join(os.path.dirname(path), 'cover.jpg'), 'wb') as f:
+                f.write(cover)
+    return written
+
+
+def generate(directory, tracks=10000, albums_with_files=50, alternativeplaycount=True, seed=1):
+    """Generate a library under directory (lms/ for the databases, music/ for the files); returns their paths"""
+    lms_dir = os.path.join(directory, 'lms')
+    music_dir = os.path.join(directory, 'music')
+    generate_databases(lms_dir, music_dir, tracks, alternativeplaycount, seed)
+    if os.path.exists(music_dir):
+        shutil.rmtree(music_dir)
+    generate_files(music_dir, tracks, albums_with_files)
+    return lms_dir, music_dir
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--tracks', type=int, default=10000)
+    parser.add_argument('--albums-with-files', type=int, default=50)
+    parser.add_argument('--no-alternativeplaycount', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args(argv)
+    lms_dir, music_dir = generate(args.directory, args.tracks, args.albums_with_files,
+                                  not args.no_alternativeplaycount, args.seed)
+    print(f"LMS databases in {lms_dir}, audio files in {music_dir}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,9 +4,56 @@ import secrets
 # Configuration
 LMS_DB_DIR = '/config'
 EXPORT_DIR = '/exports'
+SYNC_DIR = os.path.join(EXPORT_DIR, 'sync')
 PUID = os.environ.get('PUID')
 PGID = os.environ.get('PGID')
 SECRET_KEY = os.environ.get('SECRET_KEY', secrets.token_hex(32))
 MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size 
 COVER_MAX_SIZE = (256,256)
-COVER_QUALITY = 85
\ No newline at end of file
+COVER_QUALITY = 85
+# Cover thumbnail widths clients may ask for (?size=), and the WebP quality used when they accept it
+COVER_SIZES = (64, 128, 256, 512)
+COVER_WEBP_QUALITY = 80
+# Sizes rendered ahead of time for new albums: what the 96px song list picks on 1x and 2x screens
+COVER_WARM_SIZES = (128, 256)
+# Seconds browsers may reuse the redirect from an album's cover URL to its current version
+COVER_REDIRECT_MAX_AGE = 300
+# Requests sending this header (any value) get a Server-Timing breakdown of where their time went
+PROFILE_HEADER = 'X-Profile'
+
+# LMS database access (read-only). LMS_DB_IMMUTABLE skips SQLite locking,
+# which helps with read-only mounts but may read a half-written database while LMS scans.
+LMS_DB_IMMUTABLE = os.environ.get('LMS_DB_IMMUTABLE', '0') == '1'
+LMS_DB_POOL_SIZE = 4
+LMS_DB_CACHE_KB = 64 * 1024
+LMS_DB_MMAP_BYTES = 256 * 1024 * 1024
+# Keep the searchable track columns in memory and filter/sort there (rebuilt after each rescan)
+LMS_TRACK_SNAPSHOT = os.environ.get('LMS_TRACK_SNAPSHOT', '1') == '1'
+# Seconds between checks for LMS rescans (0 disables the library watcher)
+LIBRARY_POLL_SECONDS = int(os.environ.get('LIBRARY_POLL_SECONDS', 30))
+
+# Caches (kept out of the sync folder so they are never synced to devices)
+CACHE_DIR = os.path.join(EXPORT_DIR, '.cache')
+COVER_CACHE_DIR = os.path.join(CACHE_DIR, 'covers')
+COVER_CACHE_MAX_BYTES = int(os.environ.get('COVER_CACHE_MAX_MB', 256)) * 1024 * 1024
+METADATA_CACHE_DB = os.path.join(CACHE_DIR, 'metadata.db')
+# Metric values of each web worker, summed by /metrics (cleared when the server starts)
+METRICS_DIR = os.path.join(CACHE_DIR, 'metrics')
+METRICS_FLUSH_SECONDS = 5
+METADATA_CACHE_ENTRIES = 20000  # tag sets kept in memory
+COVER_INDEX_ENTRIES = 5000  # album directories whose cover source is kept in memory
+# Only the web worker holding this lock warms covers after rescans; it shares its status in the JSON file
+LIBRARY_WATCHER_LOCK = os.path.join(CACHE_DIR, 'library_watcher.lock')
+LIBRARY_STATUS_FILE = os.path.join(CACHE_DIR, 'library_status.json')
+SYNC_MANIFEST_DB = os.path.join(CACHE_DIR, 'sync.db')
+TRANSCODE_CACHE_DIR = os.path.join(CACHE_DIR, 'transcode')
+ENCODER_SLOTS_DIR = os.path.join(CACHE_DIR, 'encoder_slots')  # lock files bounding encoders across web workers
+TRANSCODE_CACHE_MAX_BYTES = int(os.environ.get('TRANSCODE_CACHE_MAX_MB', 4096)) * 1024 * 1024
+
+# Export pipeline
+EXPORT_WORKERS = int(os.environ.get('EXPORT_WORKERS', os.cpu_count() or 1))
+MAX_ENCODERS = int(os.environ.get('MAX_ENCODERS', EXPORT_WORKERS))  # for the whole server, not per web worker
+TRANSCODE_PIPE_BYTES = 1024 * 1024  # decoder -> encoder pipe buffer
+EXPORT_JOB_WORKERS = int(os.environ.get('EXPORT_JOB_WORKERS', 1))  # exports running at the same time (per web worker)
+EXPORT_JOBS_DB = os.path.join(CACHE_DIR, 'jobs.db')  # job progress shared by all web workers
+EXPORT_JOB_RETENTION = 3600  # seconds a finished export job stays queryable
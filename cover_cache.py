@@ -0,0 +1,116 @@
+import io
+import os
+import hashlib
+from PIL import Image, ImageOps
+from config import COVER_CACHE_DIR, COVER_CACHE_MAX_BYTES, COVER_MAX_SIZE, COVER_QUALITY, COVER_SIZES, COVER_WEBP_QUALITY, COVER_WARM_SIZES
+from audio_utils import extract_embedded_cover, resolve_cover
+from disk_cache import DiskCache
+import metrics
+
+# One cache for every thumbnail format, so they share COVER_CACHE_MAX_BYTES
+_cache = DiskCache(COVER_CACHE_DIR, COVER_CACHE_MAX_BYTES, '.jpg')
+
+# Thumbnail formats: file suffix in the cache, mimetype and encoder quality
+FORMATS = {
+    'jpeg': ('.jpg', 'image/jpeg', COVER_QUALITY),
+    'webp': ('.webp', 'image/webp', COVER_WEBP_QUALITY),
+}
+DEFAULT_SIZE = COVER_MAX_SIZE[0]
+
+
+def thumbnail_size(requested):
+    """Return the smallest configured thumbnail size covering the requested width (the largest if none does)"""
+    return next((size for size in sorted(COVER_SIZES) if size >= requested), max(COVER_SIZES))
+
+
+def cache_key(source_path, size=DEFAULT_SIZE, fmt='jpeg'):
+    """Return (key, mtime) for a thumbnail of a cover source (image file or audio file with embedded art).
+
+    The key changes whenever the source file or the thumbnail settings change,
+    so it doubles as the ETag of the generated thumbnail.
+    """
+    st = os.stat(source_path)
+    parts = [
+        os.path.abspath(str(source_path)),
+        str(st.st_mtime_ns),
+        str(st.st_size),
+        f"{size}x{size}",
+        str(FORMATS[fmt][2]),
+    ]
+    if fmt != 'jpeg':
+        parts.append(fmt)
+    raw = "|".join(parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest(), st.st_mtime
+
+
+def render_thumbnail(image_file, size=DEFAULT_SIZE, fmt='jpeg'):
+    """Resize an image (path or file object) to a thumbnail (progressive JPEG or WebP) and return the bytes"""
+    with metrics.timed(metrics.COVER_RESIZE_SECONDS, size=size, format=fmt), Image.open(image_file) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
+        img.thumbnail((size, size), Image.Resampling.LANCZOS)
+        buf = io.BytesIO()
+        if fmt == 'webp':
+            img.save(buf, format='WEBP', quality=COVER_WEBP_QUALITY, method=4)
+        else:
+            img.save(buf, format='JPEG', quality=COVER_QUALITY, optimize=True, progressive=True)
+    return buf.getvalue()
+
+
+def get_thumbnail(source_path, embedded=False, size=DEFAULT_SIZE, fmt='jpeg'):
+    """Return (thumbnail_path, etag, last_modified) for a cover source, rendering it on a cache miss.
+
+    source_path is either an image file or, with embedded=True, an audio file
+    whose embedded picture is used. size is one of COVER_SIZES and fmt a key of
+    FORMATS. Returns None if no thumbnail can be produced.
+    """
+    key, mtime = cache_key(source_path, size, fmt)
+    suffix = FORMATS[fmt][0]
+
+    thumb_path = _cache.lookup(key, suffix)
+    if thumb_path:
+        return thumb_path, key, mtime
+
+    with _cache.key_lock(key):
+        # Another request may have rendered it while we were waiting
+        thumb_path = _cache.lookup(key, suffix)
+        if thumb_path:
+            return thumb_path, key, mtime
+        try:
+            if embedded:
+                img_bytes, _ = extract_embedded_cover(source_path)
+                if not img_bytes:
+                    return None
+                data = render_thumbnail(io.BytesIO(img_bytes), size, fmt)
+            else:
+                data = render_thumbnail(str(source_path), size, fmt)
+            thumb_path = _cache.store(key, data, suffix)
+        except Exception as e:
+            print(f"Error rendering cover thumbnail for {source_path}: {e}")
+            return None
+
+    return thumb_path, key, mtime
+
+
+def warm_directory(directory):
+    """Render the thumbnails the song list requests for an album directory ahead of time; True if there is one"""
+    kind, source_path = resolve_cover(directory)
+    if kind == 'none':
+        return False
+    try:
+        return all([get_thumbnail(source_path, embedded=(kind == 'embedded'), size=size, fmt=fmt) is not None
+                    for size in COVER_WARM_SIZES for fmt in FORMATS])
+    except OSError:
+        return False
+
+
+def cover_version(directory):
+    """Return a short token that changes whenever the cover of an album directory changes ('none' without one)"""
+    kind, source_path = resolve_cover(directory)
+    if kind == 'none':
+        return 'none'
+    try:
+        return cache_key(source_path)[0][:16]
+    except OSError:
+        return 'none'
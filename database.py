@@ -1,166 +1,582 @@
 import os
+import json
+import base64
+import random
 import sqlite3
+import threading
 import urllib.parse
-from config import LMS_DB_DIR
+from collections import OrderedDict
+from contextlib import contextmanager
+from config import (LMS_DB_DIR, LMS_DB_IMMUTABLE, LMS_DB_POOL_SIZE, LMS_DB_CACHE_KB, LMS_DB_MMAP_BYTES,
+                    LMS_TRACK_SNAPSHOT)
+from track_snapshot import TrackSnapshot
+import metrics
+
+PERSIST_DB = os.path.join(LMS_DB_DIR, 'prefs', 'persist.db')
+LIBRARY_DB = os.path.join(LMS_DB_DIR, 'cache', 'library.db')
+
+def db_generation():
+    """Return a token that changes whenever LMS writes to its database files"""
+    generation = []
+    for path in (PERSIST_DB, LIBRARY_DB):
+        if not os.path.exists(path):
+            raise FileNotFoundError("LMS database files not found")
+        for suffix in ('', '-wal'):
+            try:
+                st = os.stat(path + suffix)
+                generation.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                generation.append(None)
+    return tuple(generation)
+
+def _db_uri(path):
+    uri = f"file:{urllib.parse.quote(path)}?mode=ro"
+    if LMS_DB_IMMUTABLE:
+        uri += "&immutable=1"
+    return uri
 
 def get_db_connection():
-    """Create a database connection to the LMS database"""
-    persist_db = os.path.join(LMS_DB_DIR, 'prefs', 'persist.db')
-    library_db = os.path.join(LMS_DB_DIR, 'cache', 'library.db')
-    
-    if not os.path.exists(persist_db) or not os.path.exists(library_db):
-        raise FileNotFoundError("LMS database files not found")
-    
-    con = sqlite3.connect(persist_db)
+    """Create a read-only database connection to the LMS database"""
+    con = sqlite3.connect(_db_uri(PERSIST_DB), uri=True, check_same_thread=False)
     cur = con.cursor()
-    cur.execute(f"ATTACH DATABASE '{library_db}' AS persist")
+    cur.execute("ATTACH DATABASE ? AS persist", (_db_uri(LIBRARY_DB),))
+    cur.execute("PRAGMA query_only = ON")
+    for schema in ('main', 'persist'):
+        cur.execute(f"PRAGMA {schema}.cache_size = -{LMS_DB_CACHE_KB}")
+        cur.execute(f"PRAGMA {schema}.mmap_size = {LMS_DB_MMAP_BYTES}")
     return con
 
-def query_songs(rating=40, limit=50, exclude_genres=None, dyn_ps_val=None, album_limit=None, order_by='added', added_before=None):
-    """Query songs from the LMS database"""
-    
-    con = get_db_connection()
-    cur = con.cursor()
-    
-    # Check if alternativeplaycount table exists
-    cur.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='alternativeplaycount'")
-    has_alternativeplaycount = cur.fetchone() is not None
-    
-    # Build common conditions and parameters
-    base_conditions = ["audio = 1", "IFNULL(tracks_persistent.rating, 0) >= ?", "INSTR(tracks.url, '#') = 0"]
+class ConnectionPool:
+    """Keeps opened LMS connections around between queries.
+
+    Connections are handed to one thread at a time and dropped as soon as
+    the LMS database files change, so a rescan is picked up on the next
+    query. Schema facts (e.g. whether the Alternative Play Count plugin
+    table exists) are cached for the same lifetime.
+    """
+
+    def __init__(self, max_idle):
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._idle = []
+        self._generation = None
+        self._schema = None
+
+    def _check_generation(self):
+        """Drop idle connections and schema facts if the database changed (call with lock held)"""
+        generation = db_generation()
+        if generation != self._generation:
+            for con in self._idle:
+                con.close()
+            self._idle = []
+            self._schema = None
+            self._generation = generation
+        return generation
+
+    def acquire(self):
+        with self._lock:
+            generation = self._check_generation()
+            if self._idle:
+                return self._idle.pop(), generation
+        return get_db_connection(), generation
+
+    def release(self, con, generation):
+        with self._lock:
+            if generation == self._generation and len(self._idle) < self.max_idle:
+                self._idle.append(con)
+                return
+        con.close()
+
+    def schema(self, con):
+        """Return cached schema facts for the current database generation"""
+        with self._lock:
+            schema = self._schema
+        if schema is None:
+            cur = con.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='alternativeplaycount'")
+            schema = {'has_alternativeplaycount': cur.fetchone() is not None}
+            with self._lock:
+                self._schema = schema
+        return schema
+
+_pool = ConnectionPool(LMS_DB_POOL_SIZE)
+
+@contextmanager
+def lms_connection():
+    """Borrow a pooled read-only connection to the LMS database"""
+    con, generation = _pool.acquire()
+    try:
+        yield con
+    finally:
+        _pool.release(con, generation)
+
+# Sort keys per ordering as (expression, direction), written against the selected
+# columns. track_id breaks ties so the order is total, which keyset pagination needs.
+SORT_KEYS = {
+    'added': [("IFNULL(added, 0)", 'DESC'), ("track_id", 'DESC')],
+    # Sort by lastPlayed, handling NULL/0 as lowest (last)
+    'last_played': [
+        ("CASE WHEN IFNULL(lastPlayed, 0) = 0 THEN 1 ELSE 0 END", 'ASC'),
+        ("IFNULL(lastPlayed, 0)", 'DESC'),
+        ("track_id", 'DESC'),
+    ],
+}
+
+def _sort_keys(order_by):
+    return SORT_KEYS.get(order_by, SORT_KEYS['added'])
+
+def _order_clause(order_by):
+    if order_by == 'random':
+        return "RANDOM()"
+    return ", ".join(f"{expr} {direction}" for expr, direction in _sort_keys(order_by))
+
+def _keyset_condition(order_by, after):
+    """Return (condition, params) selecting the rows that sort after the key values in after"""
+    alternatives = []
+    params = []
+    keys = _sort_keys(order_by)
+    for i, (expr, direction) in enumerate(keys):
+        terms = [f"{prev_expr} = ?" for prev_expr, _ in keys[:i]]
+        terms.append(f"{expr} {'<' if direction == 'DESC' else '>'} ?")
+        alternatives.append("(" + " AND ".join(terms) + ")")
+        params.extend(after[:i + 1])
+    return "(" + " OR ".join(alternatives) + ")", params
+
+def encode_cursor(state):
+    """Encode pagination state as an opaque, URL-safe cursor string"""
+    return base64.urlsafe_b64encode(json.dumps(state, separators=(',', ':')).encode('utf-8')).decode('ascii')
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+def _is_seed(value):
+    return _is_int(value) or isinstance(value, str)
+
+def decode_cursor(cursor, order_by=None):
+    """Decode a cursor from encode_cursor; raises ValueError if it is malformed.
+
+    With order_by, the sort key values a keyset cursor carries are checked
+    against that ordering too.
+    """
+    try:
+        state = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    if not isinstance(state, dict) or not _is_int(state.get('n')) or state['n'] < 0:
+        raise ValueError('Invalid cursor')
+    if 'seed' in state and not _is_seed(state['seed']):
+        raise ValueError('Invalid cursor')
+    if order_by is not None and order_by != 'random' and (state['n'] > 0 or 'after' in state):
+        after = state.get('after')
+        if (not isinstance(after, list) or len(after) != len(_sort_keys(order_by))
+                or not all(_is_int(value) or isinstance(value, float) for value in after)):
+            raise ValueError('Invalid cursor')
+    return state
+
+SONG_COLUMNS = "track_id, url, title, artist, rating, added, lastPlayed, year, album_title, dynPSval"
+SONG_COLUMN_COUNT = len(SONG_COLUMNS.split(','))
+
+# What makes a track searchable at all, whatever the filters
+BASE_CONDITIONS = [
+    "audio = 1",
+    "INSTR(tracks.url, '#') = 0",
+    "EXISTS (SELECT 1 FROM genre_track WHERE genre_track.track = tracks.id)",
+]
+
+def _filter_conditions(has_alternativeplaycount, rating=40, exclude_genres=None, dyn_ps_val=None, added_before=None):
+    """Return (conditions, params) selecting the tracks matching the search filters.
+
+    Genre filtering uses EXISTS/NOT EXISTS subqueries instead of joining
+    genre_track, so there is one row per track and no GROUP BY: a track is
+    excluded if any of its genres is excluded.
+    """
+    conditions = BASE_CONDITIONS + ["IFNULL(tracks_persistent.rating, 0) >= ?"]
     params = [rating]
     
-    if exclude_genres is not None:
+    if exclude_genres:
         placeholders = ','.join(['?' for _ in exclude_genres])
-        base_conditions.append(f"genres.name NOT IN ({placeholders})")
+        conditions.append(
+            "NOT EXISTS (SELECT 1 FROM genre_track JOIN genres ON genre_track.genre = genres.id "
+            f"WHERE genre_track.track = tracks.id AND genres.name IN ({placeholders}))"
+        )
         params.extend(exclude_genres)
     
     if dyn_ps_val is not None and dyn_ps_val != 0 and has_alternativeplaycount:
-        base_conditions.append("IFNULL(alternativeplaycount.dynPSval, 0) > ?")
+        conditions.append("IFNULL(alternativeplaycount.dynPSval, 0) > ?")
         params.append(dyn_ps_val)
     
     if added_before is not None:
-        base_conditions.append("tracks.timestamp < ?")
+        conditions.append("tracks.timestamp < ?")
         params.append(added_before)
-    
-    where_clause = " AND ".join(base_conditions)
-    
-    # Determine ordering
-    if order_by == 'random':
-        order_clause = "RANDOM()"
-    elif order_by == 'last_played':
-        # Sort by lastPlayed (tracks_persistent.lastPlayed), handling NULL/0 as lowest (last)
-        order_clause = "CASE WHEN IFNULL(tracks_persistent.lastPlayed, 0) = 0 THEN 1 ELSE 0 END, tracks_persistent.lastPlayed DESC"
-    else:
-        # Default to added time
-        order_clause = "tracks_persistent.added DESC"
+
+    return conditions, params
+
+def _song_select(has_alternativeplaycount, conditions):
+    """Return a SELECT producing one row per track (see SONG_COLUMNS, plus album_id and timestamp) matching conditions"""
+    # Conditional JOIN for alternativeplaycount
+    alternativeplaycount_join = "LEFT JOIN alternativeplaycount ON tracks.url = alternativeplaycount.url" if has_alternativeplaycount else ""
+    dynpsval_select = "alternativeplaycount.dynPSval" if has_alternativeplaycount else "NULL"
+
+    # Several tracks_persistent rows can share a musicbrainz_id (e.g. the same
+    # recording on two albums); pick one per track instead of fanning out.
+    return f'''
+        SELECT 
+            tracks.id AS track_id,
+            tracks.url AS url,
+            tracks.title AS title,
+            contributors.name AS artist,
+            tracks_persistent.rating AS rating,
+            tracks_persistent.added AS added,
+            tracks_persistent.lastPlayed AS lastPlayed,
+            tracks.year AS year,
+            albums.title AS album_title,
+            {dynpsval_select} AS dynPSval,
+            tracks.album AS album_id,
+            tracks.timestamp AS timestamp
+        FROM tracks
+        JOIN tracks_persistent ON tracks_persistent.id = (
+            SELECT tp.id FROM tracks_persistent tp
+            WHERE tp.musicbrainz_id = tracks.musicbrainz_id
+            ORDER BY tp.id
+            LIMIT 1
+        )
+        JOIN contributors ON tracks.primary_artist = contributors.id
+        JOIN albums ON tracks.album = albums.id
+        {alternativeplaycount_join}
+        WHERE {" AND ".join(conditions)}
+    '''
+
+def build_song_query(has_alternativeplaycount, rating=40, limit=50, exclude_genres=None, dyn_ps_val=None,
+                     album_limit=None, order_by='added', added_before=None, after=None):
+    """Build the SQL and parameters selecting the songs matching the filters, ordered and limited in SQL.
+
+    Rows are SONG_COLUMNS followed by the sort key values of the ordering.
+    If after holds the sort key values of a previous row, only rows sorting
+    after it are returned (keyset pagination). The genre shown per track is
+    looked up afterwards (see _primary_genres).
+    """
+    conditions, params = _filter_conditions(has_alternativeplaycount, rating, exclude_genres, dyn_ps_val, added_before)
+    song_select = _song_select(has_alternativeplaycount, conditions)
+    order_clause = _order_clause(order_by)
+    key_columns = "".join(f", {expr}" for expr, _ in _sort_keys(order_by)) if order_by != 'random' else ""
+
+    page_conditions = []
+    page_params = []
+    if after is not None and order_by != 'random':
+        condition, page_params = _keyset_condition(order_by, after)
+        page_conditions.append(condition)
 
     # Build query based on whether album limiting is enabled
     if album_limit is not None and album_limit > 0:
         # Use window function to limit tracks per album
-        window_order = "RANDOM()" if order_by == 'random' else (
-            "CASE WHEN IFNULL(tracks_persistent.lastPlayed, 0) = 0 THEN 1 ELSE 0 END, tracks_persistent.lastPlayed DESC" if order_by == 'last_played' else "tracks_persistent.added DESC"
-        )
-        
-        # Conditional JOIN for alternativeplaycount
-        alternativeplaycount_join = "LEFT JOIN alternativeplaycount ON tracks.url = alternativeplaycount.url" if has_alternativeplaycount else ""
-        dynpsval_select = "alternativeplaycount.dynPSval" if has_alternativeplaycount else "NULL as dynPSval"
-        
+        page_conditions.insert(0, "album_rank <= ?")
         query = f'''
-        WITH ranked_tracks AS (
-            SELECT 
-                tracks.url,
-                tracks.title,
-                contributors.name as artist,
-                genres.name as genre,
-                tracks_persistent.rating,
-                tracks_persistent.added,
-                tracks_persistent.lastPlayed,
-                tracks.year as year,
-                albums.title as album_title,
-                {dynpsval_select},
-                ROW_NUMBER() OVER (PARTITION BY tracks.album ORDER BY {window_order}) as album_rank
-            FROM tracks
-            JOIN tracks_persistent ON tracks.musicbrainz_id = tracks_persistent.musicbrainz_id
-            JOIN genre_track ON tracks.id = genre_track.track
-            JOIN genres ON genre_track.genre = genres.id
-            JOIN contributor_track ON tracks.id = contributor_track.track
-            JOIN contributors ON tracks.primary_artist = contributors.id
-            JOIN albums on tracks.album=albums.id
-            {alternativeplaycount_join}
-            WHERE {where_clause}
-            GROUP BY tracks.id
+        WITH matching AS ({song_select}),
+        ranked_tracks AS (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY album_id ORDER BY {order_clause}) AS album_rank
+            FROM matching
         )
-        SELECT 
-            url,
-            title,
-            artist,
-            genre,
-            rating,
-            added,
-            lastPlayed,
-            year,
-            album_title,
-            dynPSval
+        SELECT {SONG_COLUMNS}{key_columns}
         FROM ranked_tracks
-        WHERE album_rank <= ?
-        ORDER BY {
-            'RANDOM()' if order_by == 'random' else (
-                'CASE WHEN IFNULL(lastPlayed, 0) = 0 THEN 1 ELSE 0 END, lastPlayed DESC' if order_by == 'last_played' else 'added DESC'
-            )
-        }
+        WHERE {" AND ".join(page_conditions)}
+        ORDER BY {order_clause}
         LIMIT ?;
         '''
-        params.extend([album_limit, limit])
+        params.extend([album_limit] + page_params + [limit])
     else:
-        # Original query without album limiting
-        
-        # Conditional JOIN for alternativeplaycount
-        alternativeplaycount_join = "LEFT JOIN alternativeplaycount ON tracks.url = alternativeplaycount.url" if has_alternativeplaycount else ""
-        dynpsval_select = "alternativeplaycount.dynPSval" if has_alternativeplaycount else "NULL as dynPSval"
-        
         query = f'''
-        SELECT 
-            tracks.url,
-            tracks.title,
-            contributors.name as artist,
-            genres.name as genre,
-            tracks_persistent.rating,
-            tracks_persistent.added,
-            tracks_persistent.lastPlayed,
-            tracks.year as year,
-            albums.title,
-            {dynpsval_select}
-        FROM tracks
-        JOIN tracks_persistent ON tracks.musicbrainz_id = tracks_persistent.musicbrainz_id
-        JOIN genre_track ON tracks.id = genre_track.track
-        JOIN genres ON genre_track.genre = genres.id
-        JOIN contributor_track ON tracks.id = contributor_track.track
-        JOIN contributors ON tracks.primary_artist = contributors.id
-        JOIN albums on tracks.album=albums.id
-        {alternativeplaycount_join}
-        WHERE {where_clause}
-        GROUP BY tracks.id
+        SELECT {SONG_COLUMNS}{key_columns}
+        FROM ({song_select})
+        {"WHERE " + " AND ".join(page_conditions) if page_conditions else ""}
         ORDER BY {order_clause}
         LIMIT ?;
         '''
-        params.append(limit)
-    
-    result = cur.execute(query, params)
-    
+        params.extend(page_params + [limit])
+
+    return query, params
+
+class CandidateCache:
+    """Small LRU of the (track id, album id) lists matching a filter set.
+
+    Random sampling only needs the ids of the qualifying tracks, and the
+    same filters are usually reshuffled several times in a row. Keys include
+    the LMS database generation, so a rescan invalidates everything.
+    """
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            candidates = self._entries.get(key)
+            if candidates is not None:
+                self._entries.move_to_end(key)
+            return candidates
+
+    def put(self, key, candidates):
+        with self._lock:
+            self._entries[key] = candidates
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+_candidates = CandidateCache()
+
+def _shuffled_indexes(n, rng):
+    """Yield range(n) in random order, lazily (Fisher-Yates with the swaps kept in a dict).
+
+    Drawing k items costs O(k), and the order only depends on rng's seed.
+    """
+    swaps = {}
+    for i in range(n):
+        j = rng.randrange(i, n)
+        yield swaps.get(j, j)
+        swaps[j] = swaps.get(i, i)
+        swaps.pop(i, None)
+
+def sample_tracks(candidates, limit, album_limit=None, seed=None):
+    """Pick up to limit random (track id, album id) candidates, at most album_limit per album"""
+    rng = random.Random(seed)
+    picked = []
+    per_album = {}
+    for index in _shuffled_indexes(len(candidates), rng):
+        if len(picked) >= limit:
+            break
+        track_id, album_id = candidates[index]
+        if album_limit:
+            if per_album.get(album_id, 0) >= album_limit:
+                continue
+            per_album[album_id] = per_album.get(album_id, 0) + 1
+        picked.append(track_id)
+    return picked
+
+def _random_rows(cur, has_alternativeplaycount, rating, limit, exclude_genres, dyn_ps_val, album_limit, added_before, seed,
+                 offset=0, snapshot=None):
+    """Sample random song rows in Python instead of ORDER BY RANDOM() over the whole library.
+
+    Returns rows offset..limit of the sample, so a page of a shuffle can be
+    fetched without re-sampling differently. With a snapshot, cur isn't used.
+    """
+    generation = snapshot.generation if snapshot is not None else db_generation()
+    key = (generation, has_alternativeplaycount, rating, tuple(sorted(exclude_genres or [])), dyn_ps_val, added_before)
+    candidates = _candidates.get(key)
+    if candidates is None:
+        if snapshot is not None:
+            candidates = snapshot.candidates(rating, exclude_genres, dyn_ps_val, added_before)
+        else:
+            conditions, params = _filter_conditions(has_alternativeplaycount, rating, exclude_genres, dyn_ps_val, added_before)
+            candidates = cur.execute(
+                f"SELECT track_id, album_id FROM ({_song_select(has_alternativeplaycount, conditions)}) ORDER BY track_id",
+                params,
+            ).fetchall()
+        _candidates.put(key, candidates)
+
+    picked = sample_tracks(candidates, limit, album_limit, seed)
+    if snapshot is not None:
+        return snapshot.hydrate(picked[offset:])
+    return _hydrate(cur, has_alternativeplaycount, picked[offset:])
+
+def _hydrate(cur, has_alternativeplaycount, track_ids):
+    """Fetch the song rows of track_ids, in the given order"""
+    rows = {}
+    # Stay well below SQLite's bound parameter limit
+    for start in range(0, len(track_ids), 500):
+        chunk = track_ids[start:start + 500]
+        placeholders = ','.join(['?' for _ in chunk])
+        select = _song_select(has_alternativeplaycount, [f"tracks.id IN ({placeholders})"])
+        for row in cur.execute(f"SELECT {SONG_COLUMNS} FROM ({select})", chunk):
+            rows[row[0]] = row
+    return [rows[track_id] for track_id in track_ids if track_id in rows]
+
+def _primary_genres(cur, track_ids):
+    """Return {track_id: genre name} with one deterministic (alphabetically first) genre per track"""
+    genres = {}
+    # Stay well below SQLite's bound parameter limit
+    for start in range(0, len(track_ids), 500):
+        chunk = track_ids[start:start + 500]
+        placeholders = ','.join(['?' for _ in chunk])
+        rows = cur.execute(
+            f"SELECT genre_track.track, MIN(genres.name) FROM genre_track "
+            f"JOIN genres ON genre_track.genre = genres.id "
+            f"WHERE genre_track.track IN ({placeholders}) GROUP BY genre_track.track",
+            chunk,
+        )
+        genres.update(rows)
+    return genres
+
+class SnapshotHolder:
+    """Holds the TrackSnapshot of the current LMS database.
+
+    get() never waits for a build: while the snapshot is missing or stale
+    (LMS rescanned), a rebuild runs in a background thread and queries go
+    to SQLite in the meantime. Once the library watcher runs, it owns the
+    rebuilds (it waits for a scan to settle) and get() keeps serving the
+    snapshot it last published instead.
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._building = False
+        self.refresh_on_demand = True
+
+    def get(self):
+        """Return the snapshot if it is up to date (or refreshed by the watcher), else None"""
+        snapshot = self._snapshot
+        if not self.refresh_on_demand:
+            return snapshot
+        if snapshot is not None and snapshot.generation == db_generation():
+            return snapshot
+        self.refresh_in_background()
+        return None
+
+    def refresh_in_background(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(target=self._background_refresh, name='track-snapshot', daemon=True).start()
+
+    def _background_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Error building track snapshot: {e}")
+        finally:
+            with self._lock:
+                self._building = False
+
+    def refresh(self):
+        """Build a snapshot of the database as it is now, swap it in and return it"""
+        # Taken before reading, so changes made during the build trigger another one
+        generation = db_generation()
+        with lms_connection() as con:
+            has_alternativeplaycount = _pool.schema(con)['has_alternativeplaycount']
+            rows = con.execute(
+                f"SELECT {SONG_COLUMNS}, album_id, timestamp "
+                f"FROM ({_song_select(has_alternativeplaycount, BASE_CONDITIONS)}) ORDER BY track_id"
+            ).fetchall()
+            genre_rows = con.execute(
+                "SELECT genre_track.track, genres.name FROM genre_track JOIN genres ON genre_track.genre = genres.id"
+            )
+            snapshot = TrackSnapshot(generation, has_alternativeplaycount, rows, genre_rows)
+        self._snapshot = snapshot
+        return snapshot
+
+_snapshots = SnapshotHolder()
+
+def current_snapshot():
+    """Return the current track snapshot, or None if disabled or (re)building"""
+    if not LMS_TRACK_SNAPSHOT:
+        return None
+    return _snapshots.get()
+
+def refresh_query_state():
+    """Rebuild the in-memory query state for the database as it is now (call after a rescan).
+
+    Returns the new track snapshot, or None if snapshots are disabled.
+    Pooled connections and cached candidate lists follow the database
+    generation by themselves.
+    """
+    if not LMS_TRACK_SNAPSHOT:
+        return None
+    return _snapshots.refresh()
+
+def leave_refreshes_to_watcher():
+    """Stop rebuilding the query state on demand: the library watcher calls refresh_query_state itself"""
+    _snapshots.refresh_on_demand = False
+
+def url_to_path(url):
+    """Return the file path of an LMS track url"""
+    return urllib.parse.unquote(url.replace("file://", ""))
+
+def track_paths(snapshot=None):
+    """Return the file paths of every searchable track, from snapshot if given"""
+    if snapshot is not None:
+        return [url_to_path(url) for url in snapshot.url]
+    with lms_connection() as con:
+        rows = con.execute(f"SELECT tracks.url FROM tracks WHERE {' AND '.join(BASE_CONDITIONS)}")
+        return [url_to_path(url) for url, in rows]
+
+def _fetch_page(snapshot, state, rating, page_size, exclude_genres, dyn_ps_val, album_limit, order_by, added_before,
+                seed):
+    """Return (rows, {track_id: genre}) of the page after state, from snapshot or else SQLite"""
+    if snapshot is not None:
+        # Filter, sort and limit in memory: no database access at all
+        if order_by == 'random':
+            rows = _random_rows(None, snapshot.has_alternativeplaycount, rating, state['n'] + page_size, exclude_genres,
+                                dyn_ps_val, album_limit, added_before, seed, offset=state['n'], snapshot=snapshot)
+        else:
+            rows = snapshot.page(rating, page_size, exclude_genres, dyn_ps_val, album_limit, order_by, added_before,
+                                 after=state.get('after'))
+        return rows, snapshot.primary_genres([row[0] for row in rows])
+
+    with lms_connection() as con:
+        cur = con.cursor()
+        # Check if alternativeplaycount table exists
+        has_alternativeplaycount = _pool.schema(con)['has_alternativeplaycount']
+        if order_by == 'random':
+            rows = _random_rows(cur, has_alternativeplaycount, rating, state['n'] + page_size, exclude_genres,
+                                dyn_ps_val, album_limit, added_before, seed, offset=state['n'])
+        else:
+            query, params = build_song_query(has_alternativeplaycount, rating, page_size, exclude_genres, dyn_ps_val,
+                                             album_limit, order_by, added_before, after=state.get('after'))
+            rows = cur.execute(query, params).fetchall()
+        return rows, _primary_genres(cur, [row[0] for row in rows])
+
+def query_songs(rating=40, limit=50, exclude_genres=None, dyn_ps_val=None, album_limit=None, order_by='added', added_before=None, seed=None):
+    """Query songs from the LMS database.
+
+    With order_by='random' the result is a sample drawn with seed, so the
+    same seed (and filters) reproduces the same shuffle.
+    """
+    songs, _ = query_songs_page(rating, limit, exclude_genres, dyn_ps_val, album_limit, order_by, added_before,
+                                seed, page_size=limit)
+    return songs
+
+def query_songs_page(rating=40, limit=50, exclude_genres=None, dyn_ps_val=None, album_limit=None, order_by='added',
+                     added_before=None, seed=None, page_size=100, cursor=None):
+    """Query one page of songs; returns (songs, next_cursor).
+
+    limit caps the total over all pages. Pass the returned cursor (with the
+    same filters) to get the next page; it is None after the last page.
+    The added/last_played orderings page by key (no OFFSET scans), random
+    pages through the seeded sample, whose seed the cursor carries.
+    """
+    for name, value in (('limit', limit), ('page_size', page_size), ('album_limit', album_limit)):
+        if (value is not None or name != 'album_limit') and (not _is_int(value) or value <= 0):
+            raise ValueError(f"{name} must be a positive integer")
+    if seed is not None and not _is_seed(seed):
+        raise ValueError('seed must be an integer or a string')
+    state = decode_cursor(cursor, order_by) if cursor else {'n': 0}
+    if order_by == 'random':
+        seed = state.get('seed', seed)
+    remaining = limit - state['n']
+    if remaining <= 0:
+        return [], None
+    page_size = min(page_size, remaining)
+
+    snapshot = current_snapshot()
+    backend = 'snapshot' if snapshot is not None else 'sql'
+    with metrics.timed(metrics.QUERY_SECONDS, backend=backend, order_by=order_by):
+        rows, genres = _fetch_page(snapshot, state, rating, page_size, exclude_genres, dyn_ps_val, album_limit,
+                                   order_by, added_before, seed)
+    metrics.QUERY_ROWS.inc(len(rows), backend=backend, order_by=order_by)
+
     songs = []
-    for row in result:
-        url = row[0].replace("file://", "")
-        url = urllib.parse.unquote(url)
+    for row in rows:
+        url = url_to_path(row[1])
         
-        # Add cover_url for frontend
-        cover_url = f"/api/cover?path={urllib.parse.quote(url, safe='')}"
+        # Add cover_url for frontend: one URL per album directory, so tracks of an album share the cached image.
+        # The cover itself is only looked up when the browser requests it (see /api/cover/album).
+        cover_url = f"/api/cover/album?dir={urllib.parse.quote(os.path.dirname(url), safe='')}"
         
         songs.append({
             'url': url,
-            'title': row[1],
-            'artist': row[2],
-            'genre': row[3],
+            'title': row[2],
+            'artist': row[3],
+            'genre': genres.get(row[0]),
             'rating': row[4],
             'added': row[5],
             'last_played': row[6],
@@ -170,6 +586,15 @@ def query_songs(rating=40, limit=50, exclude_genres=None, dyn_ps_val=None, album
             'filename': os.path.basename(url),
             'cover_url': cover_url
         })
+
+    next_cursor = None
+    returned = state['n'] + len(rows)
+    if len(rows) == page_size and returned < limit:
+        next_state = {'n': returned}
+        if order_by == 'random':
+            next_state['seed'] = seed
+        else:
+            next_state['after'] = list(rows[-1][SONG_COLUMN_COUNT:])
+        next_cursor = encode_cursor(next_state)
     
-    con.close()
-    return songs 
\ No newline at end of file
+    return songs, next_cursor
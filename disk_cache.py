@@ -0,0 +1,170 @@
+import os
+import shutil
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds between re-reading the cache size from disk, to count what other processes wrote
+RESCAN_SECONDS = 10
+
+
+class DiskCache:
+    """A directory of generated files addressed by a key (usually a content hash).
+
+    Entries are written atomically, reads bump the file's atime, and once
+    the total size exceeds max_bytes the least recently used entries are
+    evicted. Renders of the same key are serialised with key_lock() so
+    concurrent requests for a cold entry produce it only once. The mtime
+    is left alone: entries may be hardlinked into export folders, where a
+    changing mtime would make sync tools rehash the files.
+
+    Entries use the cache's suffix unless another one is passed (e.g. one
+    per image format); the cap applies to all of them together. With an
+    owner (uid, gid), entries are given to it on commit, read-only for
+    everyone else, so hardlinks to them never need their own permissions.
+    """
+
+    def __init__(self, directory, max_bytes, suffix, owner=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.owner = owner
+        self._key_locks = {}
+        self._key_locks_guard = threading.Lock()
+        # Approximate total size of the cache directory: scanned from disk every
+        # RESCAN_SECONDS (every web worker writes to it), plus our own writes since
+        self._total_bytes = None
+        self._scanned_at = 0.0
+        self._total_lock = threading.Lock()
+
+    def path(self, key, suffix=None):
+        return os.path.join(self.directory, key[:2], f"{key}{self.suffix if suffix is None else suffix}")
+
+    def lookup(self, key, suffix=None):
+        """Return the path of a cached entry (marking it as recently used) or None"""
+        path = self.path(key, suffix)
+        try:
+            st = os.stat(path)
+            os.utime(path, ns=(time.time_ns(), st.st_mtime_ns))
+            return path
+        except OSError:
+            return None
+
+    @contextmanager
+    def key_lock(self, key):
+        with self._key_locks_guard:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+        try:
+            with lock:
+                yield
+        finally:
+            with self._key_locks_guard:
+                if self._key_locks.get(key) is lock and not lock.locked():
+                    del self._key_locks[key]
+
+    def temp_path(self, key, suffix=None):
+        """Return a private path in the cache directory to produce an entry in (see commit).
+
+        It keeps the entry's extension, for tools that pick the format by file name.
+        """
+        base, ext = os.path.splitext(self.path(key, suffix))
+        os.makedirs(os.path.dirname(base), exist_ok=True)
+        return f"{base}.{os.getpid()}.{threading.get_ident()}.tmp{ext}"
+
+    def commit(self, key, temp_path, suffix=None):
+        """Move a file produced at temp_path into the cache and return its final path"""
+        path = self.path(key, suffix)
+        if self.owner is not None:
+            try:
+                os.chown(temp_path, int(self.owner[0]), int(self.owner[1]))
+                os.chmod(temp_path, 0o644)
+            except Exception as e:
+                print(f"Error applying permissions to {temp_path}: {e}")
+        os.replace(temp_path, path)
+        self._account(os.path.getsize(path))
+        return path
+
+    def store(self, key, data, suffix=None):
+        """Write bytes as the entry for key and return its path"""
+        temp_path = self.temp_path(key, suffix)
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        return self.commit(key, temp_path, suffix)
+
+    def _scan(self):
+        """Return a list of (atime, size, path) for every cached entry, whatever its suffix"""
+        entries = []
+        if not os.path.isdir(self.directory):
+            return entries
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if '.tmp' in entry.name:
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_atime, st.st_size, entry.path))
+        return entries
+
+    def _account(self, added_bytes):
+        """Track the cache size and evict least recently used entries when over the cap"""
+        with self._total_lock:
+            if self._total_bytes is None or time.monotonic() - self._scanned_at > RESCAN_SECONDS:
+                self._total_bytes = sum(size for _, size, _ in self._scan())
+                self._scanned_at = time.monotonic()
+            else:
+                self._total_bytes += added_bytes
+            if self._total_bytes <= self.max_bytes:
+                return
+
+            entries = sorted(self._scan())
+            self._scanned_at = time.monotonic()
+            total = sum(size for _, size, _ in entries)
+            # Evict down to 90% of the cap so we don't evict on every single write
+            target = self.max_bytes * 0.9
+            for _, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+            self._total_bytes = total
+
+
+# FICLONE from linux/fs.h: share the data blocks of another file (btrfs, XFS, ...)
+_FICLONE = 0x40049409
+
+
+def clone_file(source, target, allow_hardlink=False):
+    """Materialise a cached file at target as cheaply as the filesystem allows.
+
+    Tries a hardlink (only if allowed: the target must never be modified in
+    place, or the cache entry would change with it), then a copy-on-write
+    reflink, then falls back to a regular copy. Returns the method used.
+    """
+    try:
+        os.remove(target)
+    except FileNotFoundError:
+        pass
+    if allow_hardlink:
+        try:
+            os.link(source, target)
+            return 'hardlink'
+        except OSError:
+            pass
+    try:
+        import fcntl
+        with open(source, 'rb') as src, open(target, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), _FICLONE, src.fileno())
+        return 'reflink'
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(source, target)
+    return 'copy'
@@ -0,0 +1,361 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import EXPORT_JOB_WORKERS, EXPORT_JOB_RETENTION, EXPORT_JOBS_DB
+from export_utils import copy_songs, stream_zip
+
+FINISHED_STATES = ('done', 'failed')
+
+# How often waiting event streams look for changes made by other processes
+POLL_INTERVAL = 0.5
+
+# Job fields only kept in their own columns/table, not in the client-facing state
+_PRIVATE_FIELDS = ('results', 'songs', 'options', 'owner')
+
+
+class JobStore:
+    """Export jobs in a SQLite file, so every server process sees every job.
+
+    Progress is written through on each change; the job's results are
+    appended to a separate table so a progress update doesn't rewrite them.
+    A job runs in the process that started it (its owner); if that process
+    is gone while the job is unfinished, the job is reported as failed. If
+    the file can't be opened, jobs are kept in memory (one process only).
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._con = None
+
+    def _db(self):
+        if self._con is None:
+            try:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                con = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+                con.execute("PRAGMA journal_mode=WAL")
+                con.execute("PRAGMA synchronous=NORMAL")
+            except Exception as e:
+                print(f"Export jobs kept in memory, cannot open {self.db_path}: {e}")
+                con = sqlite3.connect(':memory:', check_same_thread=False)
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS export_jobs ("
+                "id TEXT PRIMARY KEY, owner INTEGER, status TEXT NOT NULL, version INTEGER NOT NULL, "
+                "created_at REAL NOT NULL, finished_at REAL, state TEXT NOT NULL, songs TEXT, options TEXT)"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS export_job_results ("
+                "job_id TEXT NOT NULL, seq INTEGER NOT NULL, result TEXT NOT NULL, PRIMARY KEY (job_id, seq))"
+            )
+            con.commit()
+            self._con = con
+        return self._con
+
+    def create(self, job):
+        state = {k: v for k, v in job.items() if k not in _PRIVATE_FIELDS}
+        with self._lock:
+            con = self._db()
+            con.execute(
+                "INSERT INTO export_jobs (id, owner, status, version, created_at, finished_at, state, songs, options) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job['id'], os.getpid(), job['status'], job['version'], job['created_at'], job['finished_at'],
+                 json.dumps(state), json.dumps(job['songs']), json.dumps(job['options'])),
+            )
+            con.commit()
+
+    def save(self, job, result=None, reset_results=False):
+        """Write the state of a job owned by this process, optionally appending one result"""
+        state = {k: v for k, v in job.items() if k not in _PRIVATE_FIELDS}
+        with self._lock:
+            con = self._db()
+            if reset_results:
+                con.execute("DELETE FROM export_job_results WHERE job_id = ?", (job['id'],))
+            if result is not None:
+                con.execute("INSERT INTO export_job_results (job_id, seq, result) VALUES (?, ?, ?)",
+                            (job['id'], job['completed'], json.dumps(result)))
+            con.execute("UPDATE export_jobs SET owner = ?, status = ?, version = ?, finished_at = ?, state = ? "
+                        "WHERE id = ?",
+                        (os.getpid(), job['status'], job['version'], job['finished_at'], json.dumps(state), job['id']))
+            con.commit()
+
+    def load(self, job_id, include_private=False):
+        """Return a job as a dict (with songs, options and results if include_private) or None"""
+        with self._lock:
+            con = self._db()
+            row = con.execute("SELECT owner, state, songs, options FROM export_jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = json.loads(row[1])
+            job['owner'] = row[0]
+            if include_private:
+                job['songs'] = json.loads(row[2])
+                job['options'] = json.loads(row[3])
+                job['results'] = [json.loads(result) for result, in con.execute(
+                    "SELECT result FROM export_job_results WHERE job_id = ? ORDER BY seq", (job_id,))]
+            return job
+
+    def version(self, job_id):
+        """Return the version of a job, or None if it is unknown"""
+        with self._lock:
+            row = self._db().execute("SELECT version FROM export_jobs WHERE id = ?", (job_id,)).fetchone()
+            return row[0] if row else None
+
+    def owned_unfinished(self):
+        """Return the ids of this process's jobs that are queued or running"""
+        with self._lock:
+            return [job_id for job_id, in self._db().execute(
+                "SELECT id FROM export_jobs WHERE owner = ? AND status IN ('queued', 'running')", (os.getpid(),))]
+
+    def prune(self, cutoff):
+        """Forget finished jobs that ended, and never downloaded streaming jobs created, before cutoff"""
+        with self._lock:
+            con = self._db()
+            expired = [job_id for job_id, in con.execute(
+                "SELECT id FROM export_jobs WHERE (status IN ('done', 'failed') AND finished_at < ?) "
+                "OR (status = 'ready' AND created_at < ?)", (cutoff, cutoff))]
+            for job_id in expired:
+                con.execute("DELETE FROM export_job_results WHERE job_id = ?", (job_id,))
+                con.execute("DELETE FROM export_jobs WHERE id = ?", (job_id,))
+            con.commit()
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass  # exists, but belongs to another user
+    return True
+
+
+_executor = ThreadPoolExecutor(max_workers=max(1, EXPORT_JOB_WORKERS), thread_name_prefix='export-job')
+_store = JobStore(EXPORT_JOBS_DB)
+# Jobs running in this process, by id (the store has the copy every process sees)
+_jobs = {}
+_futures = {}
+# Notified whenever a job of this process changes, so event streams can wait for updates
+_changed = threading.Condition()
+_shutting_down = False
+
+
+def _public(job):
+    """Return the client-facing view of a job (everything but the full per-song results)"""
+    view = {k: v for k, v in job.items() if k not in _PRIVATE_FIELDS}
+    if job['status'] == 'running' and job['completed'] and job['started_at']:
+        elapsed = time.time() - job['started_at']
+        remaining = job['total'] - job['completed']
+        view['eta_seconds'] = round(elapsed / job['completed'] * remaining, 1)
+    else:
+        view['eta_seconds'] = None
+    return view
+
+
+def _update(job_id, reset_results=False, **changes):
+    with _changed:
+        job = _jobs.get(job_id)
+        if job is None:
+            return  # already finished (e.g. given up on by shutdown())
+        job.update(changes)
+        job['version'] += 1
+        _store.save(job, reset_results=reset_results)
+        _changed.notify_all()
+
+
+def _finish(job_id, **changes):
+    _update(job_id, finished_at=time.time(), current=None, **changes)
+    with _changed:
+        _jobs.pop(job_id, None)
+        _futures.pop(job_id, None)
+
+
+def _progress_callback(job):
+    """Return a copy_songs/stream_zip progress callback that records results on job"""
+    def on_progress(result):
+        with _changed:
+            if job['id'] not in _jobs:
+                return
+            job['completed'] += 1
+            if not result['success']:
+                job['failed'] += 1
+            job['bytes_written'] += result.get('bytes', 0)
+            # Seconds spent per stage across all songs (where the export time goes)
+            for stage, seconds in (result.get('timings') or {}).items():
+                if stage != 'cached':
+                    job['timings'][stage] = round(job['timings'].get(stage, 0) + seconds, 3)
+            job['current'] = result['filename']
+            job['version'] += 1
+            job['results'].append(result)
+            _store.save(job, result)
+            _changed.notify_all()
+    return on_progress
+
+
+def _run(job_id):
+    job = _jobs[job_id]
+    _update(job_id, status='running', started_at=time.time())
+
+    def on_plan(summary):
+        # First call: what an incremental sync is going to do, second call: what it did
+        if job['sync_plan'] is None:
+            _update(job_id, sync_plan=summary)
+        else:
+            _update(job_id, sync_result=summary)
+
+    try:
+        export_path, _ = copy_songs(job['songs'], progress=_progress_callback(job), on_plan=on_plan, **job['options'])
+        download_url = None
+        if job['format'] == 'zip':
+            download_url = f"/api/download/{os.path.basename(export_path)}"
+        _finish(job_id, status='done', export_path=export_path, download_url=download_url)
+    except Exception as e:
+        _finish(job_id, status='failed', error=str(e))
+
+
+def _new_job(selected_songs, export_format, status, options, stream=False):
+    """Register a job and return it"""
+    _store.prune(time.time() - EXPORT_JOB_RETENTION)
+    job = {
+        'id': uuid.uuid4().hex,
+        'status': status,
+        'format': export_format,
+        'stream': stream,
+        'total': len(selected_songs),
+        'completed': 0,
+        'failed': 0,
+        'bytes_written': 0,
+        'current': None,
+        'created_at': time.time(),
+        'started_at': None,
+        'finished_at': None,
+        'export_path': None,
+        'download_url': None,
+        'error': None,
+        'sync_plan': None,
+        'sync_result': None,
+        'timings': {},
+        'version': 0,
+        'results': [],
+        'songs': selected_songs,
+        'options': options,
+    }
+    _store.create(job)
+    return job
+
+
+def submit_export(selected_songs, export_format='folder', embed_covers=True, rename_files=True,
+                  transcode_profile='original', sync_folder=False, incremental=False, prune=False):
+    """Queue an export in the background and return its job id"""
+    if _shutting_down:
+        raise RuntimeError('The server is shutting down')
+    job = _new_job(selected_songs, export_format, 'queued', {
+        'export_format': export_format,
+        'embed_covers': embed_covers,
+        'rename_files': rename_files,
+        'transcode_profile': transcode_profile,
+        'sync_folder': sync_folder,
+        'incremental': incremental,
+        'prune': prune,
+    })
+    with _changed:
+        _jobs[job['id']] = job
+        _futures[job['id']] = _executor.submit(_run, job['id'])
+    return job['id']
+
+
+def submit_stream_export(selected_songs, rename_files=True, force_zip64=False, transcode_profile='original'):
+    """Register a streaming ZIP export; the archive is generated when it is downloaded"""
+    job = _new_job(selected_songs, 'zip', 'ready', {
+        'rename_files': rename_files,
+        'force_zip64': force_zip64,
+        'transcode_profile': transcode_profile,
+    }, stream=True)
+    job['download_url'] = f"/api/export/{job['id']}/download"
+    _store.save(job)
+    return job['id']
+
+
+def stream_job(job_id):
+    """Return a generator producing the ZIP of a streaming export job, or None if unknown"""
+    job = _store.load(job_id, include_private=True)
+    if job is None or not job['stream']:
+        return None
+
+    def generate():
+        # Every download regenerates the archive (in the process serving it), so progress restarts
+        with _changed:
+            _jobs[job_id] = job
+        _update(job_id, reset_results=True, status='running', started_at=time.time(), finished_at=None,
+                completed=0, failed=0, bytes_written=0, error=None, results=[], timings={})
+        try:
+            yield from stream_zip(job['songs'], progress=_progress_callback(job), **job['options'])
+            _finish(job_id, status='done')
+        except GeneratorExit:
+            _finish(job_id, status='failed', error='Download aborted')
+            raise
+        except Exception as e:
+            _finish(job_id, status='failed', error=str(e))
+            raise
+
+    return generate()
+
+
+def get_job(job_id, include_results=False):
+    """Return a snapshot of a job or None if it is unknown"""
+    job = _store.load(job_id, include_private=include_results)
+    if job is None:
+        return None
+    if job['status'] in ('queued', 'running') and job['owner'] != os.getpid() and not _alive(job['owner']):
+        # The process running it was killed before it could record the outcome
+        job.update(status='failed', error='Interrupted: the server process running this export stopped',
+                   finished_at=time.time(), current=None, version=job['version'] + 1)
+        _store.save(job)
+    view = _public(job)
+    if include_results:
+        view['results'] = job['results']
+    return view
+
+
+def wait_for_change(job_id, version, timeout=15):
+    """Block until the job's version differs from version (or timeout) and return its snapshot"""
+    deadline = time.monotonic() + timeout
+    with _changed:
+        while _store.version(job_id) == version:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Woken early by jobs of this process, polls for the others
+            _changed.wait(min(remaining, POLL_INTERVAL))
+    return get_job(job_id)
+
+
+def shutdown(timeout=30):
+    """Stop taking jobs, give running ones up to timeout seconds, and mark the rest failed.
+
+    Called when the server process exits, so clients polling from another
+    process see an outcome instead of a job that stays running forever.
+    """
+    global _shutting_down
+    _shutting_down = True
+    _executor.shutdown(wait=False, cancel_futures=True)
+    with _changed:
+        futures = list(_futures.values())
+    deadline = time.monotonic() + timeout
+    for future in futures:
+        if not future.cancelled():
+            try:
+                future.result(timeout=max(0, deadline - time.monotonic()))
+            except Exception:
+                pass
+    for job_id in _store.owned_unfinished():
+        with _changed:
+            job = _jobs.get(job_id)
+        if job is None:
+            job = _store.load(job_id, include_private=True)
+            with _changed:
+                _jobs[job_id] = job
+        _finish(job_id, status='failed', error='Interrupted: the server was shut down')
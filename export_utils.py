@@ -1,11 +1,17 @@
 import os
+import json
 import shutil
 import pathlib
+import time
 import zipfile
-import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from config import EXPORT_DIR, PUID, PGID
-from audio_utils import get_artist_and_title, embed_cover, copy_meatdata
+from config import EXPORT_DIR, SYNC_DIR, PUID, PGID, EXPORT_WORKERS
+from audio_utils import get_artist_and_title, embed_cover
+from disk_cache import clone_file
+import transcode
+import sync_index
+import metrics
 
 def apply_permissions(path):
     """Apply PUID and PGID permissions to a file or directory if set"""
@@ -43,8 +49,150 @@ def create_target_filename(source_path, original_filename, rename_files=True):
     
     return target_filename
 
-def copy_songs(selected_songs, export_format='folder', embed_covers=True, rename_files=True, song_downsampling=False, sync_folder=False):
-    """Copy selected songs to export directory"""
+def plan_exports(selected_songs, rename_files=True, transcode_profile='original'):
+    """Resolve the target filename of every selected song.
+
+    Names are assigned in selection order, so the output is deterministic:
+    if two songs end up with the same name (case-insensitive, for FAT/exFAT
+    targets), later ones get a " (2)", " (3)", ... suffix.
+    Returns a list of (song, source_path, target_filename) tuples.
+    """
+    used = set()
+    plan = []
+    for song in selected_songs:
+        source = pathlib.Path(song['url'])
+        target_filename = create_target_filename(source, song['filename'], rename_files)
+        target_filename = transcode.target_filename(source, target_filename, transcode_profile)
+
+        base, ext = os.path.splitext(target_filename)
+        candidate = target_filename
+        n = 2
+        while candidate.lower() in used:
+            candidate = f"{base} ({n}){ext}"
+            n += 1
+        used.add(candidate.lower())
+        plan.append((song, source, candidate))
+    return plan
+
+def export_song(source, target_path, embed_covers=True, transcode_profile='original'):
+    """Export a single song to target_path (copy or transcode, then tag).
+
+    Returns the seconds spent in each stage (see transcode.transcoded_path,
+    plus 'copy' and 'cover').
+    """
+    # only convert flac
+    if transcode.converts(source, transcode_profile):
+        # The cached conversion already has its tags and cover
+        converted, timings = transcode.transcoded_path(source, transcode_profile, embed_covers)
+        start = time.perf_counter()
+        # Hardlinking is safe since the exported file is never modified afterwards
+        method = clone_file(converted, target_path, allow_hardlink=True)
+        timings['copy'] = round(time.perf_counter() - start, 3)
+
+        # Delete the source if in place update
+        if os.path.dirname(source) == os.path.dirname(target_path):
+            # check if targes exists and is larger that 100Kb
+            if pathlib.Path(target_path).exists() and os.path.getsize(target_path) > 100000:
+                os.remove(source)
+    else:
+        # Copy file
+        start = time.perf_counter()
+        shutil.copy2(source, target_path)
+        timings = {'copy': round(time.perf_counter() - start, 3)}
+
+        if embed_covers:
+            start = time.perf_counter()
+            embed_cover(source, target_path)
+            timings['cover'] = round(time.perf_counter() - start, 3)
+        method = 'copy'
+    # Apply permissions to the copied file (a hardlink shares the cache entry's, set when it was cached)
+    if method != 'hardlink':
+        apply_permissions(target_path)
+    return timings
+
+def _export_result(source, target_filename, error=None, bytes_written=0, action=None, timings=None):
+    for stage, seconds in (timings or {}).items():
+        if stage != 'cached':
+            metrics.EXPORT_STAGE_SECONDS.observe(seconds, stage=stage)
+    return {
+        'source': str(source),
+        'filename': target_filename,
+        'success': error is None,
+        'error': error,
+        'bytes': bytes_written,
+        'action': action,
+        'timings': timings,
+    }
+
+def export_options_key(embed_covers=True, transcode_profile='original'):
+    """Serialize the options that change the content of an exported file (stored in the sync manifest)"""
+    options = {'embed_covers': bool(embed_covers), 'song_downsampling': transcode_profile != 'original'}
+    if transcode_profile not in ('original', transcode.DOWNSAMPLING_PROFILE):
+        # Records written before profiles existed stay valid for the two settings they could express
+        options['transcode_profile'] = transcode_profile
+    return json.dumps(options, sort_keys=True)
+
+def plan_sync(selected_songs, embed_covers=True, rename_files=True, transcode_profile='original', prune=False):
+    """Work out what an incremental export to the sync folder has to do.
+
+    A song is skipped if the manifest says its target file was written from
+    a source with the same size and mtime using the same options, and the
+    file is still there. Otherwise it is added (target missing) or updated.
+    With prune, audio files in the sync folder that none of the selected
+    songs map to are removed.
+    Returns {'songs': [(action, song, source, target_filename, stat)], 'remove': [filenames]}.
+    """
+    options = export_options_key(embed_covers, transcode_profile)
+    existing = {name.casefold(): name for name in sync_index.current_files()}
+    planned = []
+    for song, source, target_filename in plan_exports(selected_songs, rename_files, transcode_profile):
+        try:
+            st = source.stat()
+        except OSError:
+            planned.append(('missing', song, source, target_filename, None))
+            continue
+        record = sync_index.manifest_record(source)
+        if target_filename.casefold() not in existing:
+            action = 'add'
+        elif (record is not None and record['filename'].casefold() == target_filename.casefold()
+              and record['size'] == st.st_size and record['mtime_ns'] == st.st_mtime_ns
+              and record['options'] == options):
+            action = 'skip'
+        else:
+            action = 'update'
+        planned.append((action, song, source, target_filename, st))
+
+    remove = []
+    if prune:
+        keep = {target_filename.casefold() for _, _, _, target_filename, _ in planned}
+        remove = sorted(name for folded, name in existing.items() if folded not in keep)
+    return {'songs': planned, 'remove': remove}
+
+def summarize_sync_plan(plan):
+    """Count the actions of a plan_sync result"""
+    summary = {'add': 0, 'update': 0, 'skip': 0, 'missing': 0, 'remove': len(plan['remove'])}
+    for action, *_ in plan['songs']:
+        summary[action] += 1
+    return summary
+
+def copy_songs(selected_songs, export_format='folder', embed_covers=True, rename_files=True, transcode_profile='original', sync_folder=False, progress=None,
+               incremental=False, prune=False, on_plan=None):
+    """Copy selected songs to export directory.
+
+    Returns a tuple of (export_path, results) where results holds one dict per
+    selected song (in selection order) with its target filename and outcome.
+    If given, progress is called with each result as soon as that song is done.
+
+    With sync_folder and incremental, unchanged songs are skipped and, with
+    prune, files no longer selected are removed (see plan_sync). on_plan is
+    then called with the planned action counts before anything is written
+    and with the actual counts at the end.
+    """
+    def report(result):
+        if progress is not None:
+            progress(result)
+        return result
+
     if not os.path.exists(EXPORT_DIR):
         os.makedirs(EXPORT_DIR)
     
@@ -52,25 +200,26 @@ def copy_songs(selected_songs, export_format='folder', embed_covers=True, rename
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         zip_filename = f"music_export_{timestamp}.zip"
         zip_path = os.path.join(EXPORT_DIR, zip_filename)
+        results = []
         
         with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for song in selected_songs:
-                source = pathlib.Path(song['url'])
-                
+            for song, source, target_filename in plan_exports(selected_songs, rename_files, transcode_profile):
                 if not source.exists():
+                    results.append(report(_export_result(source, target_filename, 'Source file not found')))
                     continue
-                
-                # Create target filename
-                target_filename = create_target_filename(source, song['filename'], rename_files)
-                
-                # Add to zip
-                zipf.write(source, target_filename)
+                try:
+                    archived, timings = _archived_file(source, transcode_profile)
+                    zipf.write(archived, target_filename)
+                    results.append(report(_export_result(source, target_filename, bytes_written=os.path.getsize(archived),
+                                                         timings=timings)))
+                except Exception as e:
+                    results.append(report(_export_result(source, target_filename, str(e))))
         
-        return zip_path
+        return zip_path, results
     else:
         # Export to folder
         if sync_folder:
-            export_folder = os.path.join(EXPORT_DIR, "sync")
+            export_folder = SYNC_DIR
         else:
             timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             export_folder = os.path.join(EXPORT_DIR, f"music_export_{timestamp}")
@@ -79,63 +228,122 @@ def copy_songs(selected_songs, export_format='folder', embed_covers=True, rename
         
         # Apply permissions to the export folder
         apply_permissions(export_folder)
+
+        options = export_options_key(embed_covers, transcode_profile)
+
+        def run(action, source, target_filename):
+            if action == 'skip':
+                return _export_result(source, target_filename, action=action)
+            try:
+                st = source.stat()
+            except OSError:
+                return _export_result(source, target_filename, 'Source file not found', action=action)
+            target_path = os.path.join(export_folder, target_filename)
+            try:
+                timings = export_song(source, target_path, embed_covers, transcode_profile)
+                if sync_folder:
+                    sync_index.record_export(source, target_filename, st.st_size, st.st_mtime_ns, options)
+                return _export_result(source, target_filename, bytes_written=os.path.getsize(target_path), action=action,
+                                      timings=timings)
+            except Exception as e:
+                return _export_result(source, target_filename, str(e), action=action)
+
+        remove = []
+        if sync_folder and incremental:
+            sync_plan = plan_sync(selected_songs, embed_covers, rename_files, transcode_profile, prune)
+            if on_plan is not None:
+                on_plan(summarize_sync_plan(sync_plan))
+            plan = [(action, source, target_filename) for action, _, source, target_filename, _ in sync_plan['songs']]
+            remove = sync_plan['remove']
+        else:
+            plan = [(None, source, target_filename)
+                    for _, source, target_filename in plan_exports(selected_songs, rename_files, transcode_profile)]
+
+        results = [None] * len(plan)
+        with ThreadPoolExecutor(max_workers=max(1, EXPORT_WORKERS)) as pool:
+            futures = {pool.submit(run, *job): i for i, job in enumerate(plan)}
+            for future in as_completed(futures):
+                results[futures[future]] = report(future.result())
+
+        if sync_folder and incremental:
+            removed = []
+            for filename in remove:
+                try:
+                    os.remove(os.path.join(export_folder, filename))
+                    removed.append(filename)
+                except OSError as e:
+                    print(f"Error removing {filename} from sync folder: {e}")
+            sync_index.forget_files(removed)
+            if on_plan is not None:
+                summary = {'add': 0, 'update': 0, 'skip': 0, 'missing': 0, 'failed': 0, 'remove': len(removed)}
+                for result in results:
+                    if not result['success']:
+                        summary['failed'] += 1
+                    else:
+                        summary[result['action']] += 1
+                on_plan(summary)
+        if sync_folder:
+            sync_index.refresh_listing()
         
-        for song in selected_songs:
-            source = pathlib.Path(song['url'])
-            
+        return export_folder, results
+
+class _StreamBuffer:
+    """Write-only, unseekable file object collecting what ZipFile writes so it can be yielded"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def _archived_file(source, transcode_profile='original'):
+    """Return (file to put in a ZIP for source, timings): its cached conversion if the profile converts it"""
+    if transcode.converts(source, transcode_profile):
+        return transcode.transcoded_path(source, transcode_profile)
+    return source, {}
+
+def stream_zip(selected_songs, rename_files=True, force_zip64=False, transcode_profile='original', progress=None,
+               chunk_size=1024 * 1024):
+    """Generate a ZIP archive of the selected songs on the fly, yielding it chunk by chunk.
+
+    Entries are stored uncompressed (audio doesn't deflate) and only
+    converted songs touch the disk (through the transcode cache). ZIP64
+    records are used automatically where sizes need them; force_zip64 uses
+    them for every entry.
+    """
+    buf = _StreamBuffer()
+    with zipfile.ZipFile(buf, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zipf:
+        for song, source, target_filename in plan_exports(selected_songs, rename_files, transcode_profile):
             if not source.exists():
+                if progress is not None:
+                    progress(_export_result(source, target_filename, 'Source file not found'))
                 continue
-            
-            # Create target filename
-            target_filename = create_target_filename(source, song['filename'], rename_files)
-            target_path = os.path.join(export_folder, target_filename)
-
             try:
-                # only convert flac
-                if song_downsampling and pathlib.Path(source).suffix.lower() == ".flac":
-
-                    # Change file extension / overwrite target_path
-                    base, _ = os.path.splitext(target_filename)
-                    target_filename = base + '.mp3'
-                    target_path = os.path.join(export_folder, target_filename)
-
-                    # Start FLAC decoder (write PCM to stdout)
-                    flac_proc = subprocess.Popen(
-                        ["flac", "-dcs", "--", source],
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.DEVNULL,
-                    )
-
-                    # Start LAME encoder (read PCM from stdin)
-                    lame_proc = subprocess.run(
-                        ["lame", "-S", "-V", "0", "--vbr-new", "--add-id3v2", "--ignore-tag-errors", "-", target_path],
-                        stdin=flac_proc.stdout,
-                        stdout=subprocess.DEVNULL,
-                        stderr=subprocess.DEVNULL,
-                        check=True,
-                    )
-
-                    # Close the FLAC process's stdout to signal EOF
-                    flac_proc.stdout.close()
-                    flac_proc.wait()
-
-                    # Copy metadata
-                    copy_meatdata(source, target_path)
-
-                    # Delete the source if in place update
-                    if os.path.dirname(source) == os.path.dirname(target_path):
-                        # check if targes exists and is larger that 100Kb
-                        if pathlib.Path(target_path).exists() and os.path.getsize(target_path) > 100000:
-                            os.remove(source)
-                else:
-                    # Copy file
-                    shutil.copy2(source, target_path)
-
-                if embed_covers:
-                    embed_cover(source, target_path)
-                # Apply permissions to the copied file
-                apply_permissions(target_path)
+                archived, timings = _archived_file(source, transcode_profile)
             except Exception as e:
-                print(f"Error copying {source}: {e}")
-        
-        return export_folder 
\ No newline at end of file
+                if progress is not None:
+                    progress(_export_result(source, target_filename, str(e)))
+                continue
+            zinfo = zipfile.ZipInfo.from_file(archived, target_filename, strict_timestamps=False)
+            zinfo.compress_type = zipfile.ZIP_STORED
+            with open(archived, 'rb') as src, zipf.open(zinfo, 'w', force_zip64=force_zip64) as dst:
+                while True:
+                    chunk = src.read(chunk_size)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+                    yield buf.drain()
+            if progress is not None:
+                progress(_export_result(source, target_filename, bytes_written=zinfo.file_size, timings=timings))
+            yield buf.drain()
+    # Central directory
+    yield buf.drain()
@@ -0,0 +1,44 @@
+# Production server settings, read by "gunicorn app:app" (see the Dockerfile).
+# Every setting can be overridden through the environment.
+import os
+import sys
+
+# The master imports app modules in its hooks before any worker has loaded the app
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+
+# Each worker is a process with its own query snapshot and thread pool; export
+# jobs, the sync manifest, the cover/transcode caches, metrics and the library
+# status are shared on disk, and one worker at a time warms covers after rescans.
+# The track snapshot is NOT shared: every worker holds (and rebuilds after each
+# rescan) its own copy, roughly 120 MB and 2.5 s of CPU per 200k tracks, so
+# memory grows with the worker count. Hence fewer workers by default with it.
+workers = int(os.environ.get('WEB_WORKERS', min(2 if os.environ.get('LMS_TRACK_SNAPSHOT', '1') == '1' else 4,
+                                                os.cpu_count() or 1)))
+# Threads per worker: event streams and ZIP downloads each hold one for their whole duration
+worker_class = 'gthread'
+threads = int(os.environ.get('WEB_THREADS', 16))
+
+# Long ZIP downloads are fine: gthread workers heartbeat independently of requests
+timeout = int(os.environ.get('WEB_TIMEOUT', 120))
+# On SIGTERM, in-flight requests and running exports get this long before workers are killed
+graceful_timeout = int(os.environ.get('WEB_GRACEFUL_TIMEOUT', 60))
+keepalive = 5
+
+accesslog = '-' if os.environ.get('WEB_ACCESS_LOG', '0') == '1' else None
+errorlog = '-'
+
+
+def on_starting(server):
+    """Start the metrics of this run from zero (workers add up their values in METRICS_DIR)"""
+    import metrics
+    metrics.clear_shared()
+
+
+def worker_exit(server, worker):
+    """Let running exports of the exiting worker finish, or record them as interrupted"""
+    import export_jobs
+    import metrics
+    export_jobs.shutdown(timeout=max(1, graceful_timeout // 2))
+    metrics.flush()
@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import threading
+from pathlib import Path
+from config import LIBRARY_POLL_SECONDS, LIBRARY_WATCHER_LOCK, LIBRARY_STATUS_FILE
+import cover_cache
+import database
+
+
+class LibraryWatcher:
+    """Notices LMS rescans and refreshes what depends on the library.
+
+    Polls the modification times of persist.db/library.db (inotify doesn't
+    see changes made through bind mounts from other containers). Once they
+    have stopped changing for a poll interval, so a running scan isn't
+    chased, the query state is rebuilt and swapped in (see
+    database.refresh_query_state) and the cover thumbnails of album
+    directories that weren't in the library before are rendered, so the
+    first search after a rescan is as fast as any other.
+
+    Every web worker keeps its own query state fresh, but only the one
+    holding LIBRARY_WATCHER_LOCK renders covers (the others would render
+    the same ones) and publishes the status read by all of them. When it
+    exits, another worker takes the lock over at its next poll.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._thread = None
+        self._stop = threading.Event()
+        # Album directories seen at the last refresh (None until the first one)
+        self._directories = None
+        self._status = {
+            'refreshing': False,
+            'last_refresh': None,
+            'duration': None,
+            'tracks': None,
+            'new_albums': 0,
+            'covers_warmed': 0,
+            'covers_duration': None,
+            'error': None,
+        }
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or self.interval <= 0:
+                return
+            database.leave_refreshes_to_watcher()
+            self._thread = threading.Thread(target=self._run, name='library-watcher', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def status(self):
+        if self._lock_file is None:
+            try:
+                with open(LIBRARY_STATUS_FILE) as f:
+                    return json.load(f)
+            except (OSError, ValueError):
+                pass
+        with self._lock:
+            return dict(self._status)
+
+    def _update(self, **changes):
+        with self._lock:
+            self._status.update(changes)
+            status = dict(self._status)
+        if self._lock_file is not None:
+            try:
+                with open(f"{LIBRARY_STATUS_FILE}.tmp", 'w') as f:
+                    json.dump(status, f)
+                os.replace(f"{LIBRARY_STATUS_FILE}.tmp", LIBRARY_STATUS_FILE)
+            except OSError as e:
+                print(f"Error writing library status: {e}")
+
+    def _take_lead(self):
+        """Try to become the worker that warms covers; True if this one is (or has no rivals to coordinate with)"""
+        if self._lock_file is not None:
+            return True
+        try:
+            import fcntl
+        except ImportError:
+            self._lock_file = True
+            return True
+        try:
+            os.makedirs(os.path.dirname(LIBRARY_WATCHER_LOCK), exist_ok=True)
+            lock_file = open(LIBRARY_WATCHER_LOCK, 'a')
+        except OSError as e:
+            print(f"Error opening {LIBRARY_WATCHER_LOCK}: {e}")
+            return False
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        # Held (and released by the OS when this process exits) for the rest of its life
+        self._lock_file = lock_file
+        return True
+
+    def _run(self):
+        refreshed = None
+        seen = None
+        while True:
+            self._take_lead()
+            try:
+                generation = database.db_generation()
+            except FileNotFoundError as e:
+                self._update(error=str(e))
+                generation = None
+            # Refresh at startup, then once a change has settled for one interval
+            if generation is not None and generation != refreshed and (refreshed is None or generation == seen):
+                self.refresh()
+                refreshed = generation
+            seen = generation
+            if self._stop.wait(self.interval):
+                return
+
+    def refresh(self):
+        """Rebuild the query state and warm the covers of new albums; returns the status"""
+        self._update(refreshing=True)
+        try:
+            start = time.perf_counter()
+            snapshot = database.refresh_query_state()
+            directories = {os.path.dirname(path) for path in database.track_paths(snapshot)}
+            duration = time.perf_counter() - start
+            self._update(last_refresh=time.time(), duration=round(duration, 3), error=None,
+                         tracks=len(snapshot) if snapshot is not None else None)
+
+            # At startup everything is "new": covers are rendered on demand instead
+            new_directories = directories - self._directories if self._directories is not None else set()
+            self._directories = directories
+            if not self._take_lead():
+                return self.status()
+            start = time.perf_counter()
+            warmed = sum(1 for directory in sorted(new_directories) if cover_cache.warm_directory(Path(directory)))
+            self._update(new_albums=len(new_directories), covers_warmed=warmed,
+                         covers_duration=round(time.perf_counter() - start, 3))
+        except Exception as e:
+            print(f"Error refreshing library state: {e}")
+            self._update(error=str(e))
+        finally:
+            self._update(refreshing=False)
+        return self.status()
+
+
+_watcher = LibraryWatcher(LIBRARY_POLL_SECONDS)
+
+
+def start():
+    """Start watching the LMS database in the background (no-op if disabled or already running)"""
+    _watcher.start()
+
+
+def status():
+    """Return when the library state was last refreshed, how long it took and what changed"""
+    return _watcher.status()
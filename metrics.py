@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from config import METRICS_DIR, METRICS_FLUSH_SECONDS
+
+# Upper bounds (seconds) of the latency histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics = []
+# Whether this process has observations not yet written to its file in METRICS_DIR
+_dirty = False
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """A monotonically increasing value per label set, in Prometheus terms"""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+        _changed()
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(values, key, value):
+        values[key] = values.get(key, 0) + value
+
+    def render(self, values):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """Observed durations per label set, counted in cumulative buckets like prometheus_client does"""
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+        _changed()
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(s, buckets=list(s['buckets'])) for key, s in self._series.items()}
+
+    @staticmethod
+    def merge(values, key, value):
+        series = values.get(key)
+        if series is None:
+            values[key] = dict(value, buckets=list(value['buckets']))
+        elif len(series['buckets']) == len(value['buckets']):
+            series['buckets'] = [a + b for a, b in zip(series['buckets'], value['buckets'])]
+            series['sum'] += value['sum']
+            series['count'] += value['count']
+
+    def render(self, values):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, s in sorted(values.items()):
+            for bound, count in zip(self.buckets, s['buckets']):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', repr(bound))])} {count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', '+Inf')])} {s['count']}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {s['sum']!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {s['count']}")
+        return lines
+
+
+def _changed():
+    """Note new observations and make sure this process flushes them (each web worker has its own flusher)"""
+    global _dirty, _flusher_pid
+    _dirty = True
+    if _flusher_pid != os.getpid():
+        with _flusher_lock:
+            if _flusher_pid != os.getpid():
+                _flusher_pid = os.getpid()
+                threading.Thread(target=_flush_periodically, name='metrics-flush', daemon=True).start()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(METRICS_FLUSH_SECONDS)
+        if _dirty:
+            flush()
+
+
+def _local_values():
+    return {metric.name: metric.snapshot() for metric in _metrics}
+
+
+def flush(values=None):
+    """Write this process's metric values to its file in METRICS_DIR, for /metrics in any worker to sum up"""
+    global _dirty
+    _dirty = False
+    values = _local_values() if values is None else values
+    data = {name: [[list(key), value] for key, value in series.items()] for name, series in values.items()}
+    path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        with open(f"{path}.tmp", 'w') as f:
+            json.dump(data, f)
+        os.replace(f"{path}.tmp", path)
+    except OSError as e:
+        print(f"Error writing metrics to {path}: {e}")
+        return False
+    return True
+
+
+def clear_shared():
+    """Forget the values of earlier server runs (call once, before the web workers start)"""
+    try:
+        for name in os.listdir(METRICS_DIR):
+            os.remove(os.path.join(METRICS_DIR, name))
+    except OSError:
+        pass
+
+
+def _collect():
+    """Return {metric name: {label values: value}} summed over every process that wrote to METRICS_DIR.
+
+    Files of exited workers are kept, so counters never go down while the server runs.
+    """
+    local = _local_values()
+    if not flush(local):
+        return local
+    merged = {metric.name: {} for metric in _metrics}
+    for name in os.listdir(METRICS_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name)) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for metric in _metrics:
+            for key, value in data.get(metric.name, []):
+                metric.merge(merged[metric.name], tuple(key), value)
+    return merged
+
+
+def render():
+    """Return every metric, summed over all web workers, in the Prometheus text exposition format"""
+    values = _collect()
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render(values.get(metric.name, {})))
+    return "\n".join(lines) + "\n"
+
+
+HTTP_REQUEST_SECONDS = Histogram('lms_mixtape_http_request_seconds', 'Time to produce a response, per route',
+                                 ('route', 'method', 'status'))
+QUERY_SECONDS = Histogram('lms_mixtape_query_seconds', 'Time to fetch one page of songs (SQL or track snapshot)',
+                          ('backend', 'order_by'))
+QUERY_ROWS = Counter('lms_mixtape_query_rows_total', 'Song rows returned by queries', ('backend', 'order_by'))
+TAG_PARSE_SECONDS = Histogram('lms_mixtape_tag_parse_seconds', 'Time mutagen spent opening and parsing a file',
+                              ('purpose',))
+COVER_RESIZE_SECONDS = Histogram('lms_mixtape_cover_resize_seconds', 'Time to render a cover thumbnail',
+                                 ('size', 'format'))
+EXPORT_STAGE_SECONDS = Histogram('lms_mixtape_export_stage_seconds', 'Time spent per song in each export stage',
+                                 ('stage',))
+ENCODER_SECONDS = Histogram('lms_mixtape_encoder_seconds', 'Run time of the decoder and encoder processes',
+                            ('profile', 'process'))
+
+# Per-request breakdown of where the time went (see start_profile)
+_profile = threading.local()
+
+
+def start_profile():
+    """Start collecting a timing breakdown for the current thread's request"""
+    _profile.entries = {}
+
+
+def record(name, seconds):
+    """Add seconds to name in the current thread's profile, if one is being collected"""
+    entries = getattr(_profile, 'entries', None)
+    if entries is not None:
+        total, count = entries.get(name, (0.0, 0))
+        entries[name] = (total + seconds, count + 1)
+
+
+def finish_profile():
+    """Stop collecting and return {name: (seconds, count)} for the current thread (or None)"""
+    entries = getattr(_profile, 'entries', None)
+    _profile.entries = None
+    return entries
+
+
+def server_timing(entries, total=None):
+    """Format a profile as a Server-Timing header value (durations in milliseconds)"""
+    parts = [f'{name};dur={seconds * 1000:.2f};desc="{count}x"' for name, (seconds, count) in sorted(entries.items())]
+    if total is not None:
+        parts.append(f"total;dur={total * 1000:.2f}")
+    return ", ".join(parts)
+
+
+@contextmanager
+def timed(histogram, profile_name=None, **labels):
+    """Observe the duration of the block in histogram and in the current request's profile"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        histogram.observe(seconds, **labels)
+        record(profile_name or histogram.name.replace('lms_mixtape_', '').replace('_seconds', ''), seconds)
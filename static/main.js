@@ -2,6 +2,13 @@
 let songs = [];
 let selectedSongs = new Set();
 let viewMode = 'search'; // 'search' or 'sync'
+const PAGE_SIZE = 100;
+let queryRequest = null; // filters of the current search, reused for the following pages
+let queryCursor = null; // cursor of the next page, null when everything is loaded
+let loadingPage = null; // promise of the page request in flight
+let syncQuery = null; // filter and sort of the sync folder listing
+let syncNextOffset = null; // offset of the next sync folder page, null when everything is loaded
+let syncTotal = 0; // number of files matching the sync folder filter
 
 // Utility functions
 function showAlert(message, type = 'info') {
@@ -24,7 +31,7 @@ function showAlert(message, type = 'info') {
 }
 
 function updateStats() {
-    document.getElementById('totalSongs').textContent = songs.length;
+    document.getElementById('totalSongs').textContent = viewMode === 'sync' ? syncTotal : songs.length;
     document.getElementById('selectedSongs').textContent = selectedSongs.size;
     
     // Show/hide delete button in sync view when songs are selected
@@ -61,42 +68,305 @@ function renderStars(rating, idPrefix = '') {
     return html;
 }
 
-function renderSongs() {
-    const container = document.getElementById('songsContainer');
-    container.innerHTML = '';
-    songs.forEach((song, index) => {
-        const songElement = document.createElement('div');
-        songElement.className = `song-item ${selectedSongs.has(index) ? 'selected' : ''}`;
-        songElement.setAttribute('data-index', index);
-        const numericRating = typeof song.rating === 'number' ? song.rating : parseFloat(song.rating || '0');
-        const rating0to5 = Math.min(5, Math.round((numericRating / 20) * 2) / 2);
-        const ratingLabel = Number.isInteger(rating0to5) ? String(rating0to5) : rating0to5.toFixed(1);
-        const ratingChipHtml = rating0to5 > 0 ? `<span class="rating-chip"><span class="material-icons">star</span>${ratingLabel}</span>` : '';
-        songElement.innerHTML = `
-            <img class="song-cover" src="${song.cover_url}" alt="Cover" onerror="this.onerror=null;this.src='/static/default-cover.png';">
-            <div class="song-info">
-                <div class="song-title">
-                    ${song.title || 'Unknown Title'}
-                    ${song.exists_in_sync ? '<span class="exists-marker" title="Already in sync folder"><span class="dot"></span></span>' : ''}
-                </div>
-                <div class="song-details" role="list">
-                    <span class="meta-item" role="listitem"><span class="meta-label">Artist</span><span class="meta-value">${trimCustom(song.artist) || 'Unknown Artist'}</span></span>
-                    <span class="meta-item" role="listitem"><span class="meta-label">Album</span><span class="meta-value">${trimCustom(song.album) || 'Unknown Album'}</span></span>
-                    ${song.year ? `<span class="meta-item" role="listitem"><span class="meta-label">Year</span><span class="meta-value">${song.year}</span></span>` : ''}
-                    ${song.filesize != null ? `<span class="meta-item" role="listitem"><span class="meta-value">${song.filesize}</span><span class="meta-label">MB</span></span>` : ''}
-                    ${song.filetype != null ? `<span class="meta-item" role="listitem"><span class="meta-label">${song.filetype}</span></span>` : ''}
-                    ${song.dyn_ps_val !== null && song.dyn_ps_val !== 0 ? `<span class="meta-item" role="listitem"><span class="meta-label">Dynamic</span><span class="meta-value">${song.dyn_ps_val}</span></span>` : ''}
-                </div>
+function createSongElement(song, index) {
+    const songElement = document.createElement('div');
+    songElement.className = `song-item ${selectedSongs.has(index) ? 'selected' : ''}`;
+    songElement.setAttribute('data-index', index);
+    const numericRating = typeof song.rating === 'number' ? song.rating : parseFloat(song.rating || '0');
+    const rating0to5 = Math.min(5, Math.round((numericRating / 20) * 2) / 2);
+    const ratingLabel = Number.isInteger(rating0to5) ? String(rating0to5) : rating0to5.toFixed(1);
+    const ratingChipHtml = rating0to5 > 0 ? `<span class="rating-chip"><span class="material-icons">star</span>${ratingLabel}</span>` : '';
+    songElement.innerHTML = `
+        <img class="song-cover" src="${COVER_PLACEHOLDER}" data-src="${song.cover_url}" data-srcset="${coverSrcset(song.cover_url)}" sizes="96px" alt="Cover">
+        <div class="song-info">
+            <div class="song-title">
+                ${song.title || 'Unknown Title'}
+                ${song.exists_in_sync ? '<span class="exists-marker" title="Already in sync folder"><span class="dot"></span></span>' : ''}
             </div>
-            <div class="song-rating">
-                ${ratingChipHtml}
+            <div class="song-details" role="list">
+                <span class="meta-item" role="listitem"><span class="meta-label">Artist</span><span class="meta-value">${trimCustom(song.artist) || 'Unknown Artist'}</span></span>
+                <span class="meta-item" role="listitem"><span class="meta-label">Album</span><span class="meta-value">${trimCustom(song.album) || 'Unknown Album'}</span></span>
+                ${song.year ? `<span class="meta-item" role="listitem"><span class="meta-label">Year</span><span class="meta-value">${song.year}</span></span>` : ''}
+                ${song.filesize != null ? `<span class="meta-item" role="listitem"><span class="meta-value">${song.filesize}</span><span class="meta-label">MB</span></span>` : ''}
+                ${song.filetype != null ? `<span class="meta-item" role="listitem"><span class="meta-label">${song.filetype}</span></span>` : ''}
+                ${song.dyn_ps_val !== null && song.dyn_ps_val !== 0 ? `<span class="meta-item" role="listitem"><span class="meta-label">Dynamic</span><span class="meta-value">${song.dyn_ps_val}</span></span>` : ''}
             </div>
-        `;
-        container.appendChild(songElement);
+        </div>
+        <div class="song-rating">
+            ${ratingChipHtml}
+        </div>
+    `;
+    observeCover(songElement.querySelector('.song-cover'));
+    return songElement;
+}
+
+// Covers load when they come near the viewport, at most MAX_COVER_REQUESTS at a time
+const MAX_COVER_REQUESTS = 6;
+const COVER_PLACEHOLDER = 'data:image/gif;base64,R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7';
+let coverQueue = []; // images in view waiting for a free request slot
+let coverRequests = 0; // cover requests in flight
+const loadedCoverUrls = new Set(); // already in the browser cache; shown without queueing
+const COVER_SIZES = [64, 128, 256, 512]; // thumbnail widths the server renders (COVER_SIZES in config.py)
+
+// Let the browser pick the thumbnail matching the displayed size and pixel density
+function coverSrcset(url) {
+    return COVER_SIZES.map((size) => `${url}&size=${size} ${size}w`).join(', ');
+}
+
+function showCover(img) {
+    img.srcset = img.dataset.srcset;
+    img.src = img.dataset.src;
+}
+
+const coverObserver = new IntersectionObserver((entries) => {
+    entries.forEach((entry) => {
+        const img = entry.target;
+        if (entry.isIntersecting) {
+            coverObserver.unobserve(img);
+            coverQueue.push(img);
+        }
     });
+    pumpCovers();
+}, { rootMargin: '200px' });
+
+function observeCover(img) {
+    if (loadedCoverUrls.has(img.dataset.src)) {
+        showCover(img);
+    } else {
+        coverObserver.observe(img);
+    }
+}
+
+function pumpCovers() {
+    while (coverRequests < MAX_COVER_REQUESTS && coverQueue.length > 0) {
+        startCover(coverQueue.shift());
+    }
+}
+
+function startCover(img) {
+    const url = img.dataset.src;
+    if (!img.isConnected) {
+        return;
+    }
+    if (loadedCoverUrls.has(url)) {
+        showCover(img);
+        return;
+    }
+    coverRequests++;
+    let finished = false;
+    const done = (loaded) => {
+        if (finished) {
+            return;
+        }
+        finished = true;
+        coverRequests--;
+        if (loaded) {
+            loadedCoverUrls.add(url);
+        } else {
+            img.removeAttribute('srcset');
+            img.src = '/static/default-cover.png';
+        }
+        pumpCovers();
+    };
+    img.onload = () => done(true);
+    img.onerror = () => done(false);
+    showCover(img);
+}
+
+// Sentinel at the end of the list; loads the next page when it scrolls into view
+const pageSentinel = document.createElement('div');
+pageSentinel.className = 'page-sentinel';
+const pageObserver = new IntersectionObserver((entries) => {
+    if (entries[0].isIntersecting) {
+        loadNextPage();
+    }
+}, { rootMargin: '400px' });
+pageObserver.observe(pageSentinel);
+
+function renderSongs() {
+    const container = document.getElementById('songsContainer');
+    container.innerHTML = '';
+    coverObserver.disconnect();
+    coverQueue = [];
+    appendSongs(0);
+}
+
+// Render songs[fromIndex..] below the already rendered ones
+function appendSongs(fromIndex) {
+    const container = document.getElementById('songsContainer');
+    const fragment = document.createDocumentFragment();
+    for (let index = fromIndex; index < songs.length; index++) {
+        fragment.appendChild(createSongElement(songs[index], index));
+    }
+    container.appendChild(fragment);
+    // Keep the sentinel last while more pages can be loaded
+    if (hasMorePages()) {
+        container.appendChild(pageSentinel);
+    } else if (pageSentinel.parentNode) {
+        pageSentinel.remove();
+    }
     updateStats();
 }
 
+async function fetchSongsPage(cursor) {
+    const response = await fetch('/api/query', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ ...queryRequest, page_size: PAGE_SIZE, cursor })
+    });
+    return response.json();
+}
+
+async function fetchSyncPage(offset) {
+    const params = new URLSearchParams({ ...syncQuery, offset, page_size: PAGE_SIZE });
+    const response = await fetch(`/api/sync/list?${params}`);
+    return response.json();
+}
+
+function hasMorePages() {
+    return viewMode === 'search' ? Boolean(queryCursor) : syncNextOffset !== null;
+}
+
+function loadNextPage() {
+    if (!hasMorePages()) {
+        return Promise.resolve();
+    }
+    if (!loadingPage) {
+        const mode = viewMode;
+        const request = mode === 'search' ? queryRequest : syncQuery;
+        const page = mode === 'search' ? fetchSongsPage(queryCursor) : fetchSyncPage(syncNextOffset);
+        loadingPage = page.then((data) => {
+            // Ignore pages of a search or listing that has been replaced meanwhile
+            if (viewMode !== mode || request !== (mode === 'search' ? queryRequest : syncQuery)) {
+                return;
+            }
+            if (data.success) {
+                const fromIndex = songs.length;
+                songs.push(...data.songs);
+                if (mode === 'search') {
+                    queryCursor = data.cursor;
+                } else {
+                    syncNextOffset = data.next_offset;
+                }
+                appendSongs(fromIndex);
+            } else {
+                if (mode === 'search') {
+                    queryCursor = null;
+                } else {
+                    syncNextOffset = null;
+                }
+                showAlert(`Error: ${data.error}`, 'error');
+            }
+        }).catch((error) => {
+            showAlert(`Network error: ${error.message}`, 'error');
+        }).finally(() => {
+            loadingPage = null;
+        });
+    }
+    return loadingPage;
+}
+
+async function loadAllPages() {
+    while (hasMorePages()) {
+        await loadNextPage();
+    }
+}
+
+// Load the first page of the sync folder listing with the current filter and sort
+async function loadSyncFolder() {
+    const request = {
+        q: document.getElementById('syncFilter').value.trim(),
+        sort: document.getElementById('syncSort').value
+    };
+    syncQuery = request;
+    const data = await fetchSyncPage(0);
+    // A newer filter may have been typed while this page was loading
+    if (request === syncQuery && data.success) {
+        viewMode = 'sync';
+        songs = data.songs || [];
+        syncNextOffset = data.next_offset;
+        syncTotal = data.total;
+        selectedSongs.clear();
+        document.getElementById('syncListControls').style.display = 'flex';
+        renderSongs();
+    }
+    return data;
+}
+
+function formatBytes(bytes) {
+    if (bytes >= 1024 * 1024 * 1024) return `${(bytes / (1024 * 1024 * 1024)).toFixed(1)} GB`;
+    if (bytes >= 1024 * 1024) return `${(bytes / (1024 * 1024)).toFixed(0)} MB`;
+    return `${Math.round(bytes / 1024)} KB`;
+}
+
+function formatDuration(seconds) {
+    const s = Math.max(0, Math.round(seconds));
+    return `${Math.floor(s / 60)}:${String(s % 60).padStart(2, '0')}`;
+}
+
+function renderExportProgress(job) {
+    const progress = document.getElementById('exportProgress');
+    progress.style.display = 'block';
+    const percent = job.total > 0 ? Math.round((job.completed / job.total) * 100) : 0;
+    document.getElementById('exportProgressFill').style.width = `${percent}%`;
+    let text = job.status === 'queued' ? 'Waiting for other exports...' : `${job.completed}/${job.total} songs, ${formatBytes(job.bytes_written)}`;
+    if (job.eta_seconds != null) {
+        text += `, ETA ${formatDuration(job.eta_seconds)}`;
+    }
+    if (job.current) {
+        text += ` — ${job.current}`;
+    }
+    document.getElementById('exportProgressText').textContent = text;
+    document.getElementById('exportBtn').innerHTML = `<span class="material-icons rotating">refresh</span> Exporting ${percent}%`;
+}
+
+// Follow an export job until it finishes; resolves with the final job state
+function followExportJob(started) {
+    return new Promise((resolve, reject) => {
+        const finished = (job) => job.status === 'done' || job.status === 'failed';
+
+        const poll = async () => {
+            try {
+                const res = await fetch(started.status_url);
+                const data = await res.json();
+                if (!data.success) {
+                    reject(new Error(data.error));
+                    return;
+                }
+                renderExportProgress(data.job);
+                if (finished(data.job)) {
+                    resolve(data.job);
+                } else {
+                    setTimeout(poll, 1000);
+                }
+            } catch (e) {
+                reject(e);
+            }
+        };
+
+        if (!window.EventSource) {
+            poll();
+            return;
+        }
+        const events = new EventSource(started.events_url);
+        events.onmessage = (e) => {
+            const job = JSON.parse(e.data);
+            renderExportProgress(job);
+            if (finished(job)) {
+                events.close();
+                resolve(job);
+            }
+        };
+        events.onerror = () => {
+            // Fall back to polling if the stream is interrupted (e.g. by a proxy)
+            events.close();
+            poll();
+        };
+    });
+}
+
 function trimCustom(value) {
     if (value == null || value === undefined) {
         return '';
@@ -147,6 +417,24 @@ function renderRatingPicker(value) {
 }
 
 document.addEventListener('DOMContentLoaded', function() {
+    function refreshSyncFolder() {
+        loadSyncFolder().then((data) => {
+            if (!data.success) {
+                showAlert(`Error: ${data.error}`, 'error');
+            }
+        }).catch((e) => showAlert(`Network error: ${e.message}`, 'error'));
+    }
+
+    // Reload the sync folder listing when its filter or sort changes
+    let syncFilterTimer = null;
+    document.getElementById('syncFilter').addEventListener('input', () => {
+        clearTimeout(syncFilterTimer);
+        syncFilterTimer = setTimeout(() => {
+            refreshSyncFolder();
+        }, 300);
+    });
+    document.getElementById('syncSort').addEventListener('change', refreshSyncFolder);
+
     document.getElementById('searchBtn').addEventListener('click', async () => {
         const rating = parseInt(document.getElementById('rating').value);
         const limit = parseInt(document.getElementById('limit').value);
@@ -165,25 +453,23 @@ document.addEventListener('DOMContentLoaded', function() {
         document.getElementById('searchBtn').disabled = true;
         document.getElementById('searchBtn').innerHTML = '<span class="material-icons rotating">refresh</span> Searching...';
         try {
-            const response = await fetch('/api/query', {
-                method: 'POST',
-                headers: {
-                    'Content-Type': 'application/json',
-                },
-                body: JSON.stringify({
-                    rating,
-                    limit,
-                    exclude_genres: excludeGenres,
-                    dyn_ps_val: dynPsVal === 0 ? null : dynPsVal,
-                    album_limit: albumLimit === 0 ? null : albumLimit,
-                    order_by: orderBy,
-                    added_before: addedBeforeTimestamp
-                })
-            });
-            const data = await response.json();
+            queryRequest = {
+                rating,
+                limit,
+                exclude_genres: excludeGenres,
+                dyn_ps_val: dynPsVal === 0 ? null : dynPsVal,
+                album_limit: albumLimit === 0 ? null : albumLimit,
+                order_by: orderBy,
+                added_before: addedBeforeTimestamp
+            };
+            const data = await fetchSongsPage(null);
             if (data.success) {
                 viewMode = 'search';
+                document.getElementById('syncListControls').style.display = 'none';
                 songs = data.songs;
+                // Keep following pages in the same shuffle
+                queryRequest.seed = data.seed;
+                queryCursor = data.cursor;
                 selectedSongs.clear();
                 renderSongs();
                 // Scroll to top of results list
@@ -191,7 +477,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 if (songsContainer) {
                     songsContainer.scrollTop = 0;
                 }
-                showAlert(`Found ${data.count} songs!`, 'success');
+                showAlert(`Found ${data.count}${data.cursor ? '+' : ''} songs!`, 'success');
             } else {
                 showAlert(`Error: ${data.error}`, 'error');
             }
@@ -217,7 +503,9 @@ document.addEventListener('DOMContentLoaded', function() {
         updateStats();
     });
 
-    document.getElementById('selectAllBtn').addEventListener('click', () => {
+    document.getElementById('selectAllBtn').addEventListener('click', async () => {
+        // Select the whole result, not just the pages scrolled to so far
+        await loadAllPages();
         selectedSongs.clear();
         songs.forEach((_, index) => selectedSongs.add(index));
         renderSongs();
@@ -235,14 +523,9 @@ document.addEventListener('DOMContentLoaded', function() {
             try {
                 syncBtn.disabled = true;
                 syncBtn.innerHTML = '<span class="material-icons rotating">refresh</span> Loading...';
-                const res = await fetch('/api/sync/list');
-                const data = await res.json();
+                const data = await loadSyncFolder();
                 if (data.success) {
-                    viewMode = 'sync';
-                    songs = data.songs || [];
-                    selectedSongs.clear();
-                    renderSongs();
-                    showAlert(`Loaded ${data.count} files from sync folder`, 'success');
+                    showAlert(`${data.total} files (${formatBytes(data.total_bytes)}) in sync folder`, 'success');
                 } else {
                     showAlert(`Error: ${data.error}`, 'error');
                 }
@@ -272,40 +555,37 @@ document.addEventListener('DOMContentLoaded', function() {
             try {
                 // Get selected songs and delete them
                 const selectedIndices = Array.from(selectedSongs).sort((a, b) => b - a); // Sort descending to avoid index shifting issues
-                const selectedItems = selectedIndices.map(idx => songs[idx]);
-                
-                let successCount = 0;
-                let failCount = 0;
-
-                // Delete files one by one
-                for (const item of selectedItems) {
-                    try {
-                        const response = await fetch('/api/sync/delete', {
-                            method: 'POST',
-                            headers: { 'Content-Type': 'application/json' },
-                            body: JSON.stringify({ filename: item.filename })
-                        });
-                        const data = await response.json();
-                        if (data.success) {
-                            successCount++;
-                        } else {
-                            failCount++;
-                        }
-                    } catch (err) {
-                        failCount++;
-                    }
+                const response = await fetch('/api/sync/delete/batch', {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify({ filenames: selectedIndices.map(idx => songs[idx].filename) })
+                });
+                const data = await response.json();
+                if (!data.success) {
+                    showAlert(`Error: ${data.error}`, 'error');
+                    return;
                 }
+                const deleted = new Set(data.results.filter(r => r.success || r.error === 'File not found').map(r => r.filename));
+                const successCount = data.deleted;
+                const failCount = data.failed;
 
                 // Remove deleted items from songs array (in reverse order to maintain indices)
                 for (const idx of selectedIndices) {
-                    songs.splice(idx, 1);
+                    if (deleted.has(songs[idx].filename)) {
+                        songs.splice(idx, 1);
+                    }
+                }
+                // The following pages moved up by the number of deleted files
+                syncTotal -= successCount;
+                if (syncNextOffset !== null) {
+                    syncNextOffset -= successCount;
                 }
 
                 selectedSongs.clear();
                 renderSongs();
 
                 if (failCount === 0) {
-                    showAlert(`Successfully deleted ${successCount} file${successCount > 1 ? 's' : ''}`, 'success');
+                    showAlert(`Successfully deleted ${successCount} file${successCount > 1 ? 's' : ''} (${formatBytes(data.freed_bytes)} freed)`, 'success');
                 } else {
                     showAlert(`Deleted ${successCount} file${successCount > 1 ? 's' : ''}, ${failCount} failed`, 'error');
                 }
@@ -322,8 +602,11 @@ document.addEventListener('DOMContentLoaded', function() {
     function toggleEmbedCoversVisibility() {
         const exportFormat = document.querySelector('input[name="exportFormat"]:checked').value;
         const embedCoversCheckbox = document.getElementById('embedCovers');
-        const songDownsamplingCheckbox = document.getElementById('songDownsampling');
         const syncFolderCheckbox = document.getElementById('syncFolder');
+        const syncOnlyOptions = ['syncIncremental', 'syncPrune'].map(id => document.getElementById(id)).filter(el => el);
+        syncOnlyOptions.forEach(el => {
+            el.closest('.checkbox-option').style.display = exportFormat !== 'zip' && syncFolderCheckbox.checked ? 'flex' : 'none';
+        });
         
         if (exportFormat === 'zip') {
             // Hide embed covers option for ZIP format
@@ -334,10 +617,6 @@ document.addEventListener('DOMContentLoaded', function() {
             if (syncFolderCheckbox) {
                 syncFolderCheckbox.closest('.checkbox-option').style.display = 'none';
             }
-            // Hide song downsampling option for ZIP format
-            if (songDownsamplingCheckbox) {
-                songDownsamplingCheckbox.closest('.checkbox-option').style.display = 'none';
-            }
         } else {
             // Show embed covers option for folder format
             if (embedCoversCheckbox) {
@@ -347,10 +626,6 @@ document.addEventListener('DOMContentLoaded', function() {
             if (syncFolderCheckbox) {
                 syncFolderCheckbox.closest('.checkbox-option').style.display = 'flex';
             }
-            // Show song downsampling option
-            if (songDownsamplingCheckbox) {
-                songDownsamplingCheckbox.closest('.checkbox-option').style.display = 'flex';
-            }
         }
     }
 
@@ -358,6 +633,7 @@ document.addEventListener('DOMContentLoaded', function() {
     document.querySelectorAll('input[name="exportFormat"]').forEach(radio => {
         radio.addEventListener('change', toggleEmbedCoversVisibility);
     });
+    document.getElementById('syncFolder').addEventListener('change', toggleEmbedCoversVisibility);
 
     // Initial call to set correct visibility
     toggleEmbedCoversVisibility();
@@ -369,14 +645,16 @@ document.addEventListener('DOMContentLoaded', function() {
         }
         
         // Remove any existing download links
-        const existingDownloadLinks = document.querySelectorAll('#exportCard a[href^="/api/download/"]');
+        const existingDownloadLinks = document.querySelectorAll('#exportCard a[href^="/api/download/"], #exportCard a[href^="/api/export/"]');
         existingDownloadLinks.forEach(link => link.remove());
         
         const exportFormat = document.querySelector('input[name="exportFormat"]:checked').value;
         const embedCovers = document.getElementById('embedCovers').checked;
         const renameFiles = document.getElementById('renameFiles').checked;
-        const songDownsampling = document.getElementById('songDownsampling').checked;
+        const transcodeProfile = document.getElementById('transcodeProfile').value;
         const syncFolder = document.getElementById('syncFolder').checked;
+        const incremental = document.getElementById('syncIncremental').checked;
+        const prune = document.getElementById('syncPrune').checked;
         const selectedSongsList = Array.from(selectedSongs).map(index => songs[index]);
         document.getElementById('exportBtn').disabled = true;
         document.getElementById('exportBtn').innerHTML = '<span class="material-icons rotating">refresh</span> Exporting...';
@@ -391,19 +669,42 @@ document.addEventListener('DOMContentLoaded', function() {
                     format: exportFormat,
                     embed_covers: embedCovers,
                     rename_files: renameFiles,
-                    song_downsampling : songDownsampling,
-                    sync_folder: syncFolder
+                    transcode_profile: transcodeProfile,
+                    sync_folder: syncFolder,
+                    incremental,
+                    prune,
+                    stream: exportFormat === 'zip'
                 })
             });
             const data = await response.json();
-            if (data.success) {
-                showAlert(`Successfully exported ${selectedSongs.size} songs!`, 'success');
+            if (data.success && exportFormat === 'zip') {
+                // Streaming ZIP: the archive is built while it downloads
+                const downloadLink = document.createElement('a');
+                downloadLink.href = data.download_url;
+                downloadLink.className = 'btn btn-success';
+                downloadLink.innerHTML = '<span class="material-icons">download</span> Download Export';
+                downloadLink.style.marginTop = '10px';
+                document.getElementById('exportCard').appendChild(downloadLink);
+                downloadLink.click();
+                showAlert(`Download of ${selectedSongsList.length} songs started`, 'success');
+            } else if (data.success) {
+                const job = await followExportJob(data);
+                if (job.status === 'failed') {
+                    showAlert(`Export error: ${job.error}`, 'error');
+                } else if (job.sync_result) {
+                    const r = job.sync_result;
+                    showAlert(`Sync: ${r.add} added, ${r.update} updated, ${r.skip} unchanged, ${r.remove} removed` + (r.failed > 0 ? `, ${r.failed} failed` : ''), r.failed > 0 ? 'error' : 'success');
+                } else if (job.failed > 0) {
+                    showAlert(`Exported ${job.completed - job.failed} songs, ${job.failed} failed`, 'error');
+                } else {
+                    showAlert(`Successfully exported ${job.completed} songs!`, 'success');
+                }
                 
                 // Only create download link for ZIP format
-                if (exportFormat === 'zip') {
-                    const filename = data.export_path.split('/').pop();
+                if (job.status === 'done' && job.download_url) {
+                    const filename = job.download_url.split('/').pop();
                     const downloadLink = document.createElement('a');
-                    downloadLink.href = `/api/download/${filename}`;
+                    downloadLink.href = job.download_url;
                     downloadLink.download = filename;
                     downloadLink.className = 'btn btn-success';
                     downloadLink.innerHTML = '<span class="material-icons">download</span> Download Export';
@@ -416,6 +717,7 @@ document.addEventListener('DOMContentLoaded', function() {
         } catch (error) {
             showAlert(`Network error: ${error.message}`, 'error');
         } finally {
+            document.getElementById('exportProgress').style.display = 'none';
             document.getElementById('exportBtn').disabled = false;
             document.getElementById('exportBtn').innerHTML = '<span class="material-icons">download</span> Export Selected Songs';
         }
@@ -0,0 +1,462 @@
+import os
+import stat
+import sqlite3
+import threading
+from config import SYNC_DIR, SYNC_MANIFEST_DB
+from audio_utils import get_audio_metadata
+
+AUDIO_EXTENSIONS = {'.mp3', '.flac', '.wav', '.ogg', '.opus', '.aac'}
+
+
+def normalize_stem(filename):
+    """Format agnostic, case-insensitive key of a file name ("Artist - Title.flac" -> "artist - title")"""
+    return os.path.splitext(filename)[0].casefold()
+
+
+class SyncIndex:
+    """In-memory index of the audio files in the sync folder.
+
+    The folder is listed with a single os.scandir pass and only re-listed
+    when the directory's mtime changes (files added, removed or renamed),
+    so membership checks are set lookups instead of per-song stat() calls.
+    """
+
+    def __init__(self, sync_dir):
+        self.sync_dir = sync_dir
+        self._lock = threading.Lock()
+        self._mtime_ns = None
+        self._names = {}
+        self._stems = set()
+
+    def refresh(self):
+        """Re-list the sync folder if it changed; returns False if it doesn't exist"""
+        try:
+            mtime_ns = os.stat(self.sync_dir).st_mtime_ns
+        except OSError:
+            with self._lock:
+                self._mtime_ns = None
+                self._names = {}
+                self._stems = set()
+            return False
+        with self._lock:
+            if mtime_ns == self._mtime_ns:
+                return True
+            names = {}
+            with os.scandir(self.sync_dir) as entries:
+                for entry in entries:
+                    if os.path.splitext(entry.name)[1].lower() in AUDIO_EXTENSIONS and entry.is_file():
+                        names[entry.name.casefold()] = entry.name
+            self._names = names
+            self._stems = {normalize_stem(name) for name in names}
+            self._mtime_ns = mtime_ns
+        return True
+
+    def contains_file(self, filename):
+        return filename.casefold() in self._names
+
+    def files(self):
+        """Return the names of the audio files in the sync folder"""
+        return list(self._names.values())
+
+    def contains_stem(self, filename):
+        """True if a file with the same name in any audio format is in the sync folder"""
+        return normalize_stem(filename) in self._stems
+
+    def forget(self, filenames, mtime_before):
+        """Drop deleted files without re-listing the folder.
+
+        mtime_before is the folder's mtime before the files were deleted; if
+        the index was up to date then, it adopts the new mtime so the next
+        refresh doesn't re-list the folder.
+        """
+        with self._lock:
+            up_to_date = self._mtime_ns is not None and self._mtime_ns == mtime_before
+            names = dict(self._names)
+            for filename in filenames:
+                names.pop(filename.casefold(), None)
+            self._names = names
+            self._stems = {normalize_stem(name) for name in names}
+            if up_to_date:
+                try:
+                    self._mtime_ns = os.stat(self.sync_dir).st_mtime_ns
+                except OSError:
+                    self._mtime_ns = None
+
+
+class SyncManifest:
+    """Maps LMS track paths to the file they were exported to in the sync folder.
+
+    Written at export time so "already synced" checks don't have to guess
+    from file names. Each record also keeps the source's size and mtime and
+    the export options, so an incremental sync can skip unchanged songs.
+    Stored in a SQLite file next to the other caches and mirrored in memory;
+    PRAGMA data_version tells us when another process changed it.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._con = None
+        self._db_failed = False
+        self._data_version = None
+        self._entries = {}
+
+    def _db(self):
+        if self._con is None and not self._db_failed:
+            try:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                con = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+                con.execute("PRAGMA journal_mode=WAL")
+                con.execute("PRAGMA synchronous=NORMAL")
+                con.execute(
+                    "CREATE TABLE IF NOT EXISTS sync_manifest ("
+                    "source TEXT PRIMARY KEY, filename TEXT NOT NULL, "
+                    "size INTEGER, mtime_ns INTEGER, options TEXT)"
+                )
+                # Manifests written before incremental sync only had source and filename
+                columns = {row[1] for row in con.execute("PRAGMA table_info(sync_manifest)")}
+                for column, column_type in (('size', 'INTEGER'), ('mtime_ns', 'INTEGER'), ('options', 'TEXT')):
+                    if column not in columns:
+                        con.execute(f"ALTER TABLE sync_manifest ADD COLUMN {column} {column_type}")
+                con.commit()
+                self._con = con
+            except Exception as e:
+                print(f"Sync manifest disabled, cannot open {self.db_path}: {e}")
+                self._db_failed = True
+        return self._con
+
+    def _load(self):
+        """Reload the in-memory copy if the database changed (call with lock held)"""
+        con = self._db()
+        if con is None:
+            return
+        data_version = con.execute("PRAGMA data_version").fetchone()[0]
+        if data_version != self._data_version:
+            self._entries = {
+                source: {'filename': filename, 'size': size, 'mtime_ns': mtime_ns, 'options': options}
+                for source, filename, size, mtime_ns, options
+                in con.execute("SELECT source, filename, size, mtime_ns, options FROM sync_manifest")
+            }
+            self._data_version = data_version
+
+    def get(self, source):
+        """Return the manifest record of a track ({filename, size, mtime_ns, options}) or None"""
+        with self._lock:
+            try:
+                self._load()
+            except sqlite3.Error as e:
+                print(f"Error reading sync manifest: {e}")
+            return self._entries.get(str(source))
+
+    def record(self, source, filename, size=None, mtime_ns=None, options=None):
+        with self._lock:
+            self._entries[str(source)] = {'filename': filename, 'size': size, 'mtime_ns': mtime_ns, 'options': options}
+            con = self._db()
+            if con is None:
+                return
+            try:
+                con.execute(
+                    "INSERT OR REPLACE INTO sync_manifest (source, filename, size, mtime_ns, options) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (str(source), filename, size, mtime_ns, options),
+                )
+                con.commit()
+            except sqlite3.Error as e:
+                print(f"Error writing sync manifest: {e}")
+
+    def forget_files(self, filenames):
+        """Drop the records of files that were removed from the sync folder"""
+        removed = {filename.casefold() for filename in filenames}
+        with self._lock:
+            try:
+                self._load()
+            except sqlite3.Error as e:
+                print(f"Error reading sync manifest: {e}")
+            sources = [source for source, entry in self._entries.items() if entry['filename'].casefold() in removed]
+            for source in sources:
+                del self._entries[source]
+            con = self._db()
+            if con is None or not sources:
+                return
+            try:
+                con.executemany("DELETE FROM sync_manifest WHERE source = ?", [(source,) for source in sources])
+                con.commit()
+            except sqlite3.Error as e:
+                print(f"Error writing sync manifest: {e}")
+
+
+# Orderings of the sync folder listing (prefix with "-" for descending)
+LISTING_SORTS = {
+    'name': ['filename COLLATE NOCASE'],
+    'artist': ['artist COLLATE NOCASE', 'album COLLATE NOCASE', 'title COLLATE NOCASE'],
+    'album': ['album COLLATE NOCASE', 'title COLLATE NOCASE'],
+    'title': ['title COLLATE NOCASE'],
+    'size': ['size'],
+    'modified': ['mtime_ns'],
+}
+
+# Columns matched by the listing's text filter
+LISTING_SEARCH_COLUMNS = ('filename', 'title', 'artist', 'album', 'genre')
+
+
+class SyncListing:
+    """Persisted tag index of the audio files in the sync folder, for browsing it.
+
+    A refresh lists the folder with os.scandir only if the folder's mtime
+    changed (or when forced, after an export rewrote files in place) and
+    only parses the tags of files that are new or whose size/mtime changed,
+    so paging through the sync tab doesn't touch every file. Sorting,
+    filtering, paging and the totals are then done in SQL. Kept in the same SQLite file as the manifest; if
+    that can't be opened the index lives in memory.
+    """
+
+    def __init__(self, sync_dir, db_path):
+        self.sync_dir = sync_dir
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._con = None
+        # Folder mtime the index was last brought in line with (None: never)
+        self._mtime_ns = None
+
+    def _db(self):
+        if self._con is None:
+            try:
+                os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+                con = sqlite3.connect(self.db_path, timeout=5, check_same_thread=False)
+                con.execute("PRAGMA journal_mode=WAL")
+                con.execute("PRAGMA synchronous=NORMAL")
+            except Exception as e:
+                print(f"Sync listing index kept in memory, cannot open {self.db_path}: {e}")
+                con = sqlite3.connect(':memory:', check_same_thread=False)
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS sync_files ("
+                "filename TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+                "title TEXT, artist TEXT, album TEXT, genre TEXT, year INTEGER)"
+            )
+            con.commit()
+            self._con = con
+        return self._con
+
+    def refresh(self, force=False):
+        """Bring the index in line with the folder if it changed, re-reading the tags of changed files only"""
+        try:
+            mtime_ns = os.stat(self.sync_dir).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        with self._lock:
+            if not force and mtime_ns is not None and mtime_ns == self._mtime_ns:
+                return
+            con = self._db()
+            known = {filename: (size, mtime_ns)
+                     for filename, size, mtime_ns in con.execute("SELECT filename, size, mtime_ns FROM sync_files")}
+            changed = []
+            seen = set()
+            try:
+                with os.scandir(self.sync_dir) as entries:
+                    for entry in entries:
+                        if os.path.splitext(entry.name)[1].lower() not in AUDIO_EXTENSIONS or not entry.is_file():
+                            continue
+                        st = entry.stat()
+                        seen.add(entry.name)
+                        if known.get(entry.name) != (st.st_size, st.st_mtime_ns):
+                            changed.append((entry, st))
+            except FileNotFoundError:
+                pass
+
+            rows = []
+            for entry, st in changed:
+                metadata = get_audio_metadata(entry.path) or {}
+                rows.append((entry.name, st.st_size, st.st_mtime_ns, metadata.get('title') or '',
+                             metadata.get('artist') or '', metadata.get('album') or '',
+                             metadata.get('genre') or '', metadata.get('year')))
+            removed = [(filename,) for filename in known if filename not in seen]
+            if rows or removed:
+                con.executemany("INSERT OR REPLACE INTO sync_files VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                con.executemany("DELETE FROM sync_files WHERE filename = ?", removed)
+                con.commit()
+            self._mtime_ns = mtime_ns
+
+    def older_than(self, mtime_ns):
+        """Return the names of the indexed files last modified before mtime_ns"""
+        with self._lock:
+            return [filename for filename, in self._db().execute(
+                "SELECT filename FROM sync_files WHERE mtime_ns < ? ORDER BY filename", (mtime_ns,))]
+
+    def forget(self, filenames, mtime_before):
+        """Drop the rows of deleted files (adopting the folder's new mtime like SyncIndex.forget)"""
+        with self._lock:
+            con = self._db()
+            con.executemany("DELETE FROM sync_files WHERE filename = ?", [(filename,) for filename in filenames])
+            con.commit()
+            if self._mtime_ns is not None and self._mtime_ns == mtime_before:
+                try:
+                    self._mtime_ns = os.stat(self.sync_dir).st_mtime_ns
+                except OSError:
+                    self._mtime_ns = None
+
+    def page(self, text='', sort='name', offset=0, limit=100):
+        """Return (files, total, total_bytes) for one page of the files matching text.
+
+        Every whitespace separated word of text has to appear in the file
+        name or one of the tags. total and total_bytes cover all matching
+        files. Raises ValueError for an unknown sort.
+        """
+        descending = sort.startswith('-')
+        columns = LISTING_SORTS.get(sort.lstrip('-'))
+        if columns is None:
+            raise ValueError(f"Unknown sort: {sort}")
+        direction = 'DESC' if descending else 'ASC'
+        order = ', '.join(f"{column} {direction}" for column in columns + ['filename'])
+
+        conditions = []
+        params = []
+        for word in text.split():
+            pattern = '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            conditions.append('(' + ' OR '.join(f"{column} LIKE ? ESCAPE '\\'" for column in LISTING_SEARCH_COLUMNS) + ')')
+            params.extend([pattern] * len(LISTING_SEARCH_COLUMNS))
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        with self._lock:
+            con = self._db()
+            total, total_bytes = con.execute(
+                f"SELECT COUNT(*), IFNULL(SUM(size), 0) FROM sync_files {where}", params
+            ).fetchone()
+            cursor = con.execute(
+                f"SELECT filename, size, mtime_ns, title, artist, album, genre, year FROM sync_files {where} "
+                f"ORDER BY {order} LIMIT ? OFFSET ?", params + [limit, offset]
+            )
+            columns = [d[0] for d in cursor.description]
+            files = [dict(zip(columns, row)) for row in cursor]
+        return files, total, total_bytes
+
+
+_index = SyncIndex(SYNC_DIR)
+_manifest = SyncManifest(SYNC_MANIFEST_DB)
+_listing = SyncListing(SYNC_DIR, SYNC_MANIFEST_DB)
+
+
+def record_export(source, filename, size=None, mtime_ns=None, options=None):
+    """Remember that source (with the given size/mtime, exported with options) went to filename"""
+    _manifest.record(source, filename, size, mtime_ns, options)
+
+
+def manifest_record(source):
+    """Return the manifest record of a source track or None"""
+    return _manifest.get(source)
+
+
+def forget_files(filenames):
+    """Forget manifest records pointing to the given sync folder files"""
+    _manifest.forget_files(filenames)
+
+
+def list_files(text='', sort='name', offset=0, limit=100):
+    """Return (files, total, total_bytes) for a page of the sync folder listing (see SyncListing.page)"""
+    _listing.refresh()
+    return _listing.page(text, sort, offset, limit)
+
+
+def refresh_listing():
+    """Re-check every file of the sync folder listing (after an export, which may rewrite files in place)"""
+    _listing.refresh(force=True)
+
+
+def files_older_than(timestamp):
+    """Return the names of the sync folder files last modified before a unix timestamp"""
+    _listing.refresh()
+    return _listing.older_than(int(timestamp * 1_000_000_000))
+
+
+def files_not_matching(songs, guess_filenames):
+    """Return the names of the sync folder files that none of songs maps to.
+
+    The counterpart of mark_synced: a file is kept if the manifest says one
+    of the songs was exported to it or if its name (format agnostic)
+    matches one of guess_filenames(song).
+    """
+    keep = set()
+    for song in songs:
+        record = _manifest.get(song['url'])
+        if record is not None:
+            keep.add(normalize_stem(record['filename']))
+        keep.update(normalize_stem(name) for name in guess_filenames(song))
+    return sorted(name for name in current_files() if normalize_stem(name) not in keep)
+
+
+def delete_files(filenames, dry_run=False):
+    """Delete files from the sync folder in one pass.
+
+    Only plain file names of regular files directly inside the sync folder
+    are accepted (no paths, no symlinks). The folder indexes and the
+    manifest are updated in place. With dry_run nothing is deleted.
+    Returns (results, freed_bytes) with one {filename, success, error,
+    bytes} dict per distinct file name.
+    """
+    results = []
+    removed = []
+    freed_bytes = 0
+    try:
+        mtime_before = os.stat(SYNC_DIR).st_mtime_ns
+    except OSError:
+        mtime_before = None
+
+    for filename in dict.fromkeys(filenames):
+        result = {'filename': filename, 'success': False, 'error': None, 'bytes': 0}
+        results.append(result)
+        if not isinstance(filename, str) or filename in ('', '.', '..') or os.path.basename(filename) != filename:
+            result['error'] = 'Invalid path'
+            continue
+        path = os.path.join(SYNC_DIR, filename)
+        try:
+            st = os.lstat(path)
+            if not stat.S_ISREG(st.st_mode):
+                result['error'] = 'Invalid path'
+                continue
+            if not dry_run:
+                os.remove(path)
+        except FileNotFoundError:
+            result['error'] = 'File not found'
+            continue
+        except OSError as e:
+            result['error'] = str(e)
+            continue
+        result['success'] = True
+        result['bytes'] = st.st_size
+        freed_bytes += st.st_size
+        removed.append(filename)
+
+    if removed and not dry_run:
+        _index.forget(removed, mtime_before)
+        _listing.forget(removed, mtime_before)
+        _manifest.forget_files(removed)
+    return results, freed_bytes
+
+
+def current_files():
+    """Return the names of the audio files currently in the sync folder"""
+    _index.refresh()
+    return _index.files()
+
+
+def mark_synced(songs, guess_filenames):
+    """Set 'exists_in_sync' on each song.
+
+    Songs recorded in the manifest are matched exactly. Others fall back to
+    name matching against guess_filenames(song), which returns candidate
+    file names (format agnostic).
+    """
+    if not _index.refresh():
+        for song in songs:
+            song['exists_in_sync'] = False
+        return
+
+    for song in songs:
+        song['exists_in_sync'] = False
+        try:
+            record = _manifest.get(song['url'])
+            if record is not None and _index.contains_file(record['filename']):
+                song['exists_in_sync'] = True
+                continue
+            song['exists_in_sync'] = any(_index.contains_stem(name) for name in guess_filenames(song))
+        except Exception as e:
+            print(f"[ERROR] Checking file existence: {e}")
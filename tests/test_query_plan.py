@@ -0,0 +1,57 @@
+"""EXPLAIN the song queries against a synthetic 200k-track LMS library.
+
+Grouping per album (album_limit) or per track (genres) must walk an index:
+a temporary B-tree for GROUP BY means sorting the whole library per query.
+"""
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+
+import database
+from synthetic_library import generate_databases
+
+TRACKS = 200000
+
+
+@pytest.fixture(scope='module', params=[True, False], ids=['alternativeplaycount', 'plain'])
+def library(request, tmp_path_factory):
+    """Connection to a generated library, with and without the Alternative Play Count plugin table"""
+    directory = tmp_path_factory.mktemp('lms')
+    generate_databases(str(directory / 'lms'), str(directory / 'music'), tracks=TRACKS,
+                       alternativeplaycount=request.param)
+    patch = pytest.MonkeyPatch()
+    patch.setattr(database, 'PERSIST_DB', str(directory / 'lms' / 'prefs' / 'persist.db'))
+    patch.setattr(database, 'LIBRARY_DB', str(directory / 'lms' / 'cache' / 'library.db'))
+    con = database.get_db_connection()
+    yield con, request.param
+    con.close()
+    patch.undo()
+
+
+def query_plan(con, query, params):
+    return [row[-1] for row in con.execute("EXPLAIN QUERY PLAN " + query, params)]
+
+
+@pytest.mark.parametrize('order_by', ['added', 'last_played', 'random'])
+@pytest.mark.parametrize('album_limit', [None, 2])
+def test_song_query_groups_without_temp_btree(library, order_by, album_limit):
+    con, has_alternativeplaycount = library
+    query, params = database.build_song_query(has_alternativeplaycount, 40, 100, ['Christmas', 'Score'], None,
+                                              album_limit, order_by)
+    plan = query_plan(con, query, params)
+    assert not [line for line in plan if 'USE TEMP B-TREE FOR GROUP BY' in line], plan
+
+
+def test_primary_genres_use_track_index(library):
+    con, _ = library
+    track_ids = [1, 2, 3]
+    plan = query_plan(con, "SELECT genre_track.track, MIN(genres.name) FROM genre_track "
+                           "JOIN genres ON genre_track.genre = genres.id "
+                           "WHERE genre_track.track IN (?, ?, ?) GROUP BY genre_track.track", track_ids)
+    assert not [line for line in plan
+                if 'USE TEMP B-TREE FOR GROUP BY' in line or line.startswith('SCAN genre_track')], plan
@@ -0,0 +1,193 @@
+from array import array
+from bisect import bisect_left, bisect_right
+
+# Stands for NULL in the integer columns
+NULL = -(2 ** 63)
+
+
+def _nullable(value):
+    return NULL if value is None else int(value)
+
+
+def _value(value):
+    return None if value == NULL else value
+
+
+def _ifnull(value):
+    return 0 if value == NULL else value
+
+
+# Comparable form of each ordering's sort key (ascending = result order), mirroring
+# database.SORT_KEYS: track_id breaks ties, so the order is total.
+def _added_rank(added, track_id):
+    return (-added, -track_id)
+
+
+def _last_played_rank(never_played, last_played, track_id):
+    return (never_played, -last_played, -track_id)
+
+
+_RANKS = {'added': _added_rank, 'last_played': _last_played_rank}
+
+
+class TrackSnapshot:
+    """Columnar in-memory copy of the LMS tracks a search can return.
+
+    Holds one entry per qualifying track (audio, not a cue sheet part, with
+    at least one genre), in track id order: integers in typed arrays,
+    strings in lists with repeated values shared. Each ordering also has
+    its index array presorted, so a page is found by walking that order
+    from the cursor position and filtering until it is full, without
+    touching the database. The snapshot is immutable; a rescan builds a
+    new one (see database.refresh_query_state).
+    """
+
+    def __init__(self, generation, has_alternativeplaycount, rows, genre_rows):
+        """rows are (SONG_COLUMNS..., album_id, timestamp) ordered by track_id; genre_rows are (track_id, name)"""
+        self.generation = generation
+        self.has_alternativeplaycount = has_alternativeplaycount
+        self.track_id = array('q')
+        self.album_id = array('q')
+        self.rating = array('q')
+        self.added = array('q')
+        self.last_played = array('q')
+        self.year = array('q')
+        self.timestamp = array('q')
+        self.url = []
+        self.title = []
+        self.artist = []
+        self.album = []
+        # Not necessarily an integer, and mostly NULL
+        self.dyn_ps_val = []
+
+        shared = {}
+        for track_id, url, title, artist, rating, added, last_played, year, album, dyn_ps_val, album_id, timestamp in rows:
+            self.track_id.append(track_id)
+            self.url.append(url)
+            self.title.append(title)
+            self.artist.append(shared.setdefault(artist, artist))
+            self.album.append(shared.setdefault(album, album))
+            self.rating.append(_nullable(rating))
+            self.added.append(_nullable(added))
+            self.last_played.append(_nullable(last_played))
+            self.year.append(_nullable(year))
+            self.dyn_ps_val.append(dyn_ps_val)
+            self.album_id.append(album_id)
+            self.timestamp.append(_nullable(timestamp))
+
+        # Genre ids per track (for exclusion) and the alphabetically first name (for display)
+        self.genre_ids = {}
+        self.genres = [() for _ in self.track_id]
+        self.primary_genre = [None] * len(self.track_id)
+        for track_id, name in genre_rows:
+            i = self._index(track_id)
+            if i is None:
+                continue
+            genre_id = self.genre_ids.setdefault(name, len(self.genre_ids))
+            self.genres[i] += (genre_id,)
+            if self.primary_genre[i] is None or name < self.primary_genre[i]:
+                self.primary_genre[i] = shared.setdefault(name, name)
+
+        self.orders = {
+            order_by: array('l', sorted(range(len(self.track_id)), key=lambda i: self._rank(order_by, i)))
+            for order_by in _RANKS
+        }
+
+    def __len__(self):
+        return len(self.track_id)
+
+    def _index(self, track_id):
+        i = bisect_left(self.track_id, track_id)
+        if i < len(self.track_id) and self.track_id[i] == track_id:
+            return i
+        return None
+
+    def sort_key(self, order_by, i):
+        """Return the sort key values of entry i as the SQL query selects them (used in cursors)"""
+        if order_by == 'last_played':
+            last_played = _ifnull(self.last_played[i])
+            return [1 if last_played == 0 else 0, last_played, self.track_id[i]]
+        return [_ifnull(self.added[i]), self.track_id[i]]
+
+    def _rank(self, order_by, i):
+        return _RANKS[order_by](*self.sort_key(order_by, i))
+
+    def _matcher(self, rating=40, exclude_genres=None, dyn_ps_val=None, added_before=None):
+        """Return a predicate on entry indexes implementing database._filter_conditions"""
+        excluded = {self.genre_ids[name] for name in exclude_genres or [] if name in self.genre_ids}
+        check_dyn = dyn_ps_val is not None and dyn_ps_val != 0 and self.has_alternativeplaycount
+
+        def matches(i):
+            if _ifnull(self.rating[i]) < rating:
+                return False
+            if excluded and not excluded.isdisjoint(self.genres[i]):
+                return False
+            if check_dyn and (self.dyn_ps_val[i] or 0) <= dyn_ps_val:
+                return False
+            if added_before is not None and (self.timestamp[i] == NULL or self.timestamp[i] >= added_before):
+                return False
+            return True
+        return matches
+
+    def row(self, i):
+        """Return entry i as a song row (see database.SONG_COLUMNS)"""
+        return (self.track_id[i], self.url[i], self.title[i], self.artist[i], _value(self.rating[i]),
+                _value(self.added[i]), _value(self.last_played[i]), _value(self.year[i]), self.album[i],
+                self.dyn_ps_val[i])
+
+    def page(self, rating=40, page_size=100, exclude_genres=None, dyn_ps_val=None, album_limit=None,
+             order_by='added', added_before=None, after=None):
+        """Return up to page_size song rows (plus sort key values) sorting after the key values in after.
+
+        Same result as database.build_song_query for the added and
+        last_played orderings, album_limit included.
+        """
+        if order_by not in self.orders:
+            order_by = 'added'
+        order = self.orders[order_by]
+        matches = self._matcher(rating, exclude_genres, dyn_ps_val, added_before)
+        rank = _RANKS[order_by]
+        start = 0
+        if after is not None:
+            start = bisect_right(order, rank(*after), key=lambda i: self._rank(order_by, i))
+
+        rows = []
+        if album_limit is not None and album_limit > 0:
+            # Album ranks count every matching track, including those before the cursor
+            per_album = {}
+            for position, i in enumerate(order):
+                if not matches(i):
+                    continue
+                album_rank = per_album.get(self.album_id[i], 0) + 1
+                per_album[self.album_id[i]] = album_rank
+                if position >= start and album_rank <= album_limit:
+                    rows.append(self.row(i) + tuple(self.sort_key(order_by, i)))
+                    if len(rows) >= page_size:
+                        break
+        else:
+            for position in range(start, len(order)):
+                i = order[position]
+                if matches(i):
+                    rows.append(self.row(i) + tuple(self.sort_key(order_by, i)))
+                    if len(rows) >= page_size:
+                        break
+        return rows
+
+    def candidates(self, rating=40, exclude_genres=None, dyn_ps_val=None, added_before=None):
+        """Return the (track id, album id) of every matching track, in track id order"""
+        matches = self._matcher(rating, exclude_genres, dyn_ps_val, added_before)
+        return [(self.track_id[i], self.album_id[i]) for i in range(len(self.track_id)) if matches(i)]
+
+    def hydrate(self, track_ids):
+        """Return the song rows of track_ids, in the given order"""
+        indexes = (self._index(track_id) for track_id in track_ids)
+        return [self.row(i) for i in indexes if i is not None]
+
+    def primary_genres(self, track_ids):
+        """Return {track_id: genre name} like database._primary_genres"""
+        genres = {}
+        for track_id in track_ids:
+            i = self._index(track_id)
+            if i is not None and self.primary_genre[i] is not None:
+                genres[track_id] = self.primary_genre[i]
+        return genres
@@ -0,0 +1,254 @@
+import os
+import time
+import fcntl
+import hashlib
+import tempfile
+import subprocess
+import threading
+from contextlib import contextmanager
+from mutagen import File as MutagenFile
+from mutagen.flac import FLAC
+from config import PUID, PGID, MAX_ENCODERS, ENCODER_SLOTS_DIR, TRANSCODE_CACHE_DIR, TRANSCODE_CACHE_MAX_BYTES, TRANSCODE_PIPE_BYTES
+from audio_utils import copy_meatdata, find_cover_file, read_source_tags
+from disk_cache import DiskCache
+import metrics
+
+# Output formats FLAC files can be converted to. The encoder reads the WAV
+# stream of "flac -d" on stdin; the target path is appended to the command.
+PROFILES = {
+    'original': {
+        'label': 'Keep original files',
+        'extension': None,
+        'command': None,
+    },
+    'mp3_v0': {
+        'label': 'MP3 V0 (VBR, ~245 kbps)',
+        'extension': '.mp3',
+        'command': ["lame", "-S", "-V", "0", "--vbr-new", "--add-id3v2", "--ignore-tag-errors", "-"],
+    },
+    'mp3_v2': {
+        'label': 'MP3 V2 (VBR, ~190 kbps)',
+        'extension': '.mp3',
+        'command': ["lame", "-S", "-V", "2", "--vbr-new", "--add-id3v2", "--ignore-tag-errors", "-"],
+    },
+    'mp3_320': {
+        'label': 'MP3 320 kbps (CBR)',
+        'extension': '.mp3',
+        'command': ["lame", "-S", "-b", "320", "--add-id3v2", "--ignore-tag-errors", "-"],
+    },
+    'opus_128': {
+        'label': 'Opus 128 kbps',
+        'extension': '.opus',
+        'command': ["opusenc", "--quiet", "--bitrate", "128", "-"],
+    },
+    'opus_96': {
+        'label': 'Opus 96 kbps',
+        'extension': '.opus',
+        'command': ["opusenc", "--quiet", "--bitrate", "96", "-"],
+    },
+}
+
+# Largest accepted difference (seconds) between the lengths of a source and its conversion
+DURATION_TOLERANCE = 1.0
+
+# What the old "Convert FLAC to MP3" switch did
+DOWNSAMPLING_PROFILE = 'mp3_v0'
+
+# Seconds between attempts to get an encoder slot while all are taken
+SLOT_POLL_SECONDS = 0.05
+
+
+class EncoderSlots:
+    """Bounds the number of concurrent decoder|encoder pipelines across all web workers.
+
+    Each slot is a lock file in directory, held with flock while a pipeline
+    runs (the OS releases it if the process dies); waiting callers poll.
+    A semaphore keeps this process's own threads from polling needlessly.
+    If the directory can't be used, only the per-process bound applies.
+    """
+
+    def __init__(self, directory, count):
+        self.directory = directory
+        self.count = max(1, count)
+        self._local = threading.BoundedSemaphore(self.count)
+
+    @contextmanager
+    def slot(self):
+        with self._local:
+            lock_file = self._acquire()
+            try:
+                yield
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+
+    def _acquire(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+        except OSError as e:
+            print(f"Encoder slots limited to this process, cannot use {self.directory}: {e}")
+            return None
+        while True:
+            for i in range(self.count):
+                try:
+                    lock_file = open(os.path.join(self.directory, f"{i}.lock"), 'a')
+                except OSError as e:
+                    print(f"Encoder slots limited to this process, cannot use {self.directory}: {e}")
+                    return None
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return lock_file
+                except OSError:
+                    lock_file.close()
+            time.sleep(SLOT_POLL_SECONDS)
+
+
+_encoder_slots = EncoderSlots(ENCODER_SLOTS_DIR, MAX_ENCODERS)
+
+# Tagged outputs of converted FLACs, shared by every export (and hardlinked into export folders)
+_cache = DiskCache(TRANSCODE_CACHE_DIR, TRANSCODE_CACHE_MAX_BYTES, '',
+                   owner=(PUID, PGID) if PUID is not None and PGID is not None else None)
+
+
+def resolve_profile(transcode_profile=None, song_downsampling=False):
+    """Return the profile name for an export request; raises ValueError for unknown profiles"""
+    if transcode_profile is None:
+        return DOWNSAMPLING_PROFILE if song_downsampling else 'original'
+    if transcode_profile not in PROFILES:
+        raise ValueError(f"Unknown transcode profile: {transcode_profile}")
+    return transcode_profile
+
+
+def converts(source, transcode_profile):
+    """True if source is converted by the profile (only FLAC files are, lossy files are kept as is)"""
+    return PROFILES[transcode_profile]['command'] is not None and source.suffix.lower() == ".flac"
+
+
+def target_filename(source, filename, transcode_profile):
+    """Return filename with the extension of the profile's output format if source is converted"""
+    if not converts(source, transcode_profile):
+        return filename
+    base, _ = os.path.splitext(filename)
+    return base + PROFILES[transcode_profile]['extension']
+
+
+def _pipe():
+    """Return (read_fd, write_fd) of a pipe, enlarged so the decoder isn't stalled by a slower encoder"""
+    read_fd, write_fd = os.pipe()
+    try:
+        fcntl.fcntl(write_fd, fcntl.F_SETPIPE_SZ, TRANSCODE_PIPE_BYTES)
+    except (AttributeError, OSError):
+        pass  # not Linux, or above /proc/sys/fs/pipe-max-size: keep the default size
+    return read_fd, write_fd
+
+
+def _stderr_tail(stream, limit=500):
+    stream.seek(0)
+    return stream.read().decode('utf-8', 'replace').strip()[-limit:]
+
+
+def transcode(source, target_path, transcode_profile, expected_length=None):
+    """Convert a FLAC file with the profile's encoder through a flac | encoder pipe.
+
+    Both exit codes are checked and the output must be as long as the source,
+    so a decode error can't leave a truncated file behind (expected_length
+    saves reading the source's length again if the caller has it). Raises
+    RuntimeError on failure; returns the seconds until the decoder and the
+    encoder finished as {'decode': ..., 'encode': ...}.
+    """
+    command = [*PROFILES[transcode_profile]['command'], str(target_path)]
+    with _encoder_slots.slot(), tempfile.TemporaryFile() as decode_err, tempfile.TemporaryFile() as encode_err:
+        read_fd, write_fd = _pipe()
+        start = time.perf_counter()
+        try:
+            # Start FLAC decoder (write PCM to the pipe)
+            flac_proc = subprocess.Popen(["flac", "-dcs", "--", str(source)],
+                                         stdout=write_fd, stderr=decode_err)
+            try:
+                # Start the encoder (read PCM from the pipe)
+                encoder_proc = subprocess.Popen(command, stdin=read_fd, stdout=subprocess.DEVNULL, stderr=encode_err)
+            except BaseException:
+                flac_proc.kill()
+                flac_proc.wait()
+                raise
+        finally:
+            # Only the child processes keep the pipe open, so each sees EOF/EPIPE when the other exits
+            os.close(read_fd)
+            os.close(write_fd)
+
+        flac_proc.wait()
+        decode_seconds = time.perf_counter() - start
+        encoder_proc.wait()
+        encode_seconds = time.perf_counter() - start
+
+        # A failing encoder kills the decoder with SIGPIPE, so report the encoder first
+        if encoder_proc.returncode != 0:
+            raise RuntimeError(f"{command[0]} failed ({encoder_proc.returncode}): {_stderr_tail(encode_err)}")
+        if flac_proc.returncode != 0:
+            raise RuntimeError(f"flac failed ({flac_proc.returncode}): {_stderr_tail(decode_err)}")
+    metrics.ENCODER_SECONDS.observe(decode_seconds, profile=transcode_profile, process='flac')
+    metrics.ENCODER_SECONDS.observe(encode_seconds, profile=transcode_profile, process=command[0])
+
+    expected = FLAC(source).info.length if expected_length is None else expected_length
+    actual = _duration(target_path)
+    if actual is None or abs(actual - expected) > DURATION_TOLERANCE:
+        raise RuntimeError(f"Transcoded file is {actual or 0:.1f}s long, expected {expected:.1f}s")
+    return {'decode': round(decode_seconds, 3), 'encode': round(encode_seconds, 3)}
+
+
+def _duration(path):
+    try:
+        return MutagenFile(path).info.length
+    except Exception:
+        return None
+
+
+def cache_key(source, transcode_profile, cover_file=None):
+    """Key of a converted file: changes with the source file, the cover file it embeds and the encoder settings"""
+    st = os.stat(source)
+    profile = PROFILES[transcode_profile]
+    parts = [os.path.abspath(str(source)), str(st.st_mtime_ns), str(st.st_size), " ".join(profile['command'])]
+    if cover_file is not None:
+        cover_st = os.stat(cover_file)
+        parts += [os.path.abspath(str(cover_file)), str(cover_st.st_mtime_ns), str(cover_st.st_size)]
+    raw = "|".join(parts)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest() + profile['extension']
+
+
+def transcoded_path(source, transcode_profile, embed_covers=False):
+    """Return the path of the tagged conversion of a FLAC file in the transcode cache, encoding it on a miss.
+
+    The cached file is complete: with embed_covers, the album's cover file is
+    embedded if the FLAC has no pictures of its own, so exports never have to
+    modify it. Returns (path, timings) where timings holds the seconds spent
+    decoding, encoding and tagging, or {'cached': True} if nothing had to be done.
+    """
+    cover_file = find_cover_file(source.parent) if embed_covers else None
+    key = cache_key(source, transcode_profile, cover_file)
+    cached = _cache.lookup(key)
+    if cached:
+        return cached, {'cached': True}
+
+    with _cache.key_lock(key):
+        # Another export may have encoded it while we were waiting
+        cached = _cache.lookup(key)
+        if cached:
+            return cached, {'cached': True}
+        tmp_path = _cache.temp_path(key)
+        try:
+            # The source is opened once, for its length (checked after encoding) and its tags
+            start = time.perf_counter()
+            source_tags = read_source_tags(source)
+            read_seconds = time.perf_counter() - start
+            timings = transcode(source, tmp_path, transcode_profile, expected_length=source_tags[2])
+            start = time.perf_counter()
+            copy_meatdata(source, tmp_path, cover_file, source_tags)
+            timings['tagging'] = round(read_seconds + time.perf_counter() - start, 3)
+            timings['cached'] = False
+            return _cache.commit(key, tmp_path), timings
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise